@@ -1,38 +1,131 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Response, request, jsonify, render_template, stream_with_context
 from flask_cors import CORS
-import sqlite3
+import atexit
+import os
+import queue
 import numpy as np
-import openvino as ov
 from datetime import datetime
+import hashlib
+import hmac
 import math
+import time
+from inference import ModelRegistry
+from features import FeatureAudit, samples_to_array, extract_features_batch
+import json
+import wire_format
+from trips import TripDetector, iter_lines
+from route_cache import RouteCache
+from metrics import PROMETHEUS_CONTENT_TYPE, Registry, SamplingProfiler
+from nearby import (NearbyIndex, DEFAULT_NEARBY_RADIUS_M, MAX_NEARBY_RADIUS_M, DEFAULT_NEARBY_K, MAX_NEARBY_K,
+                    DEFAULT_CONE_DEG)
+from storage import (PotholeWriter, RetentionJob, connections_opened, get_connection, init_db, now_ms,
+                     query_points, query_clusters, query_bbox_version, query_changes, current_cursor,
+                     query_heatmap, heatmap_level, CursorExpired, INSERT_POTHOLE, DAY_MS, RETENTION_DAYS, HEATMAP_CELL_DEG)
 
 app = Flask(__name__)
 CORS(app)
 
-# Initialize OpenVINO
-core = ov.Core()
-model = core.read_model("pothole_ov_model.xml")
-compiled_model = core.compile_model(model, "CPU")
+# The model is loaded on the first detection, not at import, so reloads and
+# idle workers skip compilation; POTHOLE_BACKEND=openvino|numpy|auto picks the
+# backend and POST /api/model swaps in a new IR while serving
+models = ModelRegistry(os.environ.get('POTHOLE_MODEL', "pothole_ov_model.xml"))
+atexit.register(models.close)
 
-# Create database
-def init_db():
-    conn = sqlite3.connect('potholes.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS potholes (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        latitude REAL NOT NULL,
-        longitude REAL NOT NULL,
-        severity REAL NOT NULL,
-        timestamp TEXT NOT NULL
-    )
-    ''')
-    conn.commit()
-    conn.close()
+# /api/model and /api/profiler only answer requests carrying POTHOLE_ADMIN_TOKEN
+# as a bearer token, and are off when no token is configured; /api/model only
+# loads IRs from under POTHOLE_MODELS_DIR
+MODELS_DIR = os.path.realpath(os.environ.get('POTHOLE_MODELS_DIR', "models"))
+ADMIN_TOKEN = os.environ.get('POTHOLE_ADMIN_TOKEN', "")
+
+# Bounding-box results behind /api/route and /api/route/corridor; committed
+# detections invalidate the entries around them, a retention run all of them
+route_cache = RouteCache()
+
+# In-memory copy of every pothole for /api/nearby; built at startup (or on the
+# first query) and brought up to date from the change cursor after each commit
+nearby_index = NearbyIndex()
+
+def on_commit(rows, seconds):
+    stage_seconds.labels('writer', 'commit').observe(seconds)
+    writer_rows.inc(len(rows))
+    with stage('writer', 'route_cache_invalidate'):
+        route_cache.invalidate(rows)
+    with stage('writer', 'nearby_refresh'):
+        nearby_index.refresh()
+
+def on_retention(report):
+    route_cache.clear()
+    nearby_index.refresh()
+
+# Detections are committed in batches by a single background writer;
+# flush whatever is still queued when the process exits
+writer = PotholeWriter(on_commit=on_commit)
+atexit.register(writer.close)
+
+# Potholes not seen for RETENTION_DAYS are rolled up by month in the background
+retention = RetentionJob(on_commit=on_retention) if RETENTION_DAYS > 0 else None
+if retention is not None:
+    atexit.register(retention.close)
+
+# Device feature vectors checked against the server's own extraction
+feature_audit = FeatureAudit()
+
+# In-memory metrics served as Prometheus text on /metrics. Handlers time their
+# stages with `with stage(handler, name):`, which costs about a microsecond.
+metrics = Registry()
+stage_seconds = metrics.histogram('pothole_stage_seconds', "Time spent in each stage of a handler",
+                                  ['handler', 'stage'])
+request_seconds = metrics.histogram('pothole_http_request_seconds', "Request handling time until the "
+                                    "response is returned (streamed bodies excluded)",
+                                    ['endpoint', 'method', 'status'])
+detections = metrics.counter('pothole_detections_total', "Windows scored by /api/detect", ['payload'])
+positives = metrics.counter('pothole_detections_positive_total', "Detections above the threshold", ['payload'])
+db_rows = metrics.counter('pothole_db_rows_returned_total', "Pothole rows returned by queries", ['endpoint'])
+writer_rows = metrics.counter('pothole_writer_rows_total', "Detections committed by the background writer")
+metrics.gauge('pothole_writer_merged_total', "Committed detections merged into a known pothole",
+              lambda: writer.merged, kind='counter')
+metrics.gauge('pothole_writer_failed_total', "Detections the writer dropped because storing them failed",
+              lambda: writer.failed, kind='counter')
+metrics.gauge('pothole_write_queue_depth', "Detections waiting for the writer", lambda: writer.queue_depth())
+metrics.gauge('pothole_inference_queue_depth', "Windows waiting for the inference batcher",
+              lambda: models.status().get('queue_depth', 0))
+metrics.gauge('pothole_db_connections_opened_total', "Per-thread SQLite connections opened",
+              connections_opened, kind='counter')
+metrics.gauge('pothole_route_cache_events_total', "Route cache lookups and removals",
+              lambda: {(event,): value for event, value in route_cache.stats().items()
+                       if event in ('hits', 'misses', 'evictions', 'expirations', 'invalidations')},
+              ['event'], kind='counter')
+metrics.gauge('pothole_route_cache_bytes', "Estimated size of the route cache", lambda: route_cache.bytes)
+metrics.gauge('pothole_nearby_index_potholes', "Potholes in the in-memory nearby index",
+              lambda: nearby_index.stats()['potholes'])
+
+# Stack sampling for hot-path investigation, switched on and off through /api/profiler
+profiler = SamplingProfiler()
+
+def stage(handler, name):
+    return stage_seconds.labels(handler, name).time()
+
+# Corridor queries along a route polyline
+DEFAULT_CORRIDOR_WIDTH_M = 30
+MAX_CORRIDOR_WIDTH_M = 5000
+# Route segments sharing one candidate bounding box
+CORRIDOR_CHUNK_SEGMENTS = 32
+METERS_PER_DEGREE = 111320.0
+
+# Map tiles: below POINT_ZOOM potholes are returned as grid clusters,
+# CLUSTER_GRID cells across the width of one tile
+POINT_ZOOM = 14
+CLUSTER_GRID = 8
+MAX_ZOOM = 22
+
+# Heatmap: level picked so the viewport is at most this many cells wide,
+# and no response holds more than MAX_HEATMAP_CELLS cells
+HEATMAP_VIEW_COLUMNS = 96
+MAX_HEATMAP_CELLS = 50000
 
 # Add some test data
 def add_test_data():
-    conn = sqlite3.connect('potholes.db')
+    conn = get_connection()
     cursor = conn.cursor()
     # Check if we already have data
     cursor.execute("SELECT COUNT(*) FROM potholes")
@@ -42,28 +135,23 @@ def add_test_data():
         # Add some sample data for different regions in India
         test_data = [
             # Chennai area
-            (13.0827, 80.2707, 0.85, datetime.now().isoformat()),  # Chennai
-            (13.1067, 80.2847, 0.65, datetime.now().isoformat()),  # Nearby
-            (13.0647, 80.2567, 0.95, datetime.now().isoformat()),  # Another nearby
+            (13.0827, 80.2707, 0.85, now_ms()),  # Chennai
+            (13.1067, 80.2847, 0.65, now_ms()),  # Nearby
+            (13.0647, 80.2567, 0.95, now_ms()),  # Another nearby
             
             # Chengalpattu area
-            (12.6819, 79.9888, 0.90, datetime.now().isoformat()),  # Chengalpattu
-            (12.6919, 79.9988, 0.75, datetime.now().isoformat()),  # Nearby
-            (12.6719, 79.9788, 0.85, datetime.now().isoformat()),  # Another nearby
+            (12.6819, 79.9888, 0.90, now_ms()),  # Chengalpattu
+            (12.6919, 79.9988, 0.75, now_ms()),  # Nearby
+            (12.6719, 79.9788, 0.85, now_ms()),  # Another nearby
             
             # Route between Chennai and Chengalpattu
-            (12.8823, 80.1353, 0.78, datetime.now().isoformat()),  # Midway point
-            (12.9412, 80.1830, 0.88, datetime.now().isoformat()),  # Another on route
-            (12.7631, 80.0576, 0.92, datetime.now().isoformat()),  # Another on route
+            (12.8823, 80.1353, 0.78, now_ms()),  # Midway point
+            (12.9412, 80.1830, 0.88, now_ms()),  # Another on route
+            (12.7631, 80.0576, 0.92, now_ms()),  # Another on route
         ]
-        cursor.executemany(
-            "INSERT INTO potholes (latitude, longitude, severity, timestamp) VALUES (?, ?, ?, ?)",
-            test_data
-        )
+        cursor.executemany(INSERT_POTHOLE, test_data)
         conn.commit()
         print("Added test pothole data")
-    
-    conn.close()
 
 # Root route to serve the HTML page
 @app.route('/')
@@ -73,19 +161,60 @@ def index():
 # API endpoint to receive pothole data from ESP32
 @app.route('/api/detect', methods=['POST'])
 def detect_pothole():
-    data = request.json
-    
-    # Extract features from accelerometer data
-    features = extract_features(data)
+    if request.mimetype == wire_format.FEATURES_CONTENT_TYPE:
+        # Features computed on the device go straight to inference; a raw
+        # window is attached only to the sampled reports used for auditing
+        payload = 'features'
+        try:
+            with stage('detect', 'parse'):
+                lat, lng, features, window = wire_format.decode_features(request.get_data())
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        if window is not None:
+            with stage('detect', 'audit'):
+                audited = feature_audit.check(features, window)
+            if not audited:
+                print(f"Feature audit mismatch at {lat:.6f}, {lng:.6f}: {feature_audit.status()}")
+    elif request.mimetype == wire_format.CONTENT_TYPE:
+        # Packed float32 window, read straight into the feature kernel
+        payload = 'window'
+        try:
+            with stage('detect', 'parse'):
+                lat, lng, window = wire_format.decode_window(request.get_data())
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        with stage('detect', 'features'):
+            features = extract_features_batch(window[np.newaxis])[0]
+    else:
+        payload = 'json'
+        try:
+            with stage('detect', 'parse'):
+                data = request.json
+                if not isinstance(data, dict):
+                    raise ValueError("Expected a JSON object")
+                lat, lng = wire_format.check_position(data.get('latitude'), data.get('longitude'))
+                window = parse_samples(data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        # Extract features from accelerometer data
+        with stage('detect', 'features'):
+            features = extract_features_batch(window[np.newaxis])[0]
     
-    # Run inference with OpenVINO
-    input_tensor = np.array([features], dtype=np.float32)
-    result = compiled_model(input_tensor)[0][0][0]
+    # Run inference on the selected backend
+    try:
+        with stage('detect', 'inference'):
+            result = models.infer(features)
+    except queue.Full:
+        return jsonify({"error": "Inference queue is full, retry later"}), 503
     
+    detections.labels(payload).inc()
     is_pothole = bool(result > 0.5)
     if is_pothole:
+        positives.labels(payload).inc()
         # Store pothole in database
-        store_pothole(data['latitude'], data['longitude'], float(result))
+        with stage('detect', 'store'):
+            store_pothole(lat, lng, float(result))
         
     return jsonify({
         "is_pothole": is_pothole,
@@ -93,109 +222,442 @@ def detect_pothole():
         "timestamp": datetime.now().isoformat()
     })
 
+@app.before_request
+def start_request_timer():
+    request.environ['pothole.start'] = time.perf_counter()
+
+@app.after_request
+def observe_request(response):
+    start = request.environ.get('pothole.start')
+    if start is not None:
+        request_seconds.labels(request.endpoint or 'unmatched', request.method,
+                               response.status_code).observe(time.perf_counter() - start)
+    return response
+
+# Prometheus scrape endpoint
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.render(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+# Sampling profiler: POST {"enabled": true|false, "interval_ms": 5, "reset": true} switches it;
+# GET returns the sampled stacks in collapsed (flame graph) format, busiest first
+@app.route('/api/profiler', methods=['GET', 'POST'])
+def sampling_profiler():
+    refusal = admin_refusal('/api/profiler')
+    if refusal is not None:
+        return refusal
+    if request.method == 'GET':
+        limit = request.args.get('limit', type=int)
+        dump = profiler.dump(limit, include_idle=request.args.get('idle') == '1')
+        return Response(dump, mimetype='text/plain')
+
+    data = request.get_json(silent=True) or {}
+    try:
+        interval_ms = float(data['interval_ms']) if 'interval_ms' in data else None
+    except (TypeError, ValueError):
+        return jsonify({"error": "interval_ms must be a number"}), 400
+    if interval_ms is not None and not 0.5 <= interval_ms <= 1000:
+        return jsonify({"error": "interval_ms must be in [0.5, 1000]"}), 400
+    if data.get('reset'):
+        profiler.reset()
+    if data.get('enabled') is True:
+        profiler.start(interval_ms)
+    elif data.get('enabled') is False:
+        profiler.stop()
+    return jsonify(profiler.status())
+
+# Which model and inference backend are serving, and why the backend was chosen
+@app.route('/api/status', methods=['GET'])
+def get_status():
+    return jsonify({
+        "inference": models.status(),
+        "feature_audit": feature_audit.status(),
+        "route_cache": route_cache.stats(),
+        "nearby_index": nearby_index.stats(),
+        "profiler": profiler.status(),
+        "write_queue_depth": writer.queue_depth(),
+        "writer_failed": writer.failed
+    })
+
+# Swap the served model for another .xml/.bin pair; in-flight detections finish on the old one
+@app.route('/api/model', methods=['POST'])
+def swap_model():
+    refusal = admin_refusal('/api/model')
+    if refusal is not None:
+        return refusal
+    name = (request.get_json(silent=True) or {}).get('xml_path')
+    if not isinstance(name, str) or not name.endswith('.xml'):
+        return jsonify({"error": "Expected {\"xml_path\": path of an .xml IR under the models directory}"}), 400
+    # Relative to MODELS_DIR; symlinks and '..' are resolved before the check
+    xml_path = os.path.realpath(os.path.join(MODELS_DIR, name))
+    if os.path.commonpath([xml_path, MODELS_DIR]) != MODELS_DIR or not os.path.isfile(xml_path):
+        return jsonify({"error": f"No IR named {name} under the models directory"}), 400
+    try:
+        report = models.swap(xml_path)
+    except ValueError as e:
+        # An IR over another feature layout
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": f"Could not load {xml_path}: {e}"}), 500
+    return jsonify(report)
+
+# Bulk upload of a whole trip as NDJSON (see trips.py); detections stream back
+# as NDJSON while the body is still arriving
+@app.route('/api/trips', methods=['POST'])
+def upload_trip():
+    store = request.args.get('store', '1') != '0'
+    detector = TripDetector(models.infer_batch)
+
+    def generate():
+        try:
+            for line in iter_lines(request.stream):
+                for detection in detector.feed_line(line):
+                    yield emit_detection(detection, store)
+            for detection in detector.finish():
+                yield emit_detection(detection, store)
+        except ValueError as e:
+            yield json.dumps({"type": "error", "error": str(e)}) + '\n'
+        yield json.dumps(detector.summary()) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+def emit_detection(detection, store):
+    if detection['lat'] is not None and not (math.isfinite(detection['lat']) and math.isfinite(detection['lng'])):
+        # Never store or send a NaN position; the detection goes out without one
+        detection['lat'] = detection['lng'] = None
+    if store and detection['lat'] is not None:
+        store_pothole(detection['lat'], detection['lng'], detection['confidence'])
+    return json.dumps(detection) + '\n'
+
 # API endpoint to get all potholes
 @app.route('/api/route', methods=['GET'])
 def get_route_info():
-    start_lat = float(request.args.get('start_lat'))
-    start_lng = float(request.args.get('start_lng'))
-    end_lat = float(request.args.get('end_lat'))
-    end_lng = float(request.args.get('end_lng'))
-    
-    # Query potholes within the route bounds
-    conn = sqlite3.connect('potholes.db')
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT COUNT(*) FROM potholes 
-        WHERE latitude BETWEEN ? AND ? 
-        AND longitude BETWEEN ? AND ?
-    """, (start_lat, end_lat, start_lng, end_lng))
-    pothole_count = cursor.fetchone()[0]
-    
-    # Get the potholes along the route for highlighting
-    cursor.execute("""
-        SELECT latitude, longitude, severity, timestamp FROM potholes 
-        WHERE latitude BETWEEN ? AND ? 
-        AND longitude BETWEEN ? AND ?
-    """, (start_lat, end_lat, start_lng, end_lng))
-    
-    potholes = [
-        {"lat": row[0], "lng": row[1], "severity": row[2], "timestamp": row[3]} 
-        for row in cursor.fetchall()
-    ]
-    
-    conn.close()
+    with stage('route', 'parse'):
+        try:
+            # Missing, non-numeric, non-finite and out-of-range corners are all ValueError
+            start_lat, start_lng = wire_format.check_position(request.args.get('start_lat'),
+                                                              request.args.get('start_lng'))
+            end_lat, end_lng = wire_format.check_position(request.args.get('end_lat'), request.args.get('end_lng'))
+            period = parse_period(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
     
+    # Potholes within the route bounds, from the cache or through the R*Tree index
+    with stage('route', 'query'):
+        rows = route_cache.query(get_connection(), start_lat, start_lng, end_lat, end_lng, period)
+    db_rows.labels('route').inc(len(rows))
+    with stage('route', 'serialize'):
+        potholes = [
+            {"lat": row[1], "lng": row[2], "severity": row[3], "timestamp": row[4], "report_count": row[5]} 
+            for row in rows
+        ]
+        pothole_count = len(potholes)
+        
+        return jsonify({
+            "pothole_count": pothole_count,
+            "potholes": potholes
+        })
+
+
+# API endpoint for potholes within a distance of the actual route geometry
+@app.route('/api/route/corridor', methods=['POST'])
+def get_route_corridor():
+    data = request.get_json(silent=True) or {}
+    try:
+        # GeoJSON order, as in the OSRM route geometry: [[lng, lat], ...]
+        coords = np.asarray(data['coordinates'], dtype=np.float64)
+        width_m = float(data.get('width_m', DEFAULT_CORRIDOR_WIDTH_M))
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"error": "Expected {\"coordinates\": [[lng, lat], ...], \"width_m\": meters}"}), 400
+    try:
+        period = parse_period(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if coords.ndim != 2 or coords.shape[1] != 2 or len(coords) < 2:
+        return jsonify({"error": "coordinates must hold at least two [lng, lat] pairs"}), 400
+    if not 0 < width_m <= MAX_CORRIDOR_WIDTH_M:
+        return jsonify({"error": f"width_m must be in (0, {MAX_CORRIDOR_WIDTH_M}]"}), 400
+
+    with stage('corridor', 'query'):
+        potholes = potholes_in_corridor(get_connection(), coords[:, 1], coords[:, 0], width_m, period)
+    db_rows.labels('corridor').inc(len(potholes))
+    with stage('corridor', 'serialize'):
+        return jsonify({
+            "pothole_count": len(potholes),
+            "potholes": potholes
+        })
+
+
+# API endpoint for map potholes by viewport (bbox + zoom), by z/x/y tile, or changes since a cursor
+@app.route('/api/potholes', methods=['GET'])
+def get_potholes():
+    try:
+        bbox = parse_bbox(request.args.get('bbox'))
+        zoom = int(request.args.get('zoom', 0))
+        since = request.args.get('since', type=int)
+        period = parse_period(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if since is not None:
+        if period is not None:
+            # Potholes ageing out of a window are not deletions, so a cursor cannot track them
+            return jsonify({"error": "since cannot be combined with a time window"}), 400
+        return pothole_changes(since, bbox)
+    return pothole_view(bbox or (-90.0, -180.0, 90.0, 180.0), zoom, period)
+
+@app.route('/api/potholes/<int:z>/<int:x>/<int:y>', methods=['GET'])
+def get_pothole_tile(z, x, y):
+    if z > MAX_ZOOM or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        return jsonify({"error": "Tile out of range"}), 404
+    try:
+        period = parse_period(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return pothole_view(tile_bbox(z, x, y), z, period)
+
+# "Pothole ahead": the k nearest potholes within radius_m of a vehicle and, when
+# heading (degrees clockwise from north) is given, within cone_deg either side of it
+@app.route('/api/nearby', methods=['GET'])
+def get_nearby():
+    try:
+        lat = float(request.args['lat'])
+        lng = float(request.args['lng'])
+        heading = request.args.get('heading', type=float)
+        radius_m = float(request.args.get('radius_m', DEFAULT_NEARBY_RADIUS_M))
+        cone_deg = float(request.args.get('cone_deg', DEFAULT_CONE_DEG))
+        k = int(request.args.get('k', DEFAULT_NEARBY_K))
+    except (KeyError, ValueError):
+        return jsonify({"error": "Expected lat, lng and optional heading, radius_m, cone_deg, k"}), 400
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return jsonify({"error": "lat/lng out of range"}), 400
+    if not 0 < radius_m <= MAX_NEARBY_RADIUS_M:
+        return jsonify({"error": f"radius_m must be in (0, {MAX_NEARBY_RADIUS_M}]"}), 400
+    if not 0 < cone_deg <= 180:
+        return jsonify({"error": "cone_deg must be in (0, 180]"}), 400
+    if not 0 < k <= MAX_NEARBY_K:
+        return jsonify({"error": f"k must be in [1, {MAX_NEARBY_K}]"}), 400
+
+    nearby_index.load()
+    potholes = nearby_index.nearest(lat, lng, radius_m, heading, cone_deg, k)
     return jsonify({
-        "pothole_count": pothole_count,
+        "pothole_count": len(potholes),
         "potholes": potholes
     })
 
+# Severity heatmap from the maintained per-cell aggregates, as parallel arrays:
+# cell i spans rows[i] + row0 and cols[i] + col0 on the cell_deg grid from (-90, -180)
+@app.route('/api/heatmap', methods=['GET'])
+def get_heatmap():
+    try:
+        bbox = parse_bbox(request.args.get('bbox')) or (-90.0, -180.0, 90.0, 180.0)
+        level = request.args.get('level', type=int)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    min_lat, min_lng, max_lat, max_lng = bbox
+    if level is None:
+        level = heatmap_level(min_lng, max_lng, HEATMAP_VIEW_COLUMNS)
+    if not 0 <= level < len(HEATMAP_CELL_DEG):
+        return jsonify({"error": f"level must be in [0, {len(HEATMAP_CELL_DEG) - 1}]"}), 400
+
+    cell_deg = HEATMAP_CELL_DEG[level]
+    rows = query_heatmap(get_connection(), level, *bbox)
+    if len(rows) > MAX_HEATMAP_CELLS:
+        return jsonify({"error": "bbox too large for this level, use a coarser one"}), 400
+
+    row0 = int((min_lat + 90.0) / cell_deg)
+    col0 = int((min_lng + 180.0) / cell_deg)
+    return jsonify({
+        "level": level,
+        "cell_deg": cell_deg,
+        "row0": row0,
+        "col0": col0,
+        "rows": [row[0] - row0 for row in rows],
+        "cols": [row[1] - col0 for row in rows],
+        "count": [row[2] for row in rows],
+        "mean": [round(row[3], 3) for row in rows],
+        "max": [round(row[4], 3) for row in rows],
+        "updated": [row[5] for row in rows]
+    })
+
+def pothole_view(bbox, zoom, period=None):
+    # Potholes or clusters for one viewport, answered with 304 when the client's copy is current
+    zoom = max(0, min(zoom, MAX_ZOOM))
+    conn = get_connection()
+    count, max_seq = query_bbox_version(conn, *bbox, period=period)
+    key = f"{bbox}|{zoom}|{period}|{count}|{max_seq}"
+    etag = hashlib.blake2b(key.encode(), digest_size=12).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    elif zoom < POINT_ZOOM:
+        cell_deg = 360.0 / 2 ** zoom / CLUSTER_GRID
+        clusters = [
+            {"lat": lat, "lng": lng, "count": potholes, "reports": reports, "max_severity": max_severity}
+            for lat, lng, potholes, reports, max_severity in query_clusters(conn, *bbox, cell_deg, period)
+        ]
+        response = jsonify({"zoom": zoom, "clusters": clusters, "cursor": current_cursor(conn)})
+    else:
+        potholes = [pothole_json(row) for row in query_points(conn, *bbox, period)]
+        response = jsonify({"zoom": zoom, "potholes": potholes, "cursor": current_cursor(conn)})
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def pothole_changes(since, bbox):
+    try:
+        changed, deleted, cursor = query_changes(get_connection(), since, bbox)
+    except CursorExpired as e:
+        # Deletions after this cursor were pruned; the client has to reload the viewport
+        return jsonify({"error": str(e), "reset": True}), 410
+    return jsonify({
+        "cursor": cursor,
+        "potholes": [pothole_json(row) for row in changed],
+        "deleted": deleted
+    })
+
+def pothole_json(row):
+    pothole_id, lat, lng, severity, timestamp, report_count, last_seen, max_severity, _ = row
+    return {"id": pothole_id, "lat": lat, "lng": lng, "severity": severity, "timestamp": timestamp,
+            "report_count": report_count, "last_seen": last_seen, "max_severity": max_severity}
+
+def parse_bbox(value):
+    # "west,south,east,north" -> (min_lat, min_lng, max_lat, max_lng)
+    if not value:
+        return None
+    parts = value.split(',')
+    if len(parts) != 4:
+        raise ValueError("bbox must be west,south,east,north")
+    west, south, east, north = map(float, parts)
+    return (south, west, north, east)
+
+def parse_period(args):
+    # ?days=N (last N days) or ?from=&to= (epoch ms) -> (from_ms, to_ms) of last_seen, or None
+    days, start, end = args.get('days'), args.get('from'), args.get('to')
+    if days is None and start is None and end is None:
+        return None
+    now = now_ms()
+    if days is not None:
+        if start is not None:
+            raise ValueError("Use either days or from/to")
+        start = now - int(float(days) * DAY_MS)
+    period = (int(start or 0), int(end) if end is not None else now)
+    if period[0] > period[1]:
+        raise ValueError("from must not be after to")
+    return period
+
+def tile_bbox(z, x, y):
+    # Web-mercator z/x/y tile -> (min_lat, min_lng, max_lat, max_lng)
+    n = 2 ** z
+    west = x / n * 360.0 - 180.0
+    east = (x + 1) / n * 360.0 - 180.0
+    north = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    south = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return (south, west, north, east)
+
 
 def calculate_distance(lat1, lng1, lat2, lng2):
-    # Haversine formula to calculate distance between coordinates
+    # Haversine formula to calculate distance between coordinates, in km.
+    # Works elementwise on NumPy arrays as well as on plain floats.
     R = 6371  # Earth radius in km
-    d_lat = math.radians(lat2 - lat1)
-    d_lng = math.radians(lng2 - lng1)
-    a = (math.sin(d_lat/2) * math.sin(d_lat/2) + 
-         math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * 
-         math.sin(d_lng/2) * math.sin(d_lng/2))
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
+    d_lat = np.radians(lat2 - lat1)
+    d_lng = np.radians(lng2 - lng1)
+    a = (np.sin(d_lat/2) * np.sin(d_lat/2) + 
+         np.cos(np.radians(lat1)) * np.cos(np.radians(lat2)) * 
+         np.sin(d_lng/2) * np.sin(d_lng/2))
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1-a))
     return R * c
 
+def point_segment_distance(p_lat, p_lng, a_lat, a_lng, b_lat, b_lng):
+    # Distance in meters from every point (P,) to every segment a->b (S,), shape (P, S).
+    # The closest point on each segment is found in a local flat projection around
+    # the segment start, then measured with the haversine formula.
+    kx = np.cos(np.radians(a_lat)) * METERS_PER_DEGREE
+    bx = (b_lng - a_lng) * kx
+    by = (b_lat - a_lat) * METERS_PER_DEGREE
+    px = (p_lng[:, np.newaxis] - a_lng) * kx
+    py = (p_lat[:, np.newaxis] - a_lat) * METERS_PER_DEGREE
+    seg_len2 = bx * bx + by * by
+    t = (px * bx + py * by) / np.where(seg_len2 > 0, seg_len2, 1.0)
+    t = np.clip(t, 0.0, 1.0)
+    closest_lat = a_lat + t * (b_lat - a_lat)
+    closest_lng = a_lng + t * (b_lng - a_lng)
+    distance = calculate_distance(p_lat[:, np.newaxis], p_lng[:, np.newaxis], closest_lat, closest_lng) * 1000
+    return distance, t
+
+def potholes_in_corridor(conn, lats, lngs, width_m, period=None):
+    # Potholes within width_m of the polyline, ordered by distance along the route
+    seg_lengths = calculate_distance(lats[:-1], lngs[:-1], lats[1:], lngs[1:]) * 1000
+    route_offsets = np.concatenate([[0.0], np.cumsum(seg_lengths)])
+    pad_lat = width_m / METERS_PER_DEGREE
+    best = {}
+
+    # Pre-filter candidates with one small R*Tree box per run of segments
+    for start in range(0, len(seg_lengths), CORRIDOR_CHUNK_SEGMENTS):
+        end = min(start + CORRIDOR_CHUNK_SEGMENTS, len(seg_lengths))
+        chunk_lats = lats[start:end + 1]
+        chunk_lngs = lngs[start:end + 1]
+        pad_lng = pad_lat / max(np.cos(np.radians(np.abs(chunk_lats).max())), 1e-6)
+        rows = route_cache.query(conn, chunk_lats.min() - pad_lat, chunk_lngs.min() - pad_lng,
+                                 chunk_lats.max() + pad_lat, chunk_lngs.max() + pad_lng, period)
+        if not rows:
+            continue
+
+        p_lat = np.array([row[1] for row in rows])
+        p_lng = np.array([row[2] for row in rows])
+        distance, t = point_segment_distance(p_lat, p_lng, lats[start:end], lngs[start:end],
+                                             lats[start + 1:end + 1], lngs[start + 1:end + 1])
+        nearest = distance.argmin(axis=1)
+        index = np.arange(len(rows))
+        nearest_distance = distance[index, nearest]
+        along = route_offsets[start + nearest] + t[index, nearest] * seg_lengths[start + nearest]
+
+        for i in np.flatnonzero(nearest_distance <= width_m):
+            pothole_id = rows[i][0]
+            if pothole_id not in best or nearest_distance[i] < best[pothole_id][0]:
+                best[pothole_id] = (nearest_distance[i], along[i], rows[i])
+
+    ordered = sorted(best.values(), key=lambda item: item[1])
+    return [
+        {"lat": row[1], "lng": row[2], "severity": row[3], "timestamp": row[4], "report_count": row[5],
+         "distance_m": round(float(distance_m), 1), "route_offset_m": round(float(along_m), 1)}
+        for distance_m, along_m, row in ordered
+    ]
+
+def admin_refusal(endpoint):
+    # 403 response unless the request carries ADMIN_TOKEN as its bearer token, else None
+    if not ADMIN_TOKEN:
+        return jsonify({"error": f"{endpoint} is disabled; set POTHOLE_ADMIN_TOKEN to enable it"}), 403
+    supplied = request.headers.get('Authorization', '').removeprefix('Bearer ')
+    if not hmac.compare_digest(supplied.encode(), ADMIN_TOKEN.encode()):
+        return jsonify({"error": "Invalid admin token"}), 403
+    return None
+
+def parse_samples(data):
+    # (samples, 12) window from a JSON report; ValueError for anything extract_features_batch cannot score
+    samples = data.get('accelerometer_data')
+    if not isinstance(samples, list) or not samples or not all(isinstance(sample, dict) for sample in samples):
+        raise ValueError("accelerometer_data must be a non-empty list of samples")
+    try:
+        window = samples_to_array(samples)
+    except KeyError as e:
+        raise ValueError(f"Sample is missing channel {e}") from None
+    except TypeError:
+        raise ValueError("Sample values must be numbers") from None
+    if not np.isfinite(window).all():
+        raise ValueError("Sample values must be finite")
+    return window
+
 def extract_features(data):
-    # Implement feature extraction similar to your create_windows() function
-    # This should match the 34 features from your SVM model
-    features = np.zeros(34, dtype=np.float32)
-    
-    # Process accelerometer data
-    if 'accelerometer_data' in data:
-        acc_data = data['accelerometer_data']
-        
-        # Extract features based on your create_windows() function
-        # Time domain features for each axis
-        axes = ['acc_x1', 'acc_y1', 'acc_z1', 'acc_x2', 'acc_y2', 'acc_z2']
-        feat_idx = 0
-        
-        for axis in axes:
-            values = [sample[axis] for sample in acc_data]
-            features[feat_idx] = min(values)  # min
-            features[feat_idx+1] = max(values)  # max
-            features[feat_idx+2] = sum(values) / len(values)  # mean
-            features[feat_idx+3] = np.std(values)  # std
-            feat_idx += 4
-        
-        # Magnitude features
-        mag1_values = [np.sqrt(sample['acc_x1']**2 + sample['acc_y1']**2 + sample['acc_z1']**2) 
-                     for sample in acc_data]
-        mag2_values = [np.sqrt(sample['acc_x2']**2 + sample['acc_y2']**2 + sample['acc_z2']**2) 
-                     for sample in acc_data]
-        
-        features[feat_idx] = max(mag1_values)  # mag1_max
-        features[feat_idx+1] = max(mag2_values)  # mag2_max
-        features[feat_idx+2] = np.std(mag1_values)  # mag1_std
-        features[feat_idx+3] = np.std(mag2_values)  # mag2_std
-        feat_idx += 4
-        
-        # Gyroscope features
-        gyro_axes = ['gyr_x1', 'gyr_y1', 'gyr_z1', 'gyr_x2', 'gyr_y2', 'gyr_z2']
-        for axis in gyro_axes:
-            values = [sample[axis] for sample in acc_data]
-            features[feat_idx] = np.std(values)  # std
-            feat_idx += 1
-    
-    return features
+    # 34 features matching the SVM model, computed by the vectorized kernel in features.py
+    return extract_features_batch(parse_samples(data)[np.newaxis])[0]
 
 def store_pothole(lat, lng, severity):
-    conn = sqlite3.connect('potholes.db')
-    cursor = conn.cursor()
-    cursor.execute(
-        "INSERT INTO potholes (latitude, longitude, severity, timestamp) VALUES (?, ?, ?, ?)",
-        (lat, lng, severity, datetime.now().isoformat())
-    )
-    conn.commit()
-    conn.close()
+    # Queued for the background writer's next group commit, which invalidates
+    # the cached route results around it
+    writer.submit(lat, lng, severity)
 
 if __name__ == '__main__':
     init_db()
     add_test_data()  # Add test data for demonstration
+    nearby_index.build()
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,421 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# Offline benchmark suite over synthetic data. Every group runs in a fresh
+# process with its own POTHOLE_DB, so module-level state (the model, the writer,
+# the caches) starts cold and one group cannot skew another:
+#
+#   python benchmarks.py --output before.json
+#   python benchmarks.py --output after.json
+#   python benchmarks.py --compare before.json after.json
+#
+# Every result reports per-call latency percentiles in microseconds.
+GROUPS = ['features', 'inference', 'detect', 'ingest', 'route', 'training']
+DEFAULT_ROUTE_ROWS = [10000, 1000000]
+# Seeded databases are kept here and reused by later runs with the same row count
+DEFAULT_WORKDIR = 'bench_data'
+# p50 slowdown beyond this fraction is reported as a regression by --compare
+DEFAULT_TOLERANCE = 0.2
+SEED = 0
+
+
+def summarize(seconds):
+    """Latency percentiles in microseconds for a list of per-call durations"""
+    us = np.asarray(seconds, dtype=np.float64) * 1e6
+    return {
+        'n': len(us),
+        'mean_us': round(float(us.mean()), 3),
+        'p50_us': round(float(np.percentile(us, 50)), 3),
+        'p90_us': round(float(np.percentile(us, 90)), 3),
+        'p99_us': round(float(np.percentile(us, 99)), 3),
+        'min_us': round(float(us.min()), 3),
+        'max_us': round(float(us.max()), 3),
+    }
+
+
+def timed(fn, repeats, warmup=50):
+    """Call fn(i) `repeats` times after `warmup` untimed calls and summarize the latencies"""
+    for i in range(warmup):
+        fn(i)
+    durations = []
+    for i in range(repeats):
+        start = time.perf_counter()
+        fn(i)
+        durations.append(time.perf_counter() - start)
+    return summarize(durations)
+
+
+def result(group, name, stats, items=1, **params):
+    """One benchmark record; items is how many windows, rows or samples one call handles"""
+    record = {'group': group, 'name': name, 'params': params, **stats}
+    if items != 1:
+        record['items_per_call'] = items
+    record['items_per_s'] = round(items / (stats['mean_us'] / 1e6), 1)
+    return record
+
+
+def synthetic_windows(count, rng, window_size=50):
+    """(count, window_size, 12) sensor windows: road noise, with a jolt in every other window"""
+    from features import CHANNELS
+
+    windows = rng.normal(0, 0.2, (count, window_size, len(CHANNELS))).astype(np.float32)
+    windows[:, :, 2] += 1.0
+    windows[:, :, 5] += 1.0
+    windows[::2, 20:30, :6] += rng.normal(0, 4, (len(windows[::2]), 10, 6))
+    return windows
+
+
+def window_json(window, lat=13.0827, lng=80.2707):
+    from features import CHANNELS
+
+    return {
+        'accelerometer_data': [dict(zip(CHANNELS, map(float, sample))) for sample in window],
+        'latitude': lat,
+        'longitude': lng,
+    }
+
+
+def bench_features(args):
+    import app
+    from features import extract_features_batch
+    import wire_format
+
+    rng = np.random.default_rng(SEED)
+    windows = synthetic_windows(1024, rng)
+    payloads = [window_json(window) for window in windows[:64]]
+    packed = wire_format.encode_window(13.0827, 80.2707, windows[0])
+
+    results = [result('features', 'app.extract_features', timed(
+        lambda i: app.extract_features(payloads[i % len(payloads)]), args.repeats), window_size=50)]
+    for batch in [1, 64, 1024]:
+        results.append(result('features', 'extract_features_batch', timed(
+            lambda i: extract_features_batch(windows[:batch]), max(args.repeats // batch, 20)),
+            items=batch, batch=batch))
+    results.append(result('features', 'wire_format.decode_window', timed(
+        lambda i: wire_format.decode_window(packed), args.repeats)))
+    return results
+
+
+def bench_inference(args):
+    from inference import NUM_FEATURES, NumpyBackend, OpenVINOBackend
+
+    rng = np.random.default_rng(SEED)
+    features = rng.normal(0, 1, (1024, NUM_FEATURES)).astype(np.float32)
+    results = []
+    for name, backend in [('numpy', NumpyBackend()), ('openvino', OpenVINOBackend(cache_dir=''))]:
+        try:
+            results.append(result('inference', f'{name}.infer', timed(
+                lambda i: backend.infer(features[i % len(features)]), args.repeats), backend=name))
+            for batch in [64, 1024]:
+                results.append(result('inference', f'{name}.infer_batch', timed(
+                    lambda i: backend.infer_batch(features[:batch]), max(args.repeats // 10, 20)),
+                    items=batch, backend=name, batch=batch))
+        finally:
+            backend.close()
+    return results
+
+
+def bench_detect(args):
+    import app
+    import wire_format
+    from features import extract_features_batch
+
+    rng = np.random.default_rng(SEED)
+    windows = synthetic_windows(64, rng)
+    client = app.app.test_client()
+    bodies = [
+        ('json', 'application/json', [json.dumps(window_json(window)) for window in windows]),
+        ('window', wire_format.CONTENT_TYPE,
+         [wire_format.encode_window(13.0827, 80.2707, window) for window in windows]),
+        ('features', wire_format.FEATURES_CONTENT_TYPE,
+         [wire_format.encode_features(13.0827, 80.2707, features)
+          for features in extract_features_batch(windows)]),
+    ]
+
+    detected = []
+
+    def post(content_type, payload):
+        response = client.post('/api/detect', data=payload, content_type=content_type)
+        assert response.status_code == 200, response.get_data(as_text=True)
+        if response.get_json()['is_pothole']:
+            detected.append(1)
+
+    results = []
+    for name, content_type, payloads in bodies:
+        results.append(result('detect', 'POST /api/detect', timed(
+            lambda i: post(content_type, payloads[i % len(payloads)]), args.repeats),
+            payload=name, backend=app.models.status().get('backend')))
+    # Timings of failed writes would be meaningless: every detection must be stored
+    app.writer.flush()
+    assert app.writer.committed == len(detected) and not app.writer.failed, \
+        f"stored {app.writer.committed} of {len(detected)} detections"
+    return results
+
+
+def bench_ingest(args):
+    import app
+    from storage import PotholeWriter, now_ms
+    from trips import synthetic_trip_lines
+
+    rng = np.random.default_rng(SEED)
+    results = []
+
+    # Group commit through the background writer, including the merge lookup
+    writer = PotholeWriter(os.environ['POTHOLE_DB'])
+    batch = 256
+    submitted = []
+
+    def write_batch(i):
+        for lat, lng in zip(rng.uniform(12.8, 13.2, batch), rng.uniform(80.0, 80.4, batch)):
+            writer.submit(float(lat), float(lng), 0.8, now_ms())
+        submitted.append(batch)
+        writer.flush()
+
+    stats = timed(write_batch, max(args.repeats // 20, 20), warmup=2)
+    writer.close()
+    assert writer.committed == sum(submitted) and not writer.failed, \
+        f"committed {writer.committed} of {sum(submitted)} submitted rows"
+    results.append(result('ingest', 'PotholeWriter submit+flush', stats, items=batch, batch=batch))
+
+    # Whole-trip NDJSON upload, streamed through the Flask test client
+    client = app.app.test_client()
+    body = '\n'.join(synthetic_trip_lines(60)).encode()
+
+    def upload(i):
+        response = client.post('/api/trips?store=0', data=body, content_type='application/x-ndjson')
+        summary = json.loads(response.get_data(as_text=True).strip().split('\n')[-1])
+        assert summary['type'] == 'summary', summary
+
+    results.append(result('ingest', 'POST /api/trips', timed(upload, max(args.repeats // 100, 5), warmup=1),
+                          items=60 * 100, trip_s=60))
+    return results
+
+
+def seed_database(path, rows):
+    """Seed a route database once; later runs reuse it if it holds the same rows
+    and is at the current schema version"""
+    from storage import MIGRATIONS, _seed_potholes, connect
+
+    if os.path.exists(path):
+        conn = connect(path)
+        try:
+            if (conn.execute('PRAGMA user_version').fetchone()[0] == len(MIGRATIONS) and
+                    conn.execute("SELECT COUNT(*) FROM potholes").fetchone()[0] == rows):
+                return
+        finally:
+            conn.close()
+        for suffix in ['', '-wal', '-shm']:
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+    _seed_potholes(path, rows, np.random.default_rng(SEED))
+
+
+def bench_route(args):
+    import app
+
+    rng = np.random.default_rng(SEED + 1)
+    client = app.app.test_client()
+    # City-sized boxes, about 10 km across, over the seeded area (India)
+    corners = np.column_stack([rng.uniform(8.0, 29.9, args.repeats + 10), rng.uniform(70.0, 89.9, args.repeats + 10)])
+    urls = [f'/api/route?start_lat={lat}&start_lng={lng}&end_lat={lat + 0.1}&end_lng={lng + 0.1}'
+            for lat, lng in corners.tolist()]
+    hits = []
+
+    def get(url):
+        response = client.get(url)
+        assert response.status_code == 200
+        hits.append(response.get_json()['pothole_count'])
+
+    # Every box is new, so each call misses the route cache; then a handful of
+    # popular boxes repeated, which it answers
+    misses = timed(lambda i: get(urls[i]), args.repeats)
+    mean_hits = float(np.mean(hits))
+    repeated = timed(lambda i: get(urls[i % 10]), args.repeats)
+    return [
+        result('route', 'GET /api/route', misses, rows=args.rows, cache='miss', mean_potholes=round(mean_hits, 1)),
+        result('route', 'GET /api/route', repeated, rows=args.rows, cache='hit',
+               hit_rate=app.route_cache.stats()['hit_rate']),
+    ]
+
+
+def bench_training(args):
+    from road_data_analyzer import RoadDataAnalyzer
+    from road_data_generator import RoadDataGenerator
+
+    np.random.seed(SEED)
+    seconds = 600
+    data = RoadDataGenerator().generate_dataset(normal_duration=seconds, num_potholes=seconds // 3)
+    path = os.path.join(args.workdir, 'bench_training.csv')
+    data.to_csv(path, index=False)
+    analyzer = RoadDataAnalyzer()
+    analyzer.load_data(path)
+    windows = []
+
+    def prepare(i):
+        X, _ = analyzer.prepare_training_data()
+        windows.append(len(X))
+
+    stats = timed(prepare, max(args.repeats // 100, 5), warmup=1)
+    # The before number: the original iloc loop, a few calls since each takes about a second
+    original = timed(lambda i: analyzer.prepare_training_data_original(), 3, warmup=0)
+    os.remove(path)
+    return [result('training', 'RoadDataAnalyzer.prepare_training_data', stats, items=windows[-1],
+                   samples=len(data), log_s=seconds),
+            result('training', 'RoadDataAnalyzer.prepare_training_data_original', original, items=windows[-1],
+                   samples=len(data), log_s=seconds)]
+
+
+BENCHMARKS = {
+    'features': bench_features,
+    'inference': bench_inference,
+    'detect': bench_detect,
+    'ingest': bench_ingest,
+    'route': bench_route,
+    'training': bench_training,
+}
+
+
+def run_group(group, args, rows=None):
+    """Run one group in a fresh interpreter and return its records"""
+    os.makedirs(args.workdir, exist_ok=True)
+    env = dict(os.environ, POTHOLE_RETENTION_DAYS='0', POTHOLE_BACKEND=args.backend)
+    if group == 'route':
+        db_path = os.path.join(args.workdir, f'route_{rows}.db')
+        seed_database(db_path, rows)
+    else:
+        db_path = os.path.join(args.workdir, f'{group}.db')
+        for suffix in ['', '-wal', '-shm']:
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
+    env['POTHOLE_DB'] = db_path
+
+    with tempfile.NamedTemporaryFile('r', suffix='.json') as out:
+        command = [sys.executable, os.path.abspath(__file__), '--run', group, '--result-file', out.name,
+                   '--repeats', str(args.repeats), '--workdir', args.workdir, '--backend', args.backend]
+        if rows is not None:
+            command += ['--rows', str(rows)]
+        # The app and the model loader print progress; keep it off the report
+        subprocess.run(command, env=env, check=True, stdout=subprocess.DEVNULL)
+        return json.load(out)
+
+
+def run_suite(args):
+    if 'route' in args.groups:
+        print(f"Route databases: {args.route_rows} rows (seeded once into {args.workdir}/)")
+    records = []
+    for group in args.groups:
+        for rows in (args.route_rows if group == 'route' else [None]):
+            start = time.perf_counter()
+            group_records = run_group(group, args, rows)
+            records += group_records
+            label = group if rows is None else f"{group} ({rows} rows)"
+            print(f"{label}: {len(group_records)} results in {time.perf_counter() - start:.1f} s")
+            for record in group_records:
+                print(f"    {record_key(record):<70} p50 {record['p50_us']:>11.1f} us  "
+                      f"p99 {record['p99_us']:>11.1f} us")
+    return records
+
+
+def environment():
+    def git(*command):
+        try:
+            return subprocess.run(['git', *command], capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    return {
+        'commit': git('rev-parse', 'HEAD'),
+        'dirty': bool(git('status', '--porcelain', '--untracked-files=no')),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def record_key(record):
+    params = ','.join(f'{key}={value}' for key, value in sorted(record['params'].items())
+                      if key not in ('mean_potholes', 'hit_rate'))
+    return f"{record['group']}/{record['name']}[{params}]"
+
+
+def compare(before_path, after_path, tolerance=DEFAULT_TOLERANCE):
+    """Print the p50/p99 change of every result present in both runs; returns the regressions"""
+    with open(before_path) as f:
+        before = {record_key(record): record for record in json.load(f)['results']}
+    with open(after_path) as f:
+        after = json.load(f)['results']
+
+    regressions = []
+    print(f"{'benchmark':<70} {'p50 before':>11} {'p50 after':>11} {'change':>8} {'p99 change':>11}")
+    for record in after:
+        key = record_key(record)
+        old = before.get(key)
+        if old is None:
+            print(f"{key:<70} {'-':>11} {record['p50_us']:>11.1f}      new")
+            continue
+        change = record['p50_us'] / old['p50_us'] - 1
+        p99_change = record['p99_us'] / old['p99_us'] - 1
+        flag = '  REGRESSION' if change > tolerance else ''
+        if flag:
+            regressions.append(key)
+        print(f"{key:<70} {old['p50_us']:>11.1f} {record['p50_us']:>11.1f} {change:>+8.1%} {p99_change:>+11.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark suite with JSON output")
+    parser.add_argument('--groups', nargs='+', choices=GROUPS, default=GROUPS)
+    parser.add_argument('--route-rows', type=int, nargs='+', default=DEFAULT_ROUTE_ROWS)
+    parser.add_argument('--repeats', type=int, default=1000, help="Timed calls per single-item benchmark")
+    parser.add_argument('--backend', default='auto', help="POTHOLE_BACKEND for the app and detect groups")
+    parser.add_argument('--workdir', default=DEFAULT_WORKDIR)
+    parser.add_argument('--output', help="Write the JSON report here (default: print it)")
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'),
+                        help="Compare two reports; exits 1 if any p50 regressed beyond --tolerance")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    # Internal: run one group in this process
+    parser.add_argument('--run', choices=GROUPS, help=argparse.SUPPRESS)
+    parser.add_argument('--rows', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--result-file', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        regressions = compare(*args.compare, tolerance=args.tolerance)
+        print(f"{len(regressions)} regression(s) beyond {args.tolerance:.0%}")
+        sys.exit(1 if regressions else 0)
+
+    if args.run:
+        # Every group gets the current schema, in its fresh database or the reused route one
+        from storage import init_db
+        init_db(os.environ['POTHOLE_DB'])
+        records = BENCHMARKS[args.run](args)
+        with open(args.result_file, 'w') as f:
+            json.dump(records, f)
+        return
+
+    report = {
+        'environment': environment(),
+        'settings': {'repeats': args.repeats, 'backend': args.backend, 'route_rows': args.route_rows,
+                     'seed': SEED},
+        'results': run_suite(args),
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {len(report['results'])} results to {args.output}")
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
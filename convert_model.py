@@ -1,86 +1,248 @@
+import argparse
+import os
 import pickle
+import time
 import numpy as np
 import openvino as ov
+import openvino.opset13 as ops
+from sklearn.kernel_approximation import RBFSampler
+from sklearn.model_selection import train_test_split
 
-def convert_svm_to_ov_directly():
-    # Load trained SVM model
-    with open('pothole_model.pkl', 'rb') as f:
+from features import NUM_FEATURES
+
+# Keep CPU inference in f32: on bf16-capable CPUs the default precision would
+# shift confidences by ~1e-3 and flip decisions near the threshold
+CPU_CONFIG = {"INFERENCE_PRECISION_HINT": "f32"}
+
+def load_svm_and_scaler(model_path='pothole_model.pkl', scaler_path='pothole_scaler.pkl'):
+    """Load the trained linear SVM and, if it was saved, its StandardScaler"""
+    with open(model_path, 'rb') as f:
         svm = pickle.load(f)
+    if not hasattr(svm, 'coef_'):
+        raise ValueError(f"{model_path} is not a linear model; export RBF models with --rbf-approximation")
+    
+    scaler = None
+    if os.path.exists(scaler_path):
+        with open(scaler_path, 'rb') as f:
+            scaler = pickle.load(f)
+    else:
+        print(f"No scaler at {scaler_path}; exporting the SVM on unscaled features")
+    return svm, scaler
+
+def fold_scaler(weights, bias, scaler):
+    """Fold (x - mean) / scale into the linear weights and bias"""
+    if scaler is None:
+        return weights, bias
+    folded_weights = weights / scaler.scale_
+    folded_bias = bias - np.dot(folded_weights, scaler.mean_)
+    return folded_weights, folded_bias
+
+def convert_svm_to_ov_directly(model_path='pothole_model.pkl', scaler_path='pothole_scaler.pkl',
+                               xml_path="pothole_ov_model.xml", fp16=False):
+    """Export the linear SVM as MatMul -> Add -> Sigmoid on raw features.
     
-    # Get model parameters
-    weights = svm.coef_[0]
-    bias = svm.intercept_[0]
+    The input has a dynamic batch dimension, and the scaler is folded into the
+    weights so serving needs no separate normalization pass. The weights and
+    bias are the only constants, stored in that order at the start of the .bin.
+    """
+    svm, scaler = load_svm_and_scaler(model_path, scaler_path)
+    weights, bias = fold_scaler(svm.coef_[0], svm.intercept_[0], scaler)
     num_features = len(weights)
     
-    # Create a simple XML representation of the model
-    xml_content = f"""<?xml version="1.0" ?>
-<net name="SVM" version="10">
-    <layers>
-        <layer id="0" name="input" type="Parameter" version="opset1">
-            <data element_type="f32" shape="1,{num_features}"/>
-            <output>
-                <port id="0" precision="FP32"/>
-            </output>
-        </layer>
-        <layer id="1" name="weights" type="Const" version="opset1">
-            <data element_type="f32" offset="0" shape="{num_features},1" size="{4*num_features}"/>
-            <output>
-                <port id="1" precision="FP32"/>
-            </output>
-        </layer>
-        <layer id="2" name="MatMul" type="MatMul" version="opset1">
-            <input>
-                <port id="0"/>
-                <port id="1"/>
-            </input>
-            <output>
-                <port id="2" precision="FP32"/>
-            </output>
-        </layer>
-        <layer id="3" name="bias" type="Const" version="opset1">
-            <data element_type="f32" offset="{4*num_features}" shape="1,1" size="4"/>
-            <output>
-                <port id="3" precision="FP32"/>
-            </output>
-        </layer>
-        <layer id="4" name="Add" type="Add" version="opset1">
-            <input>
-                <port id="0"/>
-                <port id="1"/>
-            </input>
-            <output>
-                <port id="2" precision="FP32"/>
-            </output>
-        </layer>
-        <layer id="5" name="Sigmoid" type="Sigmoid" version="opset1">
-            <input>
-                <port id="0"/>
-            </input>
-            <output>
-                <port id="1" precision="FP32"/>
-            </output>
-        </layer>
-    </layers>
-    <edges>
-        <edge from-layer="0" from-port="0" to-layer="2" to-port="0"/>
-        <edge from-layer="1" from-port="1" to-layer="2" to-port="1"/>
-        <edge from-layer="2" from-port="2" to-layer="4" to-port="0"/>
-        <edge from-layer="3" from-port="3" to-layer="4" to-port="1"/>
-        <edge from-layer="4" from-port="2" to-layer="5" to-port="0"/>
-    </edges>
-</net>
-"""
+    features = ops.parameter([-1, num_features], ov.Type.f32, name="input")
+    weights_node = ops.constant(weights.astype(np.float32).reshape(num_features, 1), name="weights")
+    bias_node = ops.constant(np.array([[bias]], dtype=np.float32), name="bias")
+    logits = ops.add(ops.matmul(features, weights_node, False, False), bias_node, name="Add")
+    output = ops.sigmoid(logits, name="Sigmoid")
+    output.output(0).get_tensor().set_names({"confidence"})
+    model = ov.Model([output], [features], "SVM")
     
-    # Write XML to file
-    with open("pothole_ov_model.xml", "w") as f:
-        f.write(xml_content)
+    ov.save_model(model, xml_path, compress_to_fp16=False)
+    written = [xml_path]
+    if fp16:
+        fp16_path = xml_path.replace('.xml', '_fp16.xml')
+        ov.save_model(model, fp16_path, compress_to_fp16=True)
+        written.append(fp16_path)
     
-    # Create binary file with weights and bias
-    with open("pothole_ov_model.bin", "wb") as f:
-        f.write(weights.astype(np.float32).tobytes())
-        f.write(np.array([bias], dtype=np.float32).tobytes())
+    print(f"Model conversion completed: {', '.join(written)}")
+    return svm, scaler, written
+
+def verify_export(xml_path, svm, scaler, X, batch_sizes=(1, 7, 64, 1024), tolerance=1e-5):
+    """Compare OV confidences with sigmoid(svm.decision_function(scaler.transform(X)))
+    on a held-out feature matrix, split into batches of each size"""
+    compiled = ov.Core().compile_model(xml_path, "CPU", CPU_CONFIG)
+    X_scaled = scaler.transform(X) if scaler is not None else X
+    expected = 1.0 / (1.0 + np.exp(-svm.decision_function(X_scaled)))
     
-    print("Model conversion completed via direct XML writing")
+    ok = True
+    for batch_size in batch_sizes:
+        actual = np.concatenate([
+            compiled(X[start:start + batch_size].astype(np.float32))[0][:, 0]
+            for start in range(0, len(X), batch_size)
+        ])
+        max_diff = np.abs(actual - expected).max()
+        # Windows within the tolerance of the 0.5 threshold may legitimately flip
+        clear = np.abs(expected - 0.5) > tolerance
+        decisions_match = np.array_equal((actual > 0.5)[clear], (expected > 0.5)[clear])
+        passed = max_diff <= tolerance and decisions_match
+        ok = ok and passed
+        print(f"  {xml_path} batch {batch_size:>5}: max |diff| {max_diff:.2e}, "
+              f"decisions {'match' if decisions_match else 'DIFFER'} -> {'OK' if passed else 'FAIL'}")
+    return ok
+
+def holdout_features(scaler, num_features, rows=4096, path=None, pothole_rate=0.3):
+    """Held-out features for verify_export.
+
+    From a .npy file if given. Otherwise, for a model over the server's
+    layout, the features the server would compute for freshly generated
+    12-channel windows, so the check covers the distribution the model
+    serves. Only for another layout does it fall back to random rows drawn
+    around the scaler's statistics, and says so.
+    """
+    if path:
+        print(f"Held-out features: {path}")
+        return np.load(path)
+    if num_features == NUM_FEATURES:
+        from features import extract_features_batch
+        from road_data_generator import RoadDataGenerator
+        
+        windows, potholes = RoadDataGenerator().generate_windows(rows, pothole_rate, np.random.default_rng(0))
+        print(f"Held-out features: {rows} generated drive-log windows ({int(potholes.sum())} with a pothole)")
+        return extract_features_batch(windows)
+    print(f"WARNING: no held-out features for a {num_features}-feature model; verifying on random rows "
+          f"around the scaler's statistics, which do not follow the served distribution. "
+          f"Pass --holdout features.npy for a real check.")
+    rng = np.random.default_rng(0)
+    X = rng.standard_normal((rows, num_features))
+    if scaler is not None:
+        X = X * scaler.scale_ + scaler.mean_
+    return X
+
+def _const(values):
+    return ops.constant(np.asarray(values, dtype=np.float32))
+
+def convert_kernel_approximation_to_ov(analyzer, xml_path="pothole_rbf_model.xml"):
+    """Export a RoadDataAnalyzer trained with kernel_approximation='rff' or 'nystroem'.
+    
+    The graph takes raw (unscaled) features with a dynamic batch dimension:
+    the StandardScaler is folded into the first layer, and the feature map's
+    output scaling into the linear head, so inference is a couple of dense
+    layers whose cost does not depend on the number of training samples.
+    """
+    scaler, feature_map, head = analyzer.scaler, analyzer.feature_map, analyzer.model
+    num_features = len(scaler.mean_)
+    inv_scale = 1.0 / scaler.scale_
+    head_weights = head.coef_[0]
+    
+    features = ops.parameter([-1, num_features], ov.Type.f32, name="input")
+    if isinstance(feature_map, RBFSampler):
+        # z = sqrt(2/D) * cos(((x - mean) / scale) @ W + offset)
+        weights = feature_map.random_weights_ * inv_scale[:, np.newaxis]
+        offset = feature_map.random_offset_ - (scaler.mean_ * inv_scale) @ feature_map.random_weights_
+        hidden = ops.cos(ops.add(ops.matmul(features, _const(weights), False, False), _const(offset[np.newaxis])))
+        head_weights = np.sqrt(2.0 / feature_map.n_components) * head_weights
+    else:
+        # Nystroem: z = exp(-gamma * ||x_scaled - c||^2) @ normalization.T
+        scaled = ops.multiply(ops.subtract(features, _const(scaler.mean_[np.newaxis])),
+                              _const(inv_scale[np.newaxis]))
+        components = feature_map.components_
+        feature_axis = ops.constant(np.array([1], dtype=np.int64))
+        squared_norm = ops.reduce_sum(ops.multiply(scaled, scaled), feature_axis, True)
+        cross = ops.matmul(scaled, _const(components.T), False, False)
+        sq_distance = ops.add(ops.subtract(squared_norm, ops.multiply(cross, _const(2.0))),
+                              _const((components ** 2).sum(axis=1)[np.newaxis]))
+        sq_distance = ops.maximum(sq_distance, _const(0.0))
+        hidden = ops.exp(ops.multiply(sq_distance, _const(-feature_map.gamma)))
+        head_weights = feature_map.normalization_.T @ head_weights
+    
+    logits = ops.add(ops.matmul(hidden, _const(head_weights[:, np.newaxis]), False, False),
+                     _const([[head.intercept_[0]]]))
+    output = ops.sigmoid(logits)
+    output.output(0).get_tensor().set_names({"confidence"})
+    model = ov.Model([output], [features], "RBFApproximation")
+    ov.save_model(model, xml_path, compress_to_fp16=False)
+    print(f"Kernel-approximated model written to {xml_path}")
+    if num_features != NUM_FEATURES:
+        print(f"Note: it takes the analyzer's {num_features} features, not the server's {NUM_FEATURES}, "
+              f"so /api/model and POTHOLE_MODEL will refuse it")
+    return xml_path
+
+def compare_kernel_approximation(data_path, method='rff', n_components=256,
+                                 xml_path="pothole_rbf_model.xml", batch_sizes=(1, 64, 1024)):
+    """Train exact and approximated RBF models on the same split, export the approximation,
+    and report the accuracy gap and per-batch latency of the exact SVC against the OV graph"""
+    from road_data_analyzer import FeatureCache, RoadDataAnalyzer
+    
+    exact = RoadDataAnalyzer(feature_cache=FeatureCache())
+    exact.load_data(data_path)
+    X, y = exact.prepare_training_data()
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+    exact.fit(X_train, y_train)
+    
+    approx = RoadDataAnalyzer(kernel_approximation=method, n_components=n_components)
+    approx.fit(X_train, y_train)
+    convert_kernel_approximation_to_ov(approx, xml_path)
+    # The classifier, scaler and fitted feature map that reproduce the IR
+    base = os.path.splitext(xml_path)[0]
+    approx.save_model(f'{base}.pkl', f'{base}_scaler.pkl', f'{base}_feature_map.pkl')
+    compiled = ov.Core().compile_model(xml_path, "CPU", CPU_CONFIG)
+    
+    X_test32 = X_test.to_numpy(dtype=np.float32)
+    ov_confidence = compiled(X_test32)[0][:, 0]
+    exact_accuracy = (exact.predict(X_test) == y_test).mean()
+    approx_accuracy = ((ov_confidence > 0.5).astype(int) == y_test).mean()
+    sklearn_agreement = ((ov_confidence > 0.5).astype(int) == approx.predict(X_test)).mean()
+    
+    print(f"\nSupport vectors in exact SVC: {exact.model.support_vectors_.shape[0]}")
+    print(f"Exact RBF SVC accuracy:       {exact_accuracy:.4f}")
+    print(f"{method} ({n_components}) OV accuracy:  {approx_accuracy:.4f}  (gap {exact_accuracy - approx_accuracy:+.4f})")
+    print(f"OV vs sklearn approximation agreement: {sklearn_agreement:.4f}")
+    
+    print(f"\n{'batch':>6} {'svc_ms':>9} {'ov_ms':>9}")
+    rng = np.random.default_rng(0)
+    for batch_size in batch_sizes:
+        rows = rng.integers(0, len(X_test32), batch_size)
+        batch = X_test32[rows]
+        frame = X_test.iloc[rows]
+        repeats = max(3, 2000 // batch_size)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            exact.decision_function(frame)
+        svc_time = (time.perf_counter() - start) / repeats
+        start = time.perf_counter()
+        for _ in range(repeats):
+            compiled(batch)
+        ov_time = (time.perf_counter() - start) / repeats
+        print(f"{batch_size:>6} {svc_time * 1000:>9.3f} {ov_time * 1000:>9.3f}")
 
 if __name__ == "__main__":
-    convert_svm_to_ov_directly()
+    parser = argparse.ArgumentParser(description="Export the trained pothole model to OpenVINO IR")
+    parser.add_argument('--rbf-approximation', choices=['rff', 'nystroem'],
+                        help="Train and export a kernel-approximated RBF model from --data instead "
+                             "of converting pothole_model.pkl")
+    parser.add_argument('--data', default='synthetic_road_data.csv')
+    parser.add_argument('--components', type=int, default=256)
+    parser.add_argument('--output', default=None,
+                        help="IR path (default pothole_ov_model.xml, or pothole_rbf_model.xml with --rbf-approximation)")
+    parser.add_argument('--model', default='pothole_model.pkl')
+    parser.add_argument('--scaler', default='pothole_scaler.pkl')
+    parser.add_argument('--fp16', action='store_true', help="Also write an FP16-weight variant (*_fp16.xml)")
+    parser.add_argument('--holdout', help="Held-out feature matrix (.npy) used to verify the export "
+                                          "(default: features of generated 12-channel drive-log windows)")
+    args = parser.parse_args()
+    
+    if args.rbf_approximation:
+        compare_kernel_approximation(args.data, args.rbf_approximation, args.components,
+                                     args.output or 'pothole_rbf_model.xml')
+    else:
+        svm, scaler, written = convert_svm_to_ov_directly(args.model, args.scaler,
+                                                          args.output or 'pothole_ov_model.xml', args.fp16)
+        X = holdout_features(scaler, svm.coef_.shape[1], path=args.holdout)
+        print("Verifying export against the sklearn pipeline:")
+        ok = verify_export(written[0], svm, scaler, X)
+        if args.fp16:
+            # FP16 weights carry ~3 significant digits
+            ok = verify_export(written[1], svm, scaler, X, tolerance=1e-2) and ok
+        if not ok:
+            raise SystemExit("Export verification failed")
+
@@ -0,0 +1,162 @@
+import threading
+import time
+from operator import itemgetter
+
+import numpy as np
+
+NUM_FEATURES = 34
+# Bumped whenever the feature layout below changes; devices that compute
+# features themselves send it with every vector
+FEATURE_SCHEMA_VERSION = 1
+# Device-computed features agree with the server's within this (single-pass
+# float32 std on the ESP32 against float64 here)
+AUDIT_RTOL = 1e-3
+AUDIT_ATOL = 1e-3
+
+# Channel order of the (windows, samples, 12) sensor array
+ACC_CHANNELS = ['acc_x1', 'acc_y1', 'acc_z1', 'acc_x2', 'acc_y2', 'acc_z2']
+GYRO_CHANNELS = ['gyr_x1', 'gyr_y1', 'gyr_z1', 'gyr_x2', 'gyr_y2', 'gyr_z2']
+CHANNELS = ACC_CHANNELS + GYRO_CHANNELS
+
+_get_channels = itemgetter(*CHANNELS)
+
+
+def samples_to_array(samples):
+    """Convert a list of sample dicts (the /api/detect JSON layout) into a (samples, 12) array.
+
+    JSON numbers are kept as float64, as the per-sample loop read them;
+    rounding them to float32 first would change the features. Raises KeyError
+    for a sample missing a channel and ValueError for a value that is not a number.
+    """
+    rows = np.array([_get_channels(sample) for sample in samples])
+    # Strings, None and nested lists leave a non-numeric or ragged array behind
+    if rows.ndim != 2 or rows.dtype.kind not in 'iuf':
+        raise ValueError("Sample values must be numbers")
+    return rows.astype(np.float64, copy=False)
+
+
+def windows_to_array(windows):
+    """Stack several sample-dict windows into one (windows, samples, 12) float64 array"""
+    return np.stack([samples_to_array(samples) for samples in windows])
+
+
+def extract_features_batch(windows):
+    """Compute the 34-feature vectors for a (windows, samples, 12) array in one pass.
+
+    Layout per window:
+      0-23  min, max, mean, std of each accelerometer axis (ACC_CHANNELS order)
+      24-27 mag1_max, mag2_max, mag1_std, mag2_std
+      28-33 std of each gyroscope axis (GYRO_CHANNELS order)
+
+    Reductions accumulate in float64, as the per-sample Python version did,
+    and the result is rounded to float32 once at the end.
+    """
+    windows = np.asarray(windows)
+    if windows.ndim == 2:
+        windows = windows[np.newaxis]
+    n_windows = windows.shape[0]
+    features = np.empty((n_windows, NUM_FEATURES), dtype=np.float32)
+
+    acc = windows[:, :, :6]
+    acc_stats = features[:, :24].reshape(n_windows, 6, 4)
+    acc_stats[:, :, 0] = acc.min(axis=1)
+    acc_stats[:, :, 1] = acc.max(axis=1)
+    acc_stats[:, :, 2] = acc.mean(axis=1, dtype=np.float64)
+    acc_stats[:, :, 3] = acc.std(axis=1, dtype=np.float64)
+
+    # Per-sample magnitude of each sensor: (windows, samples, 2)
+    acc64 = acc.astype(np.float64).reshape(n_windows, -1, 2, 3)
+    squared = acc64 * acc64
+    magnitudes = np.sqrt(squared[..., 0] + squared[..., 1] + squared[..., 2])
+    features[:, 24:26] = magnitudes.max(axis=1)
+    features[:, 26:28] = magnitudes.std(axis=1)
+
+    features[:, 28:34] = windows[:, :, 6:].std(axis=1, dtype=np.float64)
+    return features
+
+
+class FeatureAudit:
+    """Compare device-computed feature vectors with a server recomputation from the raw window"""
+
+    def __init__(self, rtol=AUDIT_RTOL, atol=AUDIT_ATOL):
+        self.rtol = rtol
+        self.atol = atol
+        self.audits = 0
+        self.mismatches = 0
+        self.max_abs_diff = np.zeros(NUM_FEATURES, dtype=np.float64)
+        self._lock = threading.Lock()
+
+    def check(self, device_features, window):
+        """Recompute the features of window; returns True when they match the device's"""
+        expected = extract_features_batch(window)[0]
+        diff = np.abs(np.asarray(device_features, dtype=np.float64) - expected)
+        match = bool(np.all(diff <= self.atol + self.rtol * np.abs(expected)))
+        with self._lock:
+            self.audits += 1
+            self.mismatches += not match
+            np.maximum(self.max_abs_diff, diff, out=self.max_abs_diff)
+        return match
+
+    def status(self):
+        with self._lock:
+            worst = int(np.argmax(self.max_abs_diff))
+            return {
+                'audits': self.audits,
+                'mismatches': self.mismatches,
+                'max_abs_diff': float(self.max_abs_diff[worst]),
+                'worst_feature': worst,
+            }
+
+
+def _reference_features(samples):
+    """The original per-sample loop from app.extract_features, kept for comparison"""
+    features = np.zeros(NUM_FEATURES, dtype=np.float32)
+    feat_idx = 0
+    for axis in ACC_CHANNELS:
+        values = [sample[axis] for sample in samples]
+        features[feat_idx] = min(values)
+        features[feat_idx+1] = max(values)
+        features[feat_idx+2] = sum(values) / len(values)
+        features[feat_idx+3] = np.std(values)
+        feat_idx += 4
+    mag1_values = [np.sqrt(s['acc_x1']**2 + s['acc_y1']**2 + s['acc_z1']**2) for s in samples]
+    mag2_values = [np.sqrt(s['acc_x2']**2 + s['acc_y2']**2 + s['acc_z2']**2) for s in samples]
+    features[feat_idx] = max(mag1_values)
+    features[feat_idx+1] = max(mag2_values)
+    features[feat_idx+2] = np.std(mag1_values)
+    features[feat_idx+3] = np.std(mag2_values)
+    feat_idx += 4
+    for axis in GYRO_CHANNELS:
+        features[feat_idx] = np.std([sample[axis] for sample in samples])
+        feat_idx += 1
+    return features
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    window_size = 50
+
+    # json: float64 decimals as /api/detect parses them, through samples_to_array;
+    # device: float32 readings as the ESP32 and the binary wire format carry them
+    print(f"{'input':>6} {'windows':>8} {'loop_us/window':>15} {'kernel_us/window':>17} {'max_abs_diff':>13}")
+    for source in ['json', 'device']:
+        for n_windows in [1, 64, 4096]:
+            data = rng.standard_normal((n_windows, window_size, len(CHANNELS)))
+            if source == 'device':
+                data = data.astype(np.float32)
+            samples = [[dict(zip(CHANNELS, map(float, row))) for row in window] for window in data]
+
+            start = time.perf_counter()
+            expected = np.stack([_reference_features(window) for window in samples])
+            loop_time = time.perf_counter() - start
+
+            windows = windows_to_array(samples) if source == 'json' else data
+            repeats = max(1, 4096 // n_windows)
+            start = time.perf_counter()
+            for _ in range(repeats):
+                actual = extract_features_batch(windows)
+            kernel_time = (time.perf_counter() - start) / repeats
+
+            diff = np.abs(actual - expected).max()
+            print(f"{source:>6} {n_windows:>8} {loop_time / n_windows * 1e6:>15.1f} "
+                  f"{kernel_time / n_windows * 1e6:>17.2f} {diff:>13.2e}")
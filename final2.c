@@ -52,6 +52,14 @@ SensorData buffer[WINDOW_SIZE];
 int buffer_index = 0;
 bool buffer_filled = false;
 
+// Binary upload format shared with wire_format.py on the server
+const uint8_t WIRE_FORMAT_VERSION = 1;
+const int WIRE_HEADER_SIZE = 24;
+// Layout of features[] below; must match features.FEATURE_SCHEMA_VERSION on the server
+const uint8_t FEATURE_SCHEMA_VERSION = 1;
+// Attach the raw window to every Nth report so the server can audit our features (0 = never)
+const int AUDIT_EVERY_N_REPORTS = 20;
+
 // GPS variables
 float current_lat = 0.0;
 float current_lng = 0.0;
@@ -286,42 +294,57 @@ void send_pothole_to_server() {
   }
 
   Serial.println("Sending pothole data to server...");
-  // Create JSON payload
-  StaticJsonDocument<1024> doc;
-  JsonArray accelerometer_data = doc.createNestedArray("accelerometer_data");
-  
-  // Add last 50 samples to the payload
-  for (int i = 0; i < WINDOW_SIZE; i++) {
-    JsonObject sample = accelerometer_data.createNestedObject();
+  // Binary payload (see wire_format.py): 24-byte header + NUM_FEATURES float32,
+  // followed on audited reports by the WINDOW_SIZE x 12 float32 raw window.
+  // The ESP32 is little-endian, so fields are copied as-is.
+  const uint16_t num_channels = 12;
+  static uint8_t payload[WIRE_HEADER_SIZE + (NUM_FEATURES + WINDOW_SIZE * 12) * sizeof(float)];
+  static int reports_sent = 0;
+  bool audit = AUDIT_EVERY_N_REPORTS > 0 && reports_sent % AUDIT_EVERY_N_REPORTS == 0;
+  reports_sent++;
+
+  double lat = current_lat;
+  double lng = current_lng;
+  uint16_t num_features = NUM_FEATURES;
+  uint16_t num_samples = audit ? WINDOW_SIZE : 0;
+  payload[0] = 'P';
+  payload[1] = 'F';
+  payload[2] = WIRE_FORMAT_VERSION;
+  payload[3] = FEATURE_SCHEMA_VERSION;
+  memcpy(payload + 4, &lat, sizeof(double));
+  memcpy(payload + 12, &lng, sizeof(double));
+  memcpy(payload + 20, &num_features, sizeof(uint16_t));
+  memcpy(payload + 22, &num_samples, sizeof(uint16_t));
+
+  // Features from extract_features(), already computed for detect_pothole()
+  memcpy(payload + WIRE_HEADER_SIZE, features, NUM_FEATURES * sizeof(float));
+
+  // Audit window: last 50 samples, oldest first, channels in the server's CHANNELS order
+  float* samples = (float*)(payload + WIRE_HEADER_SIZE + NUM_FEATURES * sizeof(float));
+  for (int i = 0; i < num_samples; i++) {
     int idx = (buffer_index + i) % WINDOW_SIZE;
-    sample["acc_x1"] = buffer[idx].acc_x1;
-    sample["acc_y1"] = buffer[idx].acc_y1;
-    sample["acc_z1"] = buffer[idx].acc_z1;
-    sample["acc_x2"] = buffer[idx].acc_x2;
-    sample["acc_y2"] = buffer[idx].acc_y2;
-    sample["acc_z2"] = buffer[idx].acc_z2;
-    sample["gyr_x1"] = buffer[idx].gyr_x1;
-    sample["gyr_y1"] = buffer[idx].gyr_y1;
-    sample["gyr_z1"] = buffer[idx].gyr_z1;
-    sample["gyr_x2"] = buffer[idx].gyr_x2;
-    sample["gyr_y2"] = buffer[idx].gyr_y2;
-    sample["gyr_z2"] = buffer[idx].gyr_z2;
+    float* row = samples + i * num_channels;
+    row[0] = buffer[idx].acc_x1;
+    row[1] = buffer[idx].acc_y1;
+    row[2] = buffer[idx].acc_z1;
+    row[3] = buffer[idx].acc_x2;
+    row[4] = buffer[idx].acc_y2;
+    row[5] = buffer[idx].acc_z2;
+    row[6] = buffer[idx].gyr_x1;
+    row[7] = buffer[idx].gyr_y1;
+    row[8] = buffer[idx].gyr_z1;
+    row[9] = buffer[idx].gyr_x2;
+    row[10] = buffer[idx].gyr_y2;
+    row[11] = buffer[idx].gyr_z2;
   }
-
-  // Add GPS coordinates
-  doc["latitude"] = current_lat;
-  doc["longitude"] = current_lng;
-  
-  // Serialize JSON
-  String json;
-  serializeJson(doc, json);
+  size_t payload_size = WIRE_HEADER_SIZE + (NUM_FEATURES + num_samples * num_channels) * sizeof(float);
   
   // Send HTTP POST request
   HTTPClient http;
   http.begin("http://your-server-ip:5000/api/detect");
-  http.addHeader("Content-Type", "application/json");
+  http.addHeader("Content-Type", "application/x-pothole-features");
   
-  int httpResponseCode = http.POST(json);
+  int httpResponseCode = http.POST(payload, payload_size);
   if (httpResponseCode > 0) {
     String response = http.getString();
     Serial.println("HTTP Response code: " + String(httpResponseCode));
@@ -0,0 +1,380 @@
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+from urllib.parse import urlsplit
+
+import numpy as np
+
+import wire_format
+from features import CHANNELS, extract_features_batch
+
+# Simulated ESP32 fleet for sizing servers. Each device drives its own synthetic
+# route and posts a 50-sample, 12-channel window to /api/detect every 1/rate
+# seconds, over a shared pool of keep-alive connections:
+#
+#   python fleet.py --url http://localhost:5000 --devices 2000 --rate 2 --profile ramp
+#   python fleet.py --devices 500 --profile soak --output soak.json
+#
+# Every --interval seconds a line reports the achieved throughput, the error
+# rate and latency percentiles; --output keeps the whole series as JSON.
+SAMPLE_RATE_HZ = 100
+WINDOW_SIZE = 50
+# Reports per second per device; final2.c produces a new window every 0.5 s
+DEFAULT_RATE = 2.0
+# Share of reports whose window holds a pothole
+DEFAULT_POTHOLE_RATE = 0.05
+DEFAULT_CONNECTIONS = 64
+DEFAULT_TIMEOUT_S = 10.0
+DEFAULT_INTERVAL_S = 5.0
+# Distinct windows generated up front; payloads are packed from them at send time
+# so the generator's own CPU use stays small next to the server's
+WINDOW_POOL = 512
+# Attach the raw window to every Nth features report, as final2.c does
+AUDIT_EVERY_N_REPORTS = 20
+# Routes start within ROUTE_SPREAD_DEG of ORIGIN and turn back when they leave that box
+ORIGIN = (13.0827, 80.2707)
+ROUTE_SPREAD_DEG = 0.1
+SPEED_M_S = (5.0, 20.0)
+# Heading random walk, radians per sqrt(second)
+HEADING_DRIFT = 0.05
+GPS_NOISE_M = 3.0
+EARTH_RADIUS_M = 6371000.0
+# Run-wide latency histogram: log-spaced from 100 us to 100 s, about 1% wide
+LATENCY_EDGES = np.geomspace(1e-4, 100.0, 1390)
+SEED = 0
+
+# Load profiles: how long the devices take to come online, and how long the run lasts
+PROFILES = {
+    # Devices come online linearly over the whole run, to find where latency turns up
+    'ramp': {'ramp_s': None, 'duration_s': 300},
+    # Every device online within the first minute, then held, to catch leaks and drift
+    'soak': {'ramp_s': 60, 'duration_s': 3600},
+}
+
+
+def synthetic_windows(count, pothole_rate, window_size=WINDOW_SIZE, sampling_rate=SAMPLE_RATE_HZ, seed=SEED):
+    """(count, window_size, 12) windows from RoadDataGenerator's road and pothole models, and which hold a pothole"""
+    from road_data_generator import RoadDataGenerator
+
+    return RoadDataGenerator(sampling_rate).generate_windows(
+        count, pothole_rate, np.random.default_rng(seed), window_size)
+
+
+class Payloads:
+    """Packs /api/detect bodies in one of the wire formats from a pool of windows"""
+
+    def __init__(self, kind, windows, audit_every=AUDIT_EVERY_N_REPORTS):
+        self.kind = kind
+        self.windows = windows
+        self.audit_every = audit_every
+        if kind == 'features':
+            self.content_type = wire_format.FEATURES_CONTENT_TYPE
+            self.features = extract_features_batch(windows)
+        elif kind == 'window':
+            self.content_type = wire_format.CONTENT_TYPE
+        else:
+            self.content_type = 'application/json'
+            self.samples_json = [json.dumps([dict(zip(CHANNELS, map(float, sample))) for sample in window])
+                                 for window in windows]
+
+    def build(self, lat, lng, index, report):
+        """Body for the index-th pooled window sent as a device's report-th report"""
+        if self.kind == 'features':
+            audited = self.audit_every and report % self.audit_every == self.audit_every - 1
+            return wire_format.encode_features(lat, lng, self.features[index],
+                                               self.windows[index] if audited else None)
+        if self.kind == 'window':
+            return wire_format.encode_window(lat, lng, self.windows[index])
+        return (f'{{"accelerometer_data": {self.samples_json[index]}, '
+                f'"latitude": {lat!r}, "longitude": {lng!r}}}').encode()
+
+
+class Route:
+    """A device's position: constant speed along a slowly wandering heading"""
+
+    def __init__(self, rng):
+        self.rng = rng
+        self.lat = ORIGIN[0] + rng.uniform(-ROUTE_SPREAD_DEG, ROUTE_SPREAD_DEG)
+        self.lng = ORIGIN[1] + rng.uniform(-ROUTE_SPREAD_DEG, ROUTE_SPREAD_DEG)
+        self.heading = rng.uniform(0, 2 * math.pi)
+        self.speed = rng.uniform(*SPEED_M_S)
+
+    def advance(self, seconds):
+        self.heading += self.rng.gauss(0, HEADING_DRIFT * math.sqrt(seconds))
+        if abs(self.lat - ORIGIN[0]) > ROUTE_SPREAD_DEG or abs(self.lng - ORIGIN[1]) > ROUTE_SPREAD_DEG:
+            self.heading = math.atan2(ORIGIN[1] - self.lng, ORIGIN[0] - self.lat)
+        distance = self.speed * seconds
+        self.lat += math.degrees(distance * math.cos(self.heading) / EARTH_RADIUS_M)
+        self.lng += math.degrees(distance * math.sin(self.heading)
+                                 / (EARTH_RADIUS_M * math.cos(math.radians(self.lat))))
+
+    def fix(self):
+        """The position as a GPS receiver reports it"""
+        noise = math.degrees(GPS_NOISE_M / EARTH_RADIUS_M)
+        return self.lat + self.rng.gauss(0, noise), self.lng + self.rng.gauss(0, noise)
+
+
+class ConnectionPool:
+    """At most `size` keep-alive HTTP/1.1 connections to one server, shared by every device.
+
+    A request waits for a free slot, reuses an idle connection when there is
+    one, and puts it back unless the server asked to close it.
+    """
+
+    def __init__(self, host, port, size):
+        self.host = host
+        self.port = port
+        self._slots = asyncio.Semaphore(size)
+        self._idle = []
+        self.opened = 0
+
+    async def post(self, path, content_type, body):
+        """POST body and return (status, response body)"""
+        head = (f'POST {path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n'
+                f'Content-Type: {content_type}\r\nContent-Length: {len(body)}\r\n\r\n').encode()
+        async with self._slots:
+            while self._idle:
+                connection = self._idle.pop()
+                try:
+                    return await self._exchange(connection, head + body)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    # The server dropped the idle connection; try the next one
+                    continue
+            self.opened += 1
+            connection = await asyncio.open_connection(self.host, self.port)
+            return await self._exchange(connection, head + body)
+
+    async def _exchange(self, connection, request):
+        reader, writer = connection
+        try:
+            writer.write(request)
+            status_line = await reader.readuntil(b'\r\n')
+            headers = {}
+            while True:
+                line = await reader.readuntil(b'\r\n')
+                if line == b'\r\n':
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip().lower()
+            version, status = status_line.split(None, 2)[:2]
+            if 'content-length' in headers:
+                body = await reader.readexactly(int(headers['content-length']))
+            elif headers.get('transfer-encoding') == 'chunked':
+                body = b''
+                while size := int((await reader.readuntil(b'\r\n')).split(b';')[0], 16):
+                    body += (await reader.readexactly(size + 2))[:-2]
+                await reader.readuntil(b'\r\n')
+            else:
+                body = await reader.read()
+                headers['connection'] = 'close'
+        except BaseException:
+            writer.close()
+            raise
+        if version == b'HTTP/1.1' and headers.get('connection') != 'close':
+            self._idle.append(connection)
+        else:
+            writer.close()
+        return int(status), body
+
+    def close(self):
+        for _, writer in self._idle:
+            writer.close()
+        self._idle.clear()
+
+
+class FleetStats:
+    """Per-interval counts and latencies, plus run-wide totals"""
+
+    def __init__(self):
+        self.total_latency = np.zeros(len(LATENCY_EDGES) + 1, dtype=np.int64)
+        self.totals = {'sent': 0, 'ok': 0, 'errors': 0, 'positives': 0, 'late': 0}
+        self.total_errors = {}
+        self._last_elapsed = 0.0
+        self._reset()
+
+    def _reset(self):
+        self.latencies = []
+        self.counts = {'sent': 0, 'ok': 0, 'errors': 0, 'positives': 0, 'late': 0}
+        self.errors = {}
+
+    def record(self, seconds, status=None, body=None, error=None):
+        self.counts['sent'] += 1
+        self.latencies.append(seconds)
+        if error is None and status == 200:
+            self.counts['ok'] += 1
+            if b'"is_pothole":true' in body.replace(b' ', b''):
+                self.counts['positives'] += 1
+            return
+        key = error or f'http_{status}'
+        self.counts['errors'] += 1
+        self.errors[key] = self.errors.get(key, 0) + 1
+
+    def late(self):
+        self.counts['late'] += 1
+
+    def interval(self, elapsed, active, offered):
+        """Summarize the interval that just ended and start the next one"""
+        latencies = np.asarray(self.latencies)
+        row = {'t_s': round(elapsed, 1), 'devices': active, 'offered_per_s': round(offered, 1),
+               **self.counts, 'errors_by_kind': self.errors}
+        row['ok_per_s'] = round(self.counts['ok'] / max(elapsed - self._last_elapsed, 1e-9), 1)
+        row['error_rate'] = round(self.counts['errors'] / max(self.counts['sent'], 1), 4)
+        row.update(_percentiles_ms(latencies))
+        for key, value in self.counts.items():
+            self.totals[key] += value
+        for key, value in self.errors.items():
+            self.total_errors[key] = self.total_errors.get(key, 0) + value
+        np.add.at(self.total_latency, np.searchsorted(LATENCY_EDGES, latencies), 1)
+        self._last_elapsed = elapsed
+        self._reset()
+        return row
+
+    def summary(self, elapsed):
+        totals = dict(self.totals, errors_by_kind=self.total_errors)
+        totals['throughput_per_s'] = round(totals['ok'] / elapsed, 1)
+        totals['error_rate'] = round(totals['errors'] / max(totals['sent'], 1), 4)
+        # Upper edge of the histogram bucket each percentile falls in
+        cumulative = np.cumsum(self.total_latency)
+        for p in (50, 90, 99):
+            if cumulative[-1]:
+                bucket = min(int(np.searchsorted(cumulative, cumulative[-1] * p / 100)), len(LATENCY_EDGES) - 1)
+                totals[f'p{p}_ms'] = round(float(LATENCY_EDGES[bucket]) * 1e3, 2)
+            else:
+                totals[f'p{p}_ms'] = None
+        return totals
+
+
+def _percentiles_ms(latencies):
+    if not len(latencies):
+        return {'p50_ms': None, 'p90_ms': None, 'p99_ms': None}
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99]) * 1e3
+    return {'p50_ms': round(float(p50), 2), 'p90_ms': round(float(p90), 2), 'p99_ms': round(float(p99), 2)}
+
+
+async def run_device(device, start_at, end_at, rate, pool, path, payloads, stats, timeout, active):
+    """One device's report loop: sequential like the firmware, on a fixed schedule"""
+    loop = asyncio.get_running_loop()
+    rng = random.Random(SEED * 1_000_003 + device)
+    route = Route(rng)
+    period = 1.0 / rate
+    await asyncio.sleep(max(0.0, start_at - loop.time()))
+    active[0] += 1
+    last = next_at = loop.time() + rng.uniform(0, period)
+    report = 0
+    try:
+        while True:
+            delay = next_at - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            now = loop.time()
+            if now >= end_at:
+                return
+            route.advance(now - last)
+            last = now
+            body = payloads.build(*route.fix(), rng.randrange(len(payloads.windows)), report)
+            report += 1
+            start = time.perf_counter()
+            try:
+                status, response = await asyncio.wait_for(
+                    pool.post(path, payloads.content_type, body), timeout)
+            except asyncio.TimeoutError:
+                stats.record(time.perf_counter() - start, error='timeout')
+            except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError) as e:
+                stats.record(time.perf_counter() - start, error=type(e).__name__)
+            else:
+                stats.record(time.perf_counter() - start, status, response)
+            next_at += period
+            if next_at < loop.time():
+                # Behind schedule: the server or this generator cannot keep up with the offered rate
+                stats.late()
+                next_at = loop.time()
+    finally:
+        active[0] -= 1
+
+
+async def run_fleet(args, on_interval=None):
+    """Run the fleet described by args and return the per-interval rows and the totals"""
+    url = urlsplit(args.url)
+    path = (url.path.rstrip('/') or '') + '/api/detect'
+    windows, _ = synthetic_windows(WINDOW_POOL, args.pothole_rate)
+    payloads = Payloads(args.payload, windows, args.audit_every)
+    pool = ConnectionPool(url.hostname, url.port or 80, args.connections)
+    stats = FleetStats()
+    active = [0]
+
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    end_at = started + args.duration
+    ramp_s = args.ramp if args.ramp is not None else args.duration
+    devices = [asyncio.create_task(run_device(
+        device, started + ramp_s * device / args.devices, end_at, args.rate, pool, path,
+        payloads, stats, args.timeout, active)) for device in range(args.devices)]
+
+    rows = []
+    while loop.time() < end_at:
+        await asyncio.sleep(min(args.interval, end_at - loop.time()))
+        row = stats.interval(loop.time() - started, active[0], active[0] * args.rate)
+        rows.append(row)
+        if on_interval:
+            on_interval(row)
+    await asyncio.gather(*devices)
+    elapsed = loop.time() - started
+    if stats.counts['sent']:
+        rows.append(stats.interval(elapsed, active[0], 0.0))
+        if on_interval:
+            on_interval(rows[-1])
+    pool.close()
+    totals = stats.summary(elapsed)
+    totals['connections_opened'] = pool.opened
+    return rows, totals
+
+
+def print_row(row):
+    def ms(value):
+        return f'{value:>9.1f}' if value is not None else f'{"-":>9}'
+
+    print(f"{row['t_s']:>7.1f} {row['devices']:>8} {row['offered_per_s']:>10.1f} "
+          f"{row['ok_per_s']:>10.1f} {row['error_rate']:>8.2%} "
+          f"{ms(row['p50_ms'])} {ms(row['p90_ms'])} {ms(row['p99_ms'])} {row['late']:>6}", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated device fleet posting to /api/detect")
+    parser.add_argument('--url', default='http://localhost:5000', help="Server base URL")
+    parser.add_argument('--devices', type=int, default=100)
+    parser.add_argument('--rate', type=float, default=DEFAULT_RATE, help="Reports per second per device")
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='ramp')
+    parser.add_argument('--ramp', type=float, help="Seconds until every device is online (default: per profile)")
+    parser.add_argument('--duration', type=float, help="Run length in seconds (default: per profile)")
+    parser.add_argument('--payload', choices=['features', 'window', 'json'], default='features')
+    parser.add_argument('--audit-every', type=int, default=AUDIT_EVERY_N_REPORTS,
+                        help="Attach the raw window to every Nth features report (0 = never)")
+    parser.add_argument('--pothole-rate', type=float, default=DEFAULT_POTHOLE_RATE)
+    parser.add_argument('--connections', type=int, default=DEFAULT_CONNECTIONS, help="Keep-alive pool size")
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT_S)
+    parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL_S, help="Seconds per report line")
+    parser.add_argument('--output', help="Write the settings, every interval and the totals here as JSON")
+    args = parser.parse_args()
+    profile = PROFILES[args.profile]
+    if args.duration is None:
+        args.duration = profile['duration_s']
+    if args.ramp is None:
+        args.ramp = profile['ramp_s']
+
+    print(f"{'t_s':>7} {'devices':>8} {'offered/s':>10} {'ok/s':>10} {'errors':>8} "
+          f"{'p50_ms':>9} {'p90_ms':>9} {'p99_ms':>9} {'late':>6}")
+    rows, totals = asyncio.run(run_fleet(args, print_row))
+    print(f"{totals['sent']} reports, {totals['throughput_per_s']} ok/s, {totals['error_rate']:.2%} errors "
+          f"{totals['errors_by_kind'] or ''}, p50/p90/p99 {totals['p50_ms']}/{totals['p90_ms']}/{totals['p99_ms']} ms, "
+          f"{totals['positives']} potholes reported, {totals['connections_opened']} connections opened")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'settings': vars(args), 'intervals': rows, 'totals': totals}, f, indent=2)
+        print(f"Wrote {len(rows)} intervals to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,441 @@
+import argparse
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+import openvino as ov
+
+NUM_FEATURES = 34
+
+# Batching settings, overridable from the environment
+MAX_BATCH_SIZE = int(os.environ.get('POTHOLE_BATCH_SIZE', 32))
+MAX_WAIT_MS = float(os.environ.get('POTHOLE_BATCH_WAIT_MS', 2))
+MAX_QUEUE_DEPTH = int(os.environ.get('POTHOLE_QUEUE_DEPTH', 1024))
+NUM_INFER_REQUESTS = int(os.environ.get('POTHOLE_INFER_REQUESTS', 2))
+
+# Inference backend: 'openvino', 'numpy' or 'auto' (fastest in a startup micro-benchmark)
+BACKEND = os.environ.get('POTHOLE_BACKEND', 'auto')
+# Largest confidence difference tolerated between backends before 'auto' refuses to switch
+BACKEND_TOLERANCE = 1e-6
+# Compiled blobs are cached here so warm starts skip compilation ('' disables the cache)
+MODEL_CACHE_DIR = os.environ.get('POTHOLE_MODEL_CACHE', 'model_cache')
+
+
+class InferenceBatcher:
+    """Micro-batch single feature vectors into [N, 34] OpenVINO async requests"""
+
+    def __init__(self, compiled_model, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS,
+                 max_queue_depth=MAX_QUEUE_DEPTH, num_requests=NUM_INFER_REQUESTS):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.pending = queue.Queue(maxsize=max_queue_depth)
+        self.infer_queue = ov.AsyncInferQueue(compiled_model, num_requests)
+        self.infer_queue.set_callback(self._on_batch_done)
+        self._stopped = threading.Event()
+        self._worker = threading.Thread(target=self._run, name='inference-batcher', daemon=True)
+        self._worker.start()
+
+    def submit(self, features):
+        """Queue one feature vector and return a Future for its confidence.
+
+        Raises queue.Full when the queue is at max depth so callers can shed load.
+        """
+        if self._stopped.is_set():
+            raise RuntimeError("InferenceBatcher is closed")
+        future = Future()
+        self.pending.put_nowait((np.asarray(features, dtype=np.float32), future))
+        return future
+
+    def infer(self, features, timeout=1.0):
+        """Blocking helper: submit one vector and wait for its confidence"""
+        return self.submit(features).result(timeout=timeout)
+
+    def queue_depth(self):
+        return self.pending.qsize()
+
+    def close(self):
+        """Stop accepting work, flush what is queued and wait for in-flight batches"""
+        self._stopped.set()
+        self._worker.join()
+        self.infer_queue.wait_all()
+
+    def _collect_batch(self):
+        # Block for the first item, then fill until the batch is full or the deadline passes
+        try:
+            first = self.pending.get(timeout=0.1)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.pending.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not (self._stopped.is_set() and self.pending.empty()):
+            batch = self._collect_batch()
+            if not batch:
+                continue
+            features = np.stack([item[0] for item in batch])
+            futures = [item[1] for item in batch]
+            try:
+                self.infer_queue.start_async({0: features}, futures)
+            except Exception as exc:
+                for future in futures:
+                    future.set_exception(exc)
+
+    @staticmethod
+    def _on_batch_done(request, futures):
+        # Copy out before the request (and its output tensor) is reused
+        confidences = request.get_output_tensor(0).data.reshape(-1).copy()
+        for future, confidence in zip(futures, confidences):
+            future.set_result(float(confidence))
+
+
+def load_batched_model(xml_path="pothole_ov_model.xml", device="CPU", cache_dir=MODEL_CACHE_DIR):
+    """Read the IR and give it a dynamic batch dimension before compiling"""
+    core = ov.Core()
+    model = core.read_model(xml_path)
+    # Only IRs over the server's feature vector can be served; anything else would
+    # fail later with a broadcast error on the first request
+    width = model.input(0).get_partial_shape()[-1]
+    if width.is_static and width.get_length() != NUM_FEATURES:
+        raise ValueError(f"{xml_path} takes {width.get_length()} features per window, but the server computes "
+                         f"{NUM_FEATURES} (features.extract_features_batch)")
+    model.reshape([-1, NUM_FEATURES])
+    # f32 keeps served confidences equal to the sklearn model (CPUs may default to bf16)
+    config = {"INFERENCE_PRECISION_HINT": "f32"}
+    if cache_dir:
+        config["CACHE_DIR"] = cache_dir
+    return core.compile_model(model, device, config)
+
+
+class OpenVINOBackend:
+    """Serve the IR through OpenVINO, micro-batching concurrent requests"""
+
+    name = 'openvino'
+
+    def __init__(self, xml_path="pothole_ov_model.xml", device="CPU", cache_dir=MODEL_CACHE_DIR):
+        self.compiled_model = load_batched_model(xml_path, device, cache_dir)
+        self.batcher = InferenceBatcher(self.compiled_model)
+
+    def infer(self, features, timeout=1.0):
+        return self.batcher.infer(features, timeout=timeout)
+
+    def infer_batch(self, features):
+        # A request per call: the compiled model's shared request is not thread-safe
+        features = np.asarray(features, dtype=np.float32).reshape(-1, NUM_FEATURES)
+        return self.compiled_model.create_infer_request().infer({0: features})[0].reshape(-1)
+
+    def queue_depth(self):
+        return self.batcher.queue_depth()
+
+    def close(self):
+        self.batcher.close()
+
+
+class NumpyBackend:
+    """Evaluate sigmoid(x @ w + b) directly, with the weights read from the IR's .bin.
+
+    The exported graph is a single MatMul, Add and Sigmoid, so its weights file
+    holds the NUM_FEATURES MatMul weights followed by the bias, all float32.
+    Nothing is queued: a call costs a dot product and an exp.
+    """
+
+    name = 'numpy'
+
+    def __init__(self, bin_path="pothole_ov_model.bin"):
+        params = np.fromfile(bin_path, dtype='<f4')
+        if params.size != NUM_FEATURES + 1:
+            raise ValueError(f"{bin_path} holds {params.size} float32 values, expected "
+                             f"{NUM_FEATURES} weights and a bias (an FP16 or non-linear export?)")
+        self.weights = params[:NUM_FEATURES].copy()
+        self.bias = params[NUM_FEATURES]
+
+    def infer(self, features, timeout=None):
+        return float(self.infer_batch(features)[0])
+
+    def infer_batch(self, features):
+        features = np.asarray(features, dtype=np.float32).reshape(-1, NUM_FEATURES)
+        logits = features @ self.weights + self.bias
+        return (1.0 / (1.0 + np.exp(-logits))).astype(np.float32)
+
+    def queue_depth(self):
+        return 0
+
+    def close(self):
+        pass
+
+
+BACKENDS = {backend.name: backend for backend in (OpenVINOBackend, NumpyBackend)}
+
+
+def _time_single_calls(backend, vectors):
+    start = time.perf_counter()
+    for vector in vectors:
+        backend.infer(vector)
+    return (time.perf_counter() - start) / len(vectors)
+
+
+def select_backend(name=BACKEND, xml_path="pothole_ov_model.xml", repeats=200, cache_dir=MODEL_CACHE_DIR):
+    """Build the configured backend, or benchmark all of them and keep the fastest.
+
+    Returns (backend, report); report records the choice, the reason and, for
+    'auto', the per-call latency of each backend and their largest disagreement.
+    """
+    bin_path = os.path.splitext(xml_path)[0] + '.bin'
+    if name != 'auto':
+        if name not in BACKENDS:
+            raise ValueError(f"Unknown inference backend {name!r}, expected one of {sorted(BACKENDS)} or 'auto'")
+        backend = NumpyBackend(bin_path) if name == 'numpy' else OpenVINOBackend(xml_path, cache_dir=cache_dir)
+        return backend, {'backend': backend.name, 'reason': 'configured'}
+
+    candidates = [OpenVINOBackend(xml_path, cache_dir=cache_dir)]
+    try:
+        candidates.append(NumpyBackend(bin_path))
+    except ValueError as e:
+        return candidates[0], {'backend': candidates[0].name, 'reason': str(e)}
+
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((repeats, NUM_FEATURES)).astype(np.float32)
+    outputs = [candidate.infer_batch(vectors) for candidate in candidates]
+    max_diff = float(max(np.abs(output - outputs[0]).max() for output in outputs))
+
+    latencies = {}
+    for candidate in candidates:
+        _time_single_calls(candidate, vectors[:50])  # warm-up
+        latencies[candidate.name] = _time_single_calls(candidate, vectors) * 1e6
+    report = {'latency_us': latencies, 'max_abs_diff': max_diff}
+
+    if max_diff > BACKEND_TOLERANCE:
+        chosen, report['reason'] = candidates[0], f"backends disagree by {max_diff:.2e}"
+    else:
+        chosen = min(candidates, key=lambda candidate: latencies[candidate.name])
+        report['reason'] = 'fastest in startup benchmark'
+    for candidate in candidates:
+        if candidate is not chosen:
+            candidate.close()
+    report['backend'] = chosen.name
+    return chosen, report
+
+
+class _ModelVersion:
+    """One loaded model plus the number of requests currently using it"""
+
+    def __init__(self, xml_path, backend, report, load_ms):
+        self.xml_path = xml_path
+        self.backend = backend
+        self.report = dict(report, xml_path=xml_path, load_ms=load_ms)
+        self.active = 0
+        self.retired = False
+
+
+class ModelRegistry:
+    """Lazily load the served model and swap it for a new IR without a restart.
+
+    Nothing is read or compiled until the first request (or an explicit
+    load()), so importing app.py, the debug reloader's parent and workers that
+    never serve detections pay nothing. swap() builds the new version while the
+    old one keeps serving, then replaces it under a lock. Requests that already
+    hold the old version finish on it, and it is closed once the last of them
+    returns.
+    """
+
+    def __init__(self, xml_path="pothole_ov_model.xml", backend=BACKEND, cache_dir=MODEL_CACHE_DIR):
+        self.xml_path = xml_path
+        self.backend_name = backend
+        self.cache_dir = cache_dir
+        self.swaps = 0
+        self.last_swap = None
+        self._current = None
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    def _build(self, xml_path):
+        start = time.perf_counter()
+        backend, report = select_backend(self.backend_name, xml_path, cache_dir=self.cache_dir)
+        load_ms = (time.perf_counter() - start) * 1000
+        print(f"Loaded {xml_path} on {backend.name} in {load_ms:.1f} ms ({report['reason']})")
+        return _ModelVersion(xml_path, backend, report, load_ms)
+
+    def load(self):
+        """Load the configured model if nothing is loaded yet and return its report"""
+        if self._current is None:
+            with self._load_lock:
+                if self._current is None:
+                    self._current = self._build(self.xml_path)
+        return self._current.report
+
+    def _acquire(self):
+        self.load()
+        with self._lock:
+            version = self._current
+            version.active += 1
+        return version
+
+    def _release(self, version):
+        with self._lock:
+            version.active -= 1
+            close = version.retired and version.active == 0
+        if close:
+            version.backend.close()
+
+    def infer(self, features, timeout=1.0):
+        version = self._acquire()
+        try:
+            return version.backend.infer(features, timeout=timeout)
+        finally:
+            self._release(version)
+
+    def infer_batch(self, features):
+        """Score a (N, 34) array in one call, bypassing the single-window batcher"""
+        version = self._acquire()
+        try:
+            return version.backend.infer_batch(features)
+        finally:
+            self._release(version)
+
+    def swap(self, xml_path):
+        """Load xml_path (and its .bin) and make it the served model.
+
+        Returns a report with the new version's load time and the time the
+        swap itself held the lock. Raises whatever loading raises, in which
+        case the old version keeps serving.
+        """
+        with self._load_lock:
+            version = self._build(xml_path)
+            start = time.perf_counter()
+            with self._lock:
+                old, self._current = self._current, version
+                self.xml_path = xml_path
+                self.swaps += 1
+                close_old = old is not None and old.active == 0
+                if old is not None:
+                    old.retired = True
+            swap_ms = (time.perf_counter() - start) * 1000
+        if close_old:
+            old.backend.close()
+        self.last_swap = {'xml_path': xml_path, 'load_ms': version.report['load_ms'], 'swap_ms': swap_ms,
+                          'previous': old.xml_path if old is not None else None}
+        return self.last_swap
+
+    def status(self):
+        version = self._current
+        if version is None:
+            return {'loaded': False, 'xml_path': self.xml_path}
+        return dict(version.report, loaded=True, queue_depth=version.backend.queue_depth(),
+                    swaps=self.swaps, last_swap=self.last_swap)
+
+    def close(self):
+        with self._lock:
+            version, self._current = self._current, None
+        if version is not None:
+            version.backend.close()
+
+
+def measure_startup(xml_path="pothole_ov_model.xml", cache_dir=MODEL_CACHE_DIR):
+    """Time a cold compile, a cache-warm compile and a registry swap under load"""
+    import shutil
+    import tempfile
+
+    results = {}
+    scratch = tempfile.mkdtemp(prefix='ov-cache-')
+    try:
+        for label in ('cold', 'warm'):
+            start = time.perf_counter()
+            load_batched_model(xml_path, cache_dir=scratch)
+            results[f'{label}_compile_ms'] = (time.perf_counter() - start) * 1000
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    start = time.perf_counter()
+    load_batched_model(xml_path, cache_dir='')
+    results['uncached_compile_ms'] = (time.perf_counter() - start) * 1000
+
+    registry = ModelRegistry(xml_path, backend='openvino', cache_dir=cache_dir)
+    registry.load()
+    stop = threading.Event()
+    vector = np.zeros(NUM_FEATURES, dtype=np.float32)
+    errors = []
+
+    def client():
+        while not stop.is_set():
+            try:
+                registry.infer(vector, timeout=10)
+            except Exception as exc:
+                errors.append(exc)
+
+    threads = [threading.Thread(target=client) for _ in range(8)]
+    for t in threads:
+        t.start()
+    swap = registry.swap(xml_path)
+    stop.set()
+    for t in threads:
+        t.join()
+    registry.close()
+    results.update(swap_load_ms=swap['load_ms'], swap_ms=swap['swap_ms'], failed_requests=len(errors))
+    return results
+
+
+def benchmark(compiled_model, settings, clients=64, requests_per_client=200):
+    """Report throughput and latency percentiles for (batch_size, wait_ms) settings"""
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((clients, NUM_FEATURES)).astype(np.float32)
+    results = []
+
+    for batch_size, wait_ms in settings:
+        batcher = InferenceBatcher(compiled_model, max_batch_size=batch_size, max_wait_ms=wait_ms,
+                                   max_queue_depth=clients * 2)
+        latencies = [[] for _ in range(clients)]
+
+        def client(idx):
+            for _ in range(requests_per_client):
+                start = time.perf_counter()
+                batcher.infer(vectors[idx], timeout=10)
+                latencies[idx].append(time.perf_counter() - start)
+
+        threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+        batcher.close()
+
+        all_latencies = np.concatenate([np.array(l) for l in latencies]) * 1000
+        results.append({
+            'batch_size': batch_size,
+            'wait_ms': wait_ms,
+            'throughput': len(all_latencies) / elapsed,
+            'p50_ms': float(np.percentile(all_latencies, 50)),
+            'p99_ms': float(np.percentile(all_latencies, 99)),
+        })
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inference benchmarks")
+    parser.add_argument('--startup', action='store_true',
+                        help="Measure cold/warm compile time and hot-swap latency instead of batching")
+    args = parser.parse_args()
+
+    if args.startup:
+        for key, value in measure_startup().items():
+            print(f"{key:>20} {value:>10.2f}")
+    else:
+        compiled = load_batched_model()
+        settings = [(1, 0), (8, 1), (32, 2), (64, 5), (128, 10)]
+
+        print(f"{'batch':>6} {'wait_ms':>8} {'req/s':>10} {'p50_ms':>8} {'p99_ms':>8}")
+        for row in benchmark(compiled, settings):
+            print(f"{row['batch_size']:>6} {row['wait_ms']:>8} {row['throughput']:>10.0f} "
+                  f"{row['p50_ms']:>8.2f} {row['p99_ms']:>8.2f}")
@@ -0,0 +1,284 @@
+import bisect
+import os
+import sys
+import threading
+import time
+from collections import Counter as _Tally
+
+# Latency buckets in seconds, 100 us to 2.5 s
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Sampling profiler defaults
+PROFILE_INTERVAL_MS = 5
+# Samples whose innermost frame is in one of these modules are threads waiting for work
+IDLE_MODULES = ('threading.py', 'queue.py', 'thread.py', 'selectors.py', 'socketserver.py', 'socket.py')
+MAX_STACK_DEPTH = 64
+
+
+def _format_labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        """The child for one combination of label values, created on first use"""
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        for values, child in sorted(self._children.items()):
+            lines += child.render(self.name, self.label_names, values)
+        return lines
+
+
+class _CounterChild:
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def render(self, name, names, values):
+        return [f'{name}{_format_labels(names, values)} {_format_value(self.value)}']
+
+
+class Counter(_Metric):
+    """Monotonic count; call .labels(...).inc(), or .inc() when there are no labels"""
+    kind = 'counter'
+    _new_child = _CounterChild
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class _Timer:
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class _HistogramChild:
+    __slots__ = ('bounds', 'counts', 'sum', 'count', '_lock')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self):
+        """Context manager observing the time spent inside it, in seconds"""
+        return _Timer(self)
+
+    def render(self, name, names, values):
+        with self._lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        lines = []
+        cumulative = 0
+        for bound, bucket in zip(self.bounds + (float('inf'),), counts):
+            cumulative += bucket
+            le = 'le="' + _format_value(bound) + '"'
+            lines.append(f'{name}_bucket{_format_labels(names, values, le)} {cumulative}')
+        lines.append(f'{name}_sum{_format_labels(names, values)} {_format_value(total)}')
+        lines.append(f'{name}_count{_format_labels(names, values)} {count}')
+        return lines
+
+
+class Histogram(_Metric):
+    """Fixed-bucket histogram; observations cost a bisect and one short lock"""
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.bounds = tuple(buckets)
+
+    def _new_child(self):
+        return _HistogramChild(self.bounds)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+
+class Gauge(_Metric):
+    """Value read from a callback at scrape time.
+
+    fn returns a number, or a dict of label-value tuples to numbers when the
+    gauge has labels. kind='counter' exposes a callback that reads a count
+    kept elsewhere (e.g. a cache's hit counter).
+    """
+
+    def __init__(self, name, help, fn, labels=(), kind='gauge'):
+        super().__init__(name, help, labels)
+        self.fn = fn
+        self.kind = kind
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        try:
+            value = self.fn()
+        except Exception as e:
+            return lines + [f'# {self.name} unavailable: {_escape(e)}']
+        items = value.items() if isinstance(value, dict) else [((), value)]
+        for values, number in sorted(items):
+            if number is not None:
+                lines.append(f'{self.name}{_format_labels(self.label_names, values)} {_format_value(number)}')
+        return lines
+
+
+class Registry:
+    """The metrics of one process, rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.add(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self.add(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name, help, fn, labels=(), kind='gauge'):
+        return self.add(Gauge(name, help, fn, labels, kind))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines += metric.render()
+        return '\n'.join(lines) + '\n'
+
+
+class SamplingProfiler:
+    """Samples every thread's Python stack at a fixed interval while enabled.
+
+    Runs in a background thread using sys._current_frames(), so it can be
+    switched on and off in a live process. dump() returns the stacks in the
+    collapsed format flame graph tools read: frames from outermost to
+    innermost, separated by ';', followed by the sample count.
+    """
+
+    def __init__(self, interval_ms=PROFILE_INTERVAL_MS):
+        self.interval = interval_ms / 1000.0
+        self.samples = 0
+        self.started_at = None
+        self._stacks = _Tally()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self, interval_ms=None):
+        with self._lock:
+            if interval_ms is not None:
+                self.interval = interval_ms / 1000.0
+            if self._thread is not None:
+                return
+            self._stopped.clear()
+            self.started_at = time.time()
+            self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stopped.set()
+            thread.join()
+
+    def reset(self):
+        with self._lock:
+            self._stacks.clear()
+            self.samples = 0
+
+    def dump(self, limit=None, include_idle=False):
+        with self._lock:
+            stacks = self._stacks.most_common()
+        lines = [f'{stack} {count}' for (stack, idle), count in stacks if include_idle or not idle]
+        return '\n'.join(lines[:limit]) + '\n'
+
+    def status(self):
+        return {
+            'running': self.running,
+            'interval_ms': self.interval * 1000,
+            'samples': self.samples,
+            'started_at': self.started_at,
+            'stacks': len(self._stacks),
+        }
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            frames = sys._current_frames()
+            sampled = []
+            for ident, frame in frames.items():
+                if ident == own:
+                    continue
+                idle = os.path.basename(frame.f_code.co_filename) in IDLE_MODULES
+                stack = []
+                while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                    code = frame.f_code
+                    stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                sampled.append((';'.join(reversed(stack)), idle))
+            del frames
+            with self._lock:
+                self._stacks.update(sampled)
+                self.samples += 1
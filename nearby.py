@@ -0,0 +1,381 @@
+import math
+import os
+import threading
+import time
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from storage import (DB_PATH, EARTH_RADIUS_M, METERS_PER_DEGREE, CursorExpired, get_connection, iter_points,
+                     query_changes)
+
+# "Pothole ahead" queries for /api/nearby
+DEFAULT_NEARBY_RADIUS_M = 300
+MAX_NEARBY_RADIUS_M = 2000
+DEFAULT_NEARBY_K = 10
+MAX_NEARBY_K = 100
+# Half-angle of the forward cone around the heading
+DEFAULT_CONE_DEG = 30
+# New and changed potholes collect in a brute-force buffer of up to this many rows
+# before it becomes a tree segment; segments of similar size are then merged, so
+# an insert never rebuilds the whole index
+NEARBY_BUFFER_ROWS = int(os.environ.get('POTHOLE_NEARBY_BUFFER_ROWS', 1024))
+LEAF_SIZE = 16
+
+
+def to_xyz(lat, lng):
+    """Earth-centred coordinates in meters on a sphere; chord and arc length agree to
+    well under a meter over MAX_NEARBY_RADIUS_M"""
+    lat = np.radians(lat)
+    lng = np.radians(lng)
+    cos_lat = np.cos(lat)
+    return np.column_stack([cos_lat * np.cos(lng), cos_lat * np.sin(lng), np.sin(lat)]) * EARTH_RADIUS_M
+
+
+class _Segment:
+    """Immutable column arrays sorted by id, with a KD-tree over their points.
+
+    Removing potholes returns a copy with a new `alive` mask and the same
+    arrays and tree, so readers holding the old segment are never affected.
+    """
+
+    __slots__ = ('ids', 'lat', 'lng', 'severity', 'max_severity', 'report_count', 'last_seen',
+                 'xyz', 'tree', 'alive', 'live')
+
+    def __init__(self, columns, tree=True):
+        order = np.argsort(columns['ids'], kind='stable')
+        for name in ('ids', 'lat', 'lng', 'severity', 'max_severity', 'report_count', 'last_seen'):
+            setattr(self, name, columns[name][order])
+        self.xyz = to_xyz(self.lat, self.lng)
+        self.tree = cKDTree(self.xyz, leafsize=LEAF_SIZE, balanced_tree=False) if tree and len(self.ids) else None
+        self.alive = np.ones(len(self.ids), dtype=bool)
+        self.live = len(self.ids)
+
+    @classmethod
+    def from_rows(cls, rows, tree=True):
+        # query_points rows: (id, lat, lng, severity, timestamp, report_count, last_seen, max_severity, seq)
+        data = np.array(rows, dtype=np.float64).reshape(-1, 9)
+        return cls({
+            'ids': data[:, 0].astype(np.int64),
+            'lat': data[:, 1],
+            'lng': data[:, 2],
+            'severity': data[:, 3].astype(np.float32),
+            'report_count': data[:, 5].astype(np.int32),
+            'last_seen': data[:, 6].astype(np.int64),
+            'max_severity': data[:, 7].astype(np.float32),
+        }, tree)
+
+    @classmethod
+    def concat(cls, segments, tree=True):
+        names = ('ids', 'lat', 'lng', 'severity', 'max_severity', 'report_count', 'last_seen')
+        return cls({name: np.concatenate([getattr(s, name)[s.alive] for s in segments]) for name in names}, tree)
+
+    def without(self, ids):
+        """This segment with `ids` removed, or itself if it holds none of them"""
+        positions = np.searchsorted(self.ids, ids)
+        inside = positions < len(self.ids)
+        positions = positions[inside]
+        positions = positions[(self.ids[positions] == ids[inside]) & self.alive[positions]]
+        if not len(positions):
+            return self
+        copy = object.__new__(_Segment)
+        for name in self.__slots__:
+            setattr(copy, name, getattr(self, name))
+        copy.alive = self.alive.copy()
+        copy.alive[positions] = False
+        copy.live = self.live - len(positions)
+        return copy
+
+    def within(self, point, chord):
+        if self.tree is not None:
+            index = np.asarray(self.tree.query_ball_point(point, chord), dtype=np.intp)
+        else:
+            index = np.flatnonzero(((self.xyz - point) ** 2).sum(axis=1) <= chord * chord)
+        return index[self.alive[index]]
+
+    def nbytes(self):
+        arrays = sum(getattr(self, name).nbytes for name in ('ids', 'lat', 'lng', 'severity', 'max_severity',
+                                                               'report_count', 'last_seen', 'xyz', 'alive'))
+        # cKDTree keeps an index per point and about one node per LEAF_SIZE / 2 points
+        tree = len(self.ids) * 8 + len(self.ids) // (LEAF_SIZE // 2) * 72 if self.tree is not None else 0
+        return arrays + tree
+
+
+class NearbyIndex:
+    """In-memory read index of every pothole for high-rate "pothole ahead" queries.
+
+    build() loads the database once; refresh() applies what was committed
+    since, read from the change cursor, so inserts, merges and deletions reach
+    the index without a rebuild. Queries never take a lock: they read
+    immutable segments that refresh() replaces in one assignment.
+    """
+
+    def __init__(self, path=DB_PATH, buffer_rows=NEARBY_BUFFER_ROWS):
+        self.path = path
+        self.buffer_rows = buffer_rows
+        self.cursor = None
+        self.build_seconds = None
+        self.refreshes = 0
+        self.merges = 0
+        # (tree segments, brute-force buffer or None), replaced as a whole
+        self._state = ((), None)
+        self._refresh_lock = threading.Lock()
+
+    @property
+    def ready(self):
+        return self.cursor is not None
+
+    def load(self):
+        """Build the index unless it is already built.
+
+        Once built this only reads `ready`, so the query path never waits
+        on a refresh; the lock is taken only until the first build.
+        """
+        if self.ready:
+            return
+        with self._refresh_lock:
+            if not self.ready:
+                self._build()
+
+    def build(self):
+        """Load every pothole from the database, replacing the current contents"""
+        with self._refresh_lock:
+            self._build()
+
+    def _build(self, chunk_rows=100000):
+        start = time.perf_counter()
+        chunks = iter_points(get_connection(self.path), chunk_rows)
+        cursor = next(chunks)
+        segments = [_Segment.from_rows(rows, tree=False) for rows in chunks]
+        self._state = ((_Segment.concat(segments),) if segments else (), None)
+        self.cursor = cursor
+        self.build_seconds = time.perf_counter() - start
+
+    def refresh(self, *args):
+        """Apply every change committed since the last build or refresh.
+
+        Takes and ignores any arguments, so it can be used directly as a
+        writer or retention on_commit hook.
+        """
+        if not self.ready:
+            return
+        with self._refresh_lock:
+            try:
+                changed, deleted, cursor = query_changes(get_connection(self.path), self.cursor)
+            except CursorExpired:
+                self._build()
+                return
+            if not changed and not deleted:
+                self.cursor = cursor
+                return
+            # Changed potholes are removed and re-added with their new values
+            stale = np.unique(np.array([row[0] for row in changed] + deleted, dtype=np.int64))
+            segments, buffer = self._state
+            segments = [segment.without(stale) for segment in segments]
+            pending = [buffer.without(stale)] if buffer is not None else []
+            if changed:
+                pending.append(_Segment.from_rows(changed, tree=False))
+            buffer = _Segment.concat(pending, tree=False) if pending else None
+
+            if buffer is not None and buffer.live >= self.buffer_rows:
+                segments.append(_Segment.concat([buffer]))
+                buffer = None
+                # Merge while the newest segment is at least half the size of the one before it
+                while len(segments) > 1 and segments[-2].live <= 2 * segments[-1].live:
+                    segments[-2:] = [_Segment.concat(segments[-2:])]
+                    self.merges += 1
+            segments = [segment for segment in segments if segment.live]
+
+            self._state = (tuple(segments), buffer)
+            self.cursor = cursor
+            self.refreshes += 1
+
+    def nearest(self, lat, lng, radius_m=DEFAULT_NEARBY_RADIUS_M, heading=None, cone_deg=DEFAULT_CONE_DEG,
+                k=DEFAULT_NEARBY_K):
+        """The k nearest potholes within radius_m and, when heading (degrees from north)
+        is given, within cone_deg of it; nearest first"""
+        lat_r, lng_r = math.radians(lat), math.radians(lng)
+        sin_lat, cos_lat, sin_lng, cos_lng = math.sin(lat_r), math.cos(lat_r), math.sin(lng_r), math.cos(lng_r)
+        point = np.array([cos_lat * cos_lng, cos_lat * sin_lng, sin_lat]) * EARTH_RADIUS_M
+        # Local east / north unit vectors, for bearings
+        east_north = np.array([[-sin_lng, -sin_lat * cos_lng],
+                               [cos_lng, -sin_lat * sin_lng],
+                               [0.0, cos_lat]])
+        chord = 2 * EARTH_RADIUS_M * math.sin(radius_m / (2 * EARTH_RADIUS_M))
+        segments, buffer = self._state
+        parts = segments + (buffer,) if buffer is not None else segments
+
+        found = []
+        for segment in parts:
+            index = segment.within(point, chord)
+            if len(index):
+                found.append((segment, index))
+        if not found:
+            return []
+
+        def gather(name):
+            if len(found) == 1:
+                return getattr(found[0][0], name)[found[0][1]]
+            return np.concatenate([getattr(segment, name)[index] for segment, index in found])
+
+        offset = gather('xyz') - point
+        chords = np.sqrt((offset * offset).sum(axis=1))
+        distance = 2 * EARTH_RADIUS_M * np.arcsin(np.minimum(chords / (2 * EARTH_RADIUS_M), 1.0))
+        east, north = (offset @ east_north).T
+        bearing = np.degrees(np.arctan2(east, north)) % 360.0
+        keep = distance <= radius_m
+        if heading is not None:
+            keep &= np.abs((bearing - heading + 180.0) % 360.0 - 180.0) <= cone_deg
+        order = np.flatnonzero(keep)
+        if not len(order):
+            return []
+        order = order[np.argsort(distance[order], kind='stable')[:k]]
+
+        lats, lngs = gather('lat'), gather('lng')
+        ids, severity, max_severity = gather('ids')[order], gather('severity')[order], gather('max_severity')[order]
+        report_count, last_seen = gather('report_count')[order], gather('last_seen')[order]
+        return [{
+            "id": int(ids[j]),
+            "lat": float(lats[i]),
+            "lng": float(lngs[i]),
+            "severity": round(float(severity[j]), 4),
+            "max_severity": round(float(max_severity[j]), 4),
+            "report_count": int(report_count[j]),
+            "last_seen": int(last_seen[j]),
+            "distance_m": round(float(distance[i]), 1),
+            "bearing_deg": round(float(bearing[i]), 1),
+        } for j, i in enumerate(order.tolist())]
+
+    def stats(self):
+        segments, buffer = self._state
+        parts = list(segments) + ([buffer] if buffer is not None else [])
+        potholes = sum(segment.live for segment in parts)
+        nbytes = sum(segment.nbytes() for segment in parts)
+        return {
+            'ready': self.ready,
+            'potholes': potholes,
+            'segments': len(segments),
+            'buffered': buffer.live if buffer is not None else 0,
+            'bytes': nbytes,
+            'bytes_per_pothole': round(nbytes / potholes, 1) if potholes else None,
+            'cursor': self.cursor,
+            'build_seconds': self.build_seconds,
+            'refreshes': self.refreshes,
+            'merges': self.merges,
+        }
+
+
+def _haversine_m(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(np.radians, (lat1, lng1, lat2, lng2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
+def _bearing_deg(lat1, lng1, lat2, lng2):
+    # Initial great-circle bearing from point 1 to each point 2, degrees clockwise from north
+    lat1, lng1, lat2, lng2 = map(np.radians, (lat1, lng1, lat2, lng2))
+    d_lng = lng2 - lng1
+    y = np.sin(d_lng) * np.cos(lat2)
+    x = np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(d_lng)
+    return np.degrees(np.arctan2(y, x)) % 360.0
+
+
+def _rss_bytes():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def _nearest_sqlite(conn, lat, lng, radius_m, heading, cone_deg, k):
+    # The same answer through SQLite: bounding box from the R*Tree, then the cone and distance in NumPy
+    from storage import query_bbox_ids
+
+    pad_lat = radius_m / METERS_PER_DEGREE
+    pad_lng = pad_lat / max(math.cos(math.radians(abs(lat) + pad_lat)), 1e-6)
+    rows = query_bbox_ids(conn, lat - pad_lat, lng - pad_lng, lat + pad_lat, lng + pad_lng)
+    if not rows:
+        return []
+    points = np.array(rows)
+    distance = _haversine_m(lat, lng, points[:, 1], points[:, 2])
+    keep = distance <= radius_m
+    if heading is not None:
+        bearing = _bearing_deg(lat, lng, points[:, 1], points[:, 2])
+        keep &= np.abs((bearing - heading + 180.0) % 360.0 - 180.0) <= cone_deg
+    order = np.flatnonzero(keep)
+    return [rows[i] for i in order[np.argsort(distance[order], kind='stable')[:k]]]
+
+
+def benchmark(rows=1000000, queries=20000, inserts=20000, workdir='.'):
+    """Build time, memory per pothole, queries/s against SQLite, and the cost of incremental inserts"""
+    from storage import INSERT_POTHOLE, _seed_potholes, now_ms
+
+    rng = np.random.default_rng(0)
+    path = os.path.join(workdir, f'bench_nearby_{rows}.db')
+    if os.path.exists(path):
+        os.remove(path)
+    _seed_potholes(path, rows, rng)
+    conn = get_connection(path)
+
+    rss = _rss_bytes()
+    index = NearbyIndex(path)
+    index.build()
+    stats = index.stats()
+    print(f"Built {stats['potholes']} potholes in {stats['build_seconds']:.2f} s: "
+          f"{stats['bytes_per_pothole']} B/pothole in arrays and tree, "
+          f"{(_rss_bytes() - rss) / stats['potholes']:.0f} B/pothole resident")
+
+    # Half the vehicles within 200 m of a known pothole, half anywhere; random headings
+    segment = index._state[0][0]
+    near = rng.choice(len(segment.ids), queries // 2)
+    lats = np.concatenate([segment.lat[near] + rng.uniform(-0.0018, 0.0018, len(near)),
+                           rng.uniform(8.5, 29.5, queries - len(near))])
+    lngs = np.concatenate([segment.lng[near] + rng.uniform(-0.0018, 0.0018, len(near)),
+                           rng.uniform(70.5, 89.5, queries - len(near))])
+    positions = list(zip(lats.tolist(), lngs.tolist(), rng.uniform(0, 360, queries).tolist()))
+    radius_m, cone_deg, k = DEFAULT_NEARBY_RADIUS_M, 90, DEFAULT_NEARBY_K
+
+    def qps(fn, n):
+        start = time.perf_counter()
+        found = sum(len(fn(*position)) for position in positions[:n])
+        return n / (time.perf_counter() - start), found / n
+
+    # The original BETWEEN query scans the table, so it gets a handful of queries only
+    pad = radius_m / METERS_PER_DEGREE
+    between = lambda lat, lng, heading: conn.execute(
+        "SELECT id FROM potholes NOT INDEXED WHERE latitude BETWEEN ? AND ? AND longitude BETWEEN ? AND ?",
+        (lat - pad, lat + pad, lng - pad, lng + pad)).fetchall()
+    print(f"{'path':>14} {'queries/s':>10} {'found':>7}   (radius {radius_m} m, cone +-{cone_deg} deg, k {k})")
+    for name, fn, n in [
+        ('sqlite scan', between, 20),
+        ('sqlite rtree', lambda lat, lng, heading: _nearest_sqlite(conn, lat, lng, radius_m, heading, cone_deg, k),
+         queries),
+        ('nearby index', lambda lat, lng, heading: index.nearest(lat, lng, radius_m, heading, cone_deg, k), queries),
+    ]:
+        rate, found = qps(fn, n)
+        print(f"{name:>14} {rate:>10.0f} {found:>7.2f}")
+
+    # Inserts committed in writer-sized batches, each followed by a refresh
+    batch = 256
+    refresh_s = 0.0
+    for first in range(0, inserts, batch):
+        n = min(batch, inserts - first)
+        with conn:
+            conn.executemany(INSERT_POTHOLE, [(float(a), float(b), 0.8, now_ms()) for a, b in
+                                              zip(rng.uniform(8.0, 30.0, n), rng.uniform(70.0, 90.0, n))])
+        start = time.perf_counter()
+        index.refresh()
+        refresh_s += time.perf_counter() - start
+    stats = index.stats()
+    print(f"{inserts} inserts in batches of {batch}: refresh {refresh_s / inserts * 1e6:.1f} us/insert, "
+          f"{stats['segments']} segments, {stats['merges']} merges")
+    os.remove(path)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the in-memory nearby index")
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--queries', type=int, default=20000)
+    parser.add_argument('--inserts', type=int, default=20000)
+    args = parser.parse_args()
+    benchmark(args.rows, args.queries, args.inserts)
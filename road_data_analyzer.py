@@ -1,23 +1,268 @@
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import time
+import zipfile
 import pandas as pd
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 import matplotlib.pyplot as plt
 from scipy import signal
 from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import StandardScaler
-from sklearn.svm import SVC
+from sklearn.svm import SVC, LinearSVC
+from sklearn.kernel_approximation import RBFSampler, Nystroem
 from sklearn.metrics import classification_report, confusion_matrix
 import seaborn as sns
 
+FEATURE_AXES = ['acc_x', 'acc_y', 'acc_z']
+# Bumped whenever the window features or labels below change; part of the feature cache key
+FEATURE_SET_VERSION = 1
+
+# Rows handled at once when streaming large logs
+CHUNK_SAMPLES = 1_000_000
+
+# Columnar binary cache: one raw little-endian file per column plus meta.json
+CACHE_COLUMNS = {
+    'timestamp': '<f8',
+    'acc_x': '<f4',
+    'acc_y': '<f4',
+    'acc_z': '<f4',
+    'label': 'u1',
+}
+
+# 12-channel fleet logs (road_data_generator --vehicles) carry both sensors as
+# features.CHANNELS; their front sensor, which the labels follow, is read as FEATURE_AXES
+FLEET_AXES = {'acc_x1': 'acc_x', 'acc_y1': 'acc_y', 'acc_z1': 'acc_z'}
+
+# Extracted feature matrices are kept here, keyed by the data's contents and the windowing
+FEATURE_CACHE_DIR = 'feature_cache'
+FEATURE_CACHE_MB = 1024
+HASH_BLOCK_BYTES = 1 << 20
+
+def read_csv_chunks(csv_path, columns, chunksize=CHUNK_SAMPLES):
+    """Stream the given columns of a drive-log CSV, reading a fleet log's front sensor as FEATURE_AXES"""
+    header = pd.read_csv(csv_path, nrows=0).columns
+    renames = {} if 'acc_x' in header else {k: v for k, v in FLEET_AXES.items() if k in header}
+    source = {v: k for k, v in renames.items()}
+    chunks = pd.read_csv(csv_path, usecols=[source.get(column, column) for column in columns], chunksize=chunksize)
+    return (chunk.rename(columns=renames) for chunk in chunks)
+
+def with_analyzer_axes(data):
+    """A loaded log (DataFrame or dict of columns) with FEATURE_AXES, aliased from a fleet log's front sensor"""
+    if 'acc_x' in data or not all(column in data for column in FLEET_AXES):
+        return data
+    # Each axis is taken from its one named source column; the 12 channels stay as they are
+    axes = {axis: data[column] for column, axis in FLEET_AXES.items()}
+    if isinstance(data, pd.DataFrame):
+        return data.assign(**axes)
+    return {**data, **axes}
+
+def convert_to_cache(csv_path, cache_dir, chunksize=CHUNK_SAMPLES):
+    """Parse a drive-log CSV once, in chunks, into a memory-mappable columnar cache"""
+    os.makedirs(cache_dir, exist_ok=True)
+    files = {column: open(os.path.join(cache_dir, f'{column}.bin'), 'wb') for column in CACHE_COLUMNS}
+    samples = 0
+    try:
+        for chunk in read_csv_chunks(csv_path, list(CACHE_COLUMNS), chunksize):
+            for column, dtype in CACHE_COLUMNS.items():
+                files[column].write(chunk[column].to_numpy().astype(dtype).tobytes())
+            samples += len(chunk)
+    finally:
+        for f in files.values():
+            f.close()
+    
+    # Written last, so an interrupted conversion is never mistaken for a complete cache
+    with open(os.path.join(cache_dir, 'meta.json'), 'w') as f:
+        json.dump({'samples': samples, 'columns': CACHE_COLUMNS, 'source': os.path.abspath(csv_path)}, f, indent=2)
+    print(f"Cached {samples} samples from {csv_path} in {cache_dir}")
+    return samples
+
+def open_cache(cache_dir):
+    """Open a cache written by convert_to_cache, or a binary fleet log, as a dict of
+    read-only np.memmap columns"""
+    with open(os.path.join(cache_dir, 'meta.json')) as f:
+        meta = json.load(f)
+    return with_analyzer_axes({
+        column: np.memmap(os.path.join(cache_dir, f'{column}.bin'), dtype=dtype, mode='r',
+                          shape=(meta['samples'],))
+        for column, dtype in meta['columns'].items()
+    })
+
+class FeatureCache:
+    """Content-addressed on-disk cache of prepare_training_data results.
+
+    An entry is one .npz holding X, y and the column names. Its key is a hash
+    of the data file's contents (every file, for a cache directory), the window
+    size, the hop and FEATURE_SET_VERSION, so an edited log or a new feature set
+    never reuses a stale matrix. File digests are remembered by path, size and
+    mtime, so an unchanged log is not re-read. Entries past max_bytes are
+    evicted least recently used first, by file mtime, which hits refresh.
+    """
+
+    def __init__(self, cache_dir=FEATURE_CACHE_DIR, max_bytes=FEATURE_CACHE_MB << 20):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._digests_path = os.path.join(cache_dir, 'digests.json')
+
+    def key(self, data_path, window_size, hop):
+        content = self._content_digest(data_path)
+        return hashlib.sha256(f'{content}:{window_size}:{hop}:{FEATURE_SET_VERSION}'.encode()).hexdigest()
+
+    def get(self, key):
+        """(X, y) for key, or None"""
+        path = self._entry_path(key)
+        try:
+            with np.load(path, allow_pickle=False) as entry:
+                X = pd.DataFrame(entry['X'], columns=list(entry['columns']))
+                y = entry['y']
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            self.misses += 1
+            return None
+        os.utime(path)
+        self.hits += 1
+        return X, y
+
+    def put(self, key, X, y):
+        path = self._entry_path(key)
+        # Written beside the entry and renamed, so a reader never sees half a file
+        partial = f'{path}.{os.getpid()}.partial'
+        with open(partial, 'wb') as f:
+            np.savez(f, X=X.to_numpy(), y=np.asarray(y), columns=np.array(X.columns, dtype=str))
+        os.replace(partial, path)
+        self._evict(keep=path)
+
+    def load_or_extract(self, data_path, window_size, hop, extract):
+        """Return the cached (X, y) for this data and windowing, or call extract() and store its result"""
+        key = self.key(data_path, window_size, hop)
+        start = time.perf_counter()
+        cached = self.get(key)
+        if cached is not None:
+            print(f"Feature cache hit {key[:12]}: {len(cached[1])} windows in {time.perf_counter() - start:.3f}s "
+                  f"({self.hits} hits, {self.misses} misses)")
+            return cached
+        X, y = extract()
+        elapsed = time.perf_counter() - start
+        self.put(key, X, y)
+        print(f"Feature cache miss {key[:12]}: extracted {len(y)} windows in {elapsed:.3f}s "
+              f"({self.hits} hits, {self.misses} misses)")
+        return X, y
+
+    def stats(self):
+        entries = self._entries()
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(entries),
+            'bytes': sum(size for _, size, _ in entries),
+            'max_bytes': self.max_bytes,
+        }
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.npz')
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.npz'):
+                try:
+                    stat = os.stat(os.path.join(self.cache_dir, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((os.path.join(self.cache_dir, name), stat.st_size, stat.st_mtime_ns))
+        return entries
+
+    def _evict(self, keep):
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            self.evictions += 1
+
+    def _content_digest(self, data_path):
+        """sha256 over the file, or over every file of a cache directory in name order"""
+        if os.path.isdir(data_path):
+            files = [os.path.join(data_path, name) for name in sorted(os.listdir(data_path))]
+        else:
+            files = [data_path]
+        stats = [os.stat(path) for path in files]
+        signature = [[os.path.basename(path), stat.st_size, stat.st_mtime_ns] for path, stat in zip(files, stats)]
+
+        try:
+            with open(self._digests_path) as f:
+                known = json.load(f)
+        except (FileNotFoundError, ValueError):
+            known = {}
+        source = os.path.abspath(data_path)
+        if source in known and known[source]['files'] == signature:
+            return known[source]['sha256']
+
+        digest = hashlib.sha256()
+        for path in files:
+            digest.update(os.path.basename(path).encode() + b'\0')
+            with open(path, 'rb') as f:
+                while block := f.read(HASH_BLOCK_BYTES):
+                    digest.update(block)
+        known[source] = {'files': signature, 'sha256': digest.hexdigest()}
+        partial = f'{self._digests_path}.{os.getpid()}.partial'
+        with open(partial, 'w') as f:
+            json.dump(known, f, indent=2)
+        os.replace(partial, self._digests_path)
+        return known[source]['sha256']
+
 class RoadDataAnalyzer:
-    def __init__(self, window_size=50):
+    def __init__(self, window_size=50, hop=None, kernel_approximation=None, n_components=256,
+                 feature_cache=None):
+        """kernel_approximation: None for an exact RBF SVC, or 'rff' (random Fourier
+        features) / 'nystroem' to approximate the RBF kernel with an explicit feature
+        map followed by a linear SVM, which exports to a fixed-cost dense graph.
+        
+        feature_cache: a FeatureCache that prepare_training_data reuses matrices
+        from when the data came from load_data.
+        """
         self.window_size = window_size
+        self.hop = hop or window_size // 2
+        self.feature_cache = feature_cache
+        self.data_path = None
         self.scaler = StandardScaler()
-        self.model = SVC(kernel='rbf')
+        self.kernel_approximation = kernel_approximation
+        if kernel_approximation is None:
+            self.feature_map = None
+            self.model = SVC(kernel='rbf')
+        elif kernel_approximation == 'rff':
+            self.feature_map = RBFSampler(n_components=n_components, random_state=42)
+            self.model = LinearSVC()
+        elif kernel_approximation == 'nystroem':
+            self.feature_map = Nystroem(kernel='rbf', n_components=n_components, random_state=42)
+            self.model = LinearSVC()
+        else:
+            raise ValueError(f"Unknown kernel approximation: {kernel_approximation}")
         
     def load_data(self, file_path):
-        """Load the CSV data file"""
-        self.data = pd.read_csv(file_path)
-        print(f"Loaded dataset with {len(self.data)} samples")
+        """Load the CSV data file, or memory-map a cache directory made by convert_to_cache
+        (or a binary fleet log)"""
+        self.data_path = file_path
+        if os.path.isdir(file_path):
+            self.data = open_cache(file_path)
+            print(f"Mapped cached dataset with {len(self.data['label'])} samples")
+        else:
+            self.data = with_analyzer_axes(pd.read_csv(file_path))
+            print(f"Loaded dataset with {len(self.data)} samples")
         return self.data
     
     def plot_segment(self, start_idx=0, duration=5):
@@ -84,12 +329,131 @@ class RoadDataAnalyzer:
         
         return features
     
+    def extract_features_batch(self, windows, axis):
+        """Vectorized extract_features for one axis over a (windows, window_size) array"""
+        maximum = windows.max(axis=1)
+        minimum = windows.min(axis=1)
+        
+        # Real FFT of every window in one call. The full spectrum's magnitudes are the
+        # rfft bins plus the mirrored bins 1 .. (n+1)//2 - 1, so mean and max match np.fft.fft.
+        n = windows.shape[1]
+        rfft_magnitude = np.abs(np.fft.rfft(windows, axis=1))
+        fft_sum = rfft_magnitude.sum(axis=1) + rfft_magnitude[:, 1:(n + 1) // 2].sum(axis=1)
+        
+        return {
+            f'{axis}_mean': windows.mean(axis=1),
+            f'{axis}_std': windows.std(axis=1),
+            f'{axis}_max': maximum,
+            f'{axis}_min': minimum,
+            f'{axis}_peak2peak': maximum - minimum,
+            f'{axis}_rms': np.sqrt(np.mean(np.square(windows), axis=1)),
+            f'{axis}_fft_mean': fft_sum / n,
+            f'{axis}_fft_max': rfft_magnitude.max(axis=1)
+        }
+    
+    def sliding_windows(self, values):
+        """Overlapping windows of a 1-D array as a strided (windows, window_size) view, no copy"""
+        n_windows = len(range(0, len(values) - self.window_size, self.hop))
+        return sliding_window_view(values, self.window_size)[::self.hop][:n_windows]
+    
+    def window_features(self, columns):
+        """Features and majority-vote labels for every window over a dict of equal-length 1-D arrays"""
+        features = {}
+        for axis in FEATURE_AXES:
+            windows = self.sliding_windows(np.asarray(columns[axis], dtype=np.float64))
+            features.update(self.extract_features_batch(windows, axis))
+        
+        # Use majority vote for window label
+        label_windows = self.sliding_windows(np.asarray(columns['label'], dtype=np.float64))
+        y = (label_windows.mean(axis=1) > 0.5).astype(int)
+        
+        return pd.DataFrame(features), y
+    
+    def iter_feature_batches(self, chunks):
+        """Yield (X, y) per chunk of consecutive samples, carrying the overlap between chunks.
+        
+        A window is only emitted once at least one sample follows it, which is
+        exactly the in-memory range(0, len - window_size, hop), so the
+        concatenated batches equal prepare_training_data on the whole log.
+        """
+        carry = None
+        for chunk in chunks:
+            if carry is None:
+                buffer = {column: np.asarray(chunk[column]) for column in FEATURE_AXES + ['label']}
+            else:
+                buffer = {column: np.concatenate([carry[column], np.asarray(chunk[column])])
+                          for column in carry}
+            
+            X, y = self.window_features(buffer)
+            if len(y):
+                yield X, y
+            carry = {column: values[len(y) * self.hop:] for column, values in buffer.items()}
+    
+    def iter_csv_feature_batches(self, file_path, chunksize=CHUNK_SAMPLES):
+        """Stream feature batches from a CSV too large to load at once"""
+        return self.iter_feature_batches(read_csv_chunks(file_path, FEATURE_AXES + ['label'], chunksize))
+    
+    def iter_data_chunks(self, chunksize=CHUNK_SAMPLES):
+        """Consecutive row slices of the loaded data (DataFrame or memory-mapped cache)"""
+        columns = {column: np.asarray(self.data[column]) for column in FEATURE_AXES + ['label']}
+        total = len(columns['label'])
+        for start in range(0, total, chunksize):
+            yield {column: values[start:start + chunksize] for column, values in columns.items()}
+    
     def prepare_training_data(self):
-        """Prepare windowed data for training"""
+        """Prepare windowed data for training, from the feature cache when one is set and holds it"""
+        if self.feature_cache is not None and self.data_path is not None:
+            return self.feature_cache.load_or_extract(self.data_path, self.window_size, self.hop,
+                                                      self.extract_training_data)
+        return self.extract_training_data()
+    
+    def extract_training_data(self):
+        """Windowed features and labels, vectorized over all windows in bounded chunks"""
+        batches = list(self.iter_feature_batches(self.iter_data_chunks()))
+        if not batches:
+            return pd.DataFrame(columns=self.feature_names()), np.zeros(0, dtype=int)
+        
+        X = pd.concat([X for X, _ in batches], ignore_index=True)
+        y = np.concatenate([y for _, y in batches])
+        return X, y
+    
+    def feature_names(self):
+        names = []
+        for axis in FEATURE_AXES:
+            names += [f'{axis}_{name}' for name in
+                      ['mean', 'std', 'max', 'min', 'peak2peak', 'rms', 'fft_mean', 'fft_max']]
+        return names
+    
+    def prepare_training_data_loop(self):
+        """Per-window reference implementation of prepare_training_data.
+        
+        Works on the loaded DataFrame and on a memory-mapped cache alike, one
+        window's slice of each column at a time.
+        """
+        windows = []
+        labels = []
+        columns = {column: np.asarray(self.data[column]) for column in FEATURE_AXES + ['label']}
+        
+        for i in range(0, len(columns['label']) - self.window_size, self.hop):
+            window = {column: np.asarray(values[i:i + self.window_size], dtype=np.float64)
+                      for column, values in columns.items()}
+            windows.append(self.extract_features(window))
+            # Use majority vote for window label
+            labels.append(int(window['label'].mean() > 0.5))
+        
+        # Convert to DataFrame
+        X = pd.DataFrame(windows)
+        y = np.array(labels)
+        
+        return X, y
+    
+    def prepare_training_data_original(self):
+        """The original DataFrame implementation of prepare_training_data, kept
+        unchanged (apart from the configurable hop) as the benchmark's before number"""
         windows = []
         labels = []
         
-        for i in range(0, len(self.data) - self.window_size, self.window_size // 2):
+        for i in range(0, len(self.data) - self.window_size, self.hop):
             window = self.data.iloc[i:i + self.window_size]
             windows.append(self.extract_features(window))
             # Use majority vote for window label
@@ -101,6 +465,62 @@ class RoadDataAnalyzer:
         
         return X, y
     
+    def benchmark_windowing(self):
+        """Time the original iloc loop (or, on a cache, the per-window column loop)
+        against the vectorized path and check they agree"""
+        if isinstance(self.data, pd.DataFrame):
+            name, reference = "Original iloc loop", self.prepare_training_data_original
+        else:
+            # The original only runs on a DataFrame
+            name, reference = "Per-window column loop", self.prepare_training_data_loop
+        start = time.perf_counter()
+        X_loop, y_loop = reference()
+        loop_time = time.perf_counter() - start
+        
+        start = time.perf_counter()
+        X_fast, y_fast = self.extract_training_data()
+        fast_time = time.perf_counter() - start
+        
+        assert list(X_fast.columns) == list(X_loop.columns)
+        assert np.array_equal(y_fast, y_loop)
+        max_diff = np.abs(X_fast.to_numpy() - X_loop.to_numpy()).max()
+        print(f"{len(X_fast)} windows (size {self.window_size}, hop {self.hop})")
+        print(f"{name}: {loop_time:.3f}s  Vectorized: {fast_time:.4f}s  "
+              f"Speedup: {loop_time / fast_time:.0f}x  Max feature diff: {max_diff:.2e}")
+    
+    def fit(self, X_train, y_train):
+        """Fit the scaler, the optional kernel feature map and the classifier"""
+        X_scaled = self.scaler.fit_transform(X_train)
+        if self.feature_map is not None:
+            # Same gamma as SVC's default gamma='scale', so both target the same kernel
+            self.feature_map.set_params(gamma=1.0 / (X_scaled.shape[1] * X_scaled.var()))
+            X_scaled = self.feature_map.fit_transform(X_scaled)
+        self.model.fit(X_scaled, y_train)
+    
+    def decision_function(self, X):
+        X_scaled = self.scaler.transform(X)
+        if self.feature_map is not None:
+            X_scaled = self.feature_map.transform(X_scaled)
+        return self.model.decision_function(X_scaled)
+    
+    def predict(self, X):
+        return (self.decision_function(X) > 0).astype(int)
+    
+    def save_model(self, model_path='pothole_model.pkl', scaler_path='pothole_scaler.pkl',
+                   feature_map_path='pothole_feature_map.pkl'):
+        """Pickle the classifier, its scaler and, for a kernel approximation, the fitted feature map"""
+        with open(model_path, 'wb') as f:
+            pickle.dump(self.model, f)
+        with open(scaler_path, 'wb') as f:
+            pickle.dump(self.scaler, f)
+        saved = f"Saved model to {model_path} and scaler to {scaler_path}"
+        if self.feature_map is not None:
+            # The linear head is meaningless without the exact random features it was trained on
+            with open(feature_map_path, 'wb') as f:
+                pickle.dump(self.feature_map, f)
+            saved += f" and feature map to {feature_map_path}"
+        print(saved)
+    
     def train_model(self):
         """Train the pothole detection model"""
         print("Preparing training data...")
@@ -109,16 +529,12 @@ class RoadDataAnalyzer:
         # Split data
         X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
         
-        # Scale features
-        X_train_scaled = self.scaler.fit_transform(X_train)
-        X_test_scaled = self.scaler.transform(X_test)
-        
-        # Train model
+        # Scale features and train model
         print("Training model...")
-        self.model.fit(X_train_scaled, y_train)
+        self.fit(X_train, y_train)
         
         # Evaluate
-        y_pred = self.model.predict(X_test_scaled)
+        y_pred = self.predict(X_test)
         
         # Print results
         print("\nClassification Report:")
@@ -136,14 +552,46 @@ class RoadDataAnalyzer:
         return y_test, y_pred
 
 if __name__ == "__main__":
-    # Create analyzer instance
-    analyzer = RoadDataAnalyzer()
-    
-    # Load the synthetic data
-    data = analyzer.load_data('synthetic_road_data.csv')
+    parser = argparse.ArgumentParser(description="Train and evaluate the pothole detection model")
+    parser.add_argument('--data', default='synthetic_road_data.csv')
+    parser.add_argument('--window-size', type=int, default=50)
+    parser.add_argument('--hop', type=int, default=None, help="Samples between window starts (default: half a window)")
+    parser.add_argument('--kernel-approximation', choices=['rff', 'nystroem'],
+                        help="Approximate the RBF kernel with an explicit feature map and a linear SVM")
+    parser.add_argument('--components', type=int, default=256, help="Kernel approximation dimension")
+    parser.add_argument('--bench', action='store_true', help="Benchmark feature extraction instead of training")
+    parser.add_argument('--save', action='store_true',
+                        help="Save the trained model and scaler to pothole_model.pkl / pothole_scaler.pkl")
+    parser.add_argument('--convert-cache', metavar='DIR',
+                        help="Convert --data into a memory-mapped cache directory and exit; "
+                             "later runs can pass the directory as --data")
+    parser.add_argument('--feature-cache', default=FEATURE_CACHE_DIR,
+                        help="Directory of cached feature matrices, reused across runs on the same data")
+    parser.add_argument('--feature-cache-mb', type=int, default=FEATURE_CACHE_MB,
+                        help="Evict least recently used feature matrices beyond this size")
+    parser.add_argument('--no-feature-cache', action='store_true', help="Always extract features")
+    args = parser.parse_args()
     
-    # Plot first 5 seconds of data
-    analyzer.plot_segment(duration=5)
-    
-    # Train and evaluate model
-    y_test, y_pred = analyzer.train_model()
\ No newline at end of file
+    if args.convert_cache:
+        convert_to_cache(args.data, args.convert_cache)
+    else:
+        # Create analyzer instance
+        feature_cache = None if args.no_feature_cache else FeatureCache(args.feature_cache,
+                                                                        args.feature_cache_mb << 20)
+        analyzer = RoadDataAnalyzer(window_size=args.window_size, hop=args.hop,
+                                    kernel_approximation=args.kernel_approximation,
+                                    n_components=args.components, feature_cache=feature_cache)
+        
+        # Load the synthetic data (or a cache directory)
+        data = analyzer.load_data(args.data)
+        
+        if args.bench:
+            analyzer.benchmark_windowing()
+        else:
+            # Plot first 5 seconds of data
+            analyzer.plot_segment(duration=5)
+            
+            # Train and evaluate model
+            y_test, y_pred = analyzer.train_model()
+            if args.save:
+                analyzer.save_model()
@@ -1,8 +1,49 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 from scipy import signal
 
+from features import CHANNELS
+
+# 12-channel drive logs: both MPU6050s in the firmware's SensorData order
+# (features.CHANNELS) plus a GPS position that updates at GPS_RATE_HZ. The
+# binary format is road_data_analyzer's columnar cache layout: one raw
+# little-endian file per column plus meta.json, so open_cache maps it directly.
+FLEET_COLUMNS = {
+    'timestamp': '<f8',
+    'latitude': '<f8',
+    'longitude': '<f8',
+    **{channel: '<f4' for channel in CHANNELS},
+    'label': 'u1',
+}
+# Seconds of one vehicle's log generated and written at a time; this bounds
+# each worker's memory (600 s is about 12 MB) whatever the log length
+CHUNK_SECONDS = 600
+POTHOLE_SECONDS = 0.5
+# Impacts per minute of driving, as dense as generate_dataset's defaults
+POTHOLES_PER_MINUTE = 20
+# Per-axis (x, y, z) scale of a pothole's Gaussian pulse, as in generate_pothole
+POTHOLE_AXES = np.array([0.5, 0.3, -2.0])
+# The rear sensor's hit relative to the front one
+REAR_IMPACT = 0.8
+# Front to rear axle of the Honda SP 125
+WHEELBASE_M = 1.285
+GPS_RATE_HZ = 1
+GPS_NOISE_M = 3.0
+# Routes start within ROUTE_SPREAD_DEG of ORIGIN, at a constant speed along a wandering heading
+ORIGIN = (13.0827, 80.2707)
+ROUTE_SPREAD_DEG = 0.1
+SPEED_M_S = (5.0, 20.0)
+# Heading random walk, radians per sqrt(second)
+HEADING_DRIFT = 0.05
+EARTH_RADIUS_M = 6371000.0
+
 class RoadDataGenerator:
     def __init__(self, sampling_rate=100):
         self.sampling_rate = sampling_rate
@@ -44,20 +85,16 @@ class RoadDataGenerator:
         # Generate normal road data
         normal_x, normal_y, normal_z, normal_labels = self.generate_normal_road(normal_duration)
         
-        # Insert random potholes
-        for _ in range(num_potholes):
-            # Random position for pothole
-            pos = np.random.randint(0, len(normal_x) - 50)
-            
-            # Generate pothole data
-            p_x, p_y, p_z, p_label = self.generate_pothole()
-            
-            # Insert pothole data
-            slice_length = len(p_x)
-            normal_x[pos:pos+slice_length] = p_x
-            normal_y[pos:pos+slice_length] = p_y
-            normal_z[pos:pos+slice_length] = p_z
-            normal_labels[pos:pos+slice_length] = p_label
+        # Insert all potholes at once; where two overlap the later one wins, as
+        # it did when they were inserted one by one
+        slice_length = int(POTHOLE_SECONDS * self.sampling_rate)
+        positions = np.random.randint(0, len(normal_x) - slice_length, num_potholes)
+        rows = positions[:, np.newaxis] + np.arange(slice_length)
+        pulse = np.exp(-np.linspace(-3, 3, slice_length) ** 2)
+        normal_x[rows] = 0.5 * pulse + 0.1 * np.random.randn(num_potholes, slice_length)
+        normal_y[rows] = 0.3 * pulse + 0.1 * np.random.randn(num_potholes, slice_length)
+        normal_z[rows] = -2.0 * pulse + 0.1 * np.random.randn(num_potholes, slice_length)
+        normal_labels[rows] = 1
         
         # Create DataFrame
         data = pd.DataFrame({
@@ -70,6 +107,107 @@ class RoadDataGenerator:
         
         return data
     
+    def road_noise(self, rng, t):
+        """(len(t), 12) normal-road readings for both sensors, the generate_normal_road model.
+
+        Each accelerometer has the 0.5 g vertical offset; the gyroscopes get the
+        same vibration without it.
+        """
+        noise = rng.standard_normal((len(t), 4, 3), dtype=np.float32)
+        noise *= np.array([0.2, 0.2, 0.3], dtype=np.float32)
+        noise[:, :, 2] += (0.2 * np.sin(2 * np.pi * 5 * t)).astype(np.float32)[:, np.newaxis]
+        noise[:, :2, 2] += 0.5
+        return noise.reshape(len(t), 12)
+
+    def insert_potholes(self, rng, data, labels, starts, length, rear_delay):
+        """Write a pothole impact into a (samples, 12) array at every start in one pass.
+
+        The front sensor's accelerometer is replaced by the generate_pothole
+        pulse, the rear one gets a softer copy rear_delay samples later, and both
+        gyroscopes see the bike pitch. labels covers the front impact.
+        """
+        pulse = np.exp(-np.linspace(-3, 3, length) ** 2)
+        jolt = pulse[np.newaxis, :, np.newaxis] * POTHOLE_AXES + 0.1 * rng.standard_normal((len(starts), length, 3))
+        jolt = jolt.reshape(-1, 3)
+        rows = (starts[:, np.newaxis] + np.arange(length)).ravel()
+        # Impacts can overlap. NumPy leaves the winner of repeated indices in one
+        # assignment unspecified, so each sample is written once, from the impact
+        # listed last in starts
+        front, rear = _last_writes(rows), _last_writes(rows + rear_delay)
+        data[rows[front], 0:3] = jolt[front]
+        data[rows[rear] + rear_delay, 3:6] = REAR_IMPACT * jolt[rear]
+        data[rows[front], 7] -= 0.5 * jolt[front, 2]
+        data[rows[rear] + rear_delay, 10] -= 0.5 * REAR_IMPACT * jolt[rear, 2]
+        labels[rows] = 1
+
+    def rear_delay(self, speed):
+        """Samples between the front and rear wheel crossing the same spot"""
+        return int(round(WHEELBASE_M / speed * self.sampling_rate))
+
+    def generate_windows(self, count, pothole_rate, rng, window_size=50):
+        """(count, window_size, 12) float32 windows, and which of them hold a pothole"""
+        data = self.road_noise(rng, np.tile(np.arange(window_size) / self.sampling_rate, count))
+        labels = np.zeros(len(data), dtype=np.uint8)
+        potholes = rng.random(count) < pothole_rate
+        # A shorter pulse than in drive logs, so both wheels' hits fit in one window
+        length = int(window_size * 0.6)
+        delay = min(self.rear_delay(np.mean(SPEED_M_S)), window_size - length)
+        offsets = rng.integers(0, window_size - length - delay + 1, count)
+        starts = (np.flatnonzero(potholes) * window_size + offsets[potholes])
+        self.insert_potholes(rng, data, labels, starts, length, delay)
+        return data.reshape(count, window_size, 12), potholes
+
+    def iter_vehicle(self, seconds, seed, potholes_per_minute=POTHOLES_PER_MINUTE, chunk_seconds=CHUNK_SECONDS):
+        """Yield one vehicle's drive log as dicts of FLEET_COLUMNS arrays, chunk_seconds at a time.
+
+        seed is anything np.random.default_rng accepts; SeedSequence.spawn
+        children give every vehicle an independent stream. Potholes are placed
+        within a chunk, never across a chunk boundary.
+        """
+        rng = np.random.default_rng(seed)
+        lat = ORIGIN[0] + rng.uniform(-ROUTE_SPREAD_DEG, ROUTE_SPREAD_DEG)
+        lng = ORIGIN[1] + rng.uniform(-ROUTE_SPREAD_DEG, ROUTE_SPREAD_DEG)
+        heading = rng.uniform(0, 2 * np.pi)
+        speed = rng.uniform(*SPEED_M_S)
+        delay = self.rear_delay(speed)
+        length = int(POTHOLE_SECONDS * self.sampling_rate)
+        per_fix = self.sampling_rate // GPS_RATE_HZ
+        # Whole GPS periods per chunk, so every chunk starts with a fresh fix
+        chunk = max(1, int(chunk_seconds * GPS_RATE_HZ)) * per_fix
+        total = int(seconds * self.sampling_rate)
+        fix_noise = np.degrees(GPS_NOISE_M / EARTH_RADIUS_M)
+
+        for start in range(0, total, chunk):
+            n = min(chunk, total - start)
+            t = (start + np.arange(n)) / self.sampling_rate
+            data = self.road_noise(rng, t)
+            labels = np.zeros(n, dtype=np.uint8)
+            count = rng.poisson(potholes_per_minute * n / self.sampling_rate / 60)
+            if count and n > length + delay:
+                starts = rng.integers(0, n - length - delay + 1, count)
+                self.insert_potholes(rng, data, labels, starts, length, delay)
+
+            # True position at each fix, then receiver noise, held until the next fix
+            fixes = -(-n // per_fix)
+            headings = heading + np.cumsum(rng.normal(0, HEADING_DRIFT / np.sqrt(GPS_RATE_HZ), fixes))
+            step = speed / GPS_RATE_HZ
+            d_lat = np.degrees(step * np.cos(headings) / EARTH_RADIUS_M)
+            d_lng = np.degrees(step * np.sin(headings) / (EARTH_RADIUS_M * np.cos(np.radians(lat))))
+            fix_lat = lat + np.cumsum(d_lat) - d_lat + rng.normal(0, fix_noise, fixes)
+            fix_lng = lng + np.cumsum(d_lng) - d_lng + rng.normal(0, fix_noise, fixes)
+            lat += d_lat.sum()
+            lng += d_lng.sum()
+            heading = headings[-1]
+
+            columns = {
+                'timestamp': t,
+                'latitude': np.repeat(fix_lat, per_fix)[:n],
+                'longitude': np.repeat(fix_lng, per_fix)[:n],
+            }
+            columns.update({channel: data[:, i] for i, channel in enumerate(CHANNELS)})
+            columns['label'] = labels
+            yield columns
+
     def plot_data(self, data, start_idx=0, duration=5):
         """Plot a section of the generated data"""
         samples = int(duration * self.sampling_rate)
@@ -102,19 +240,102 @@ class RoadDataGenerator:
         plt.tight_layout()
         plt.show()
 
+def _last_writes(indices):
+    """Positions in indices of the last occurrence of each distinct index"""
+    _, first_from_end = np.unique(indices[::-1], return_index=True)
+    return len(indices) - 1 - first_from_end
+
+def write_vehicle(task):
+    """Generate one vehicle's log and stream it to disk chunk by chunk; returns (path, samples, pothole samples)"""
+    vehicle, seed, output, seconds, fmt, sampling_rate, potholes_per_minute, chunk_seconds = task
+    generator = RoadDataGenerator(sampling_rate)
+    chunks = generator.iter_vehicle(seconds, seed, potholes_per_minute, chunk_seconds)
+    samples = pothole_samples = 0
+    if fmt == 'csv':
+        path = os.path.join(output, f'vehicle_{vehicle:05d}.csv')
+        with open(path, 'w', newline='') as f:
+            for columns in chunks:
+                pd.DataFrame(columns).to_csv(f, header=samples == 0, index=False, float_format='%.6f')
+                samples += len(columns['label'])
+                pothole_samples += int(columns['label'].sum())
+        return path, samples, pothole_samples
+
+    path = os.path.join(output, f'vehicle_{vehicle:05d}')
+    os.makedirs(path, exist_ok=True)
+    files = {column: open(os.path.join(path, f'{column}.bin'), 'wb') for column in FLEET_COLUMNS}
+    try:
+        for columns in chunks:
+            for column, dtype in FLEET_COLUMNS.items():
+                files[column].write(np.asarray(columns[column], dtype=dtype).tobytes())
+            samples += len(columns['label'])
+            pothole_samples += int(columns['label'].sum())
+    finally:
+        for f in files.values():
+            f.close()
+    # Written last, as in convert_to_cache, so a partial log is never mistaken for a complete one
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump({'samples': samples, 'columns': FLEET_COLUMNS, 'vehicle': vehicle,
+                   'sampling_rate': sampling_rate}, f, indent=2)
+    return path, samples, pothole_samples
+
+def generate_fleet(output, vehicles, seconds, processes=None, seed=0, fmt='bin', sampling_rate=100,
+                   potholes_per_minute=POTHOLES_PER_MINUTE, chunk_seconds=CHUNK_SECONDS):
+    """Write `vehicles` independent drive logs of `seconds` each into output/, one per vehicle, in parallel.
+
+    Each vehicle gets its own child of SeedSequence(seed), so a log depends
+    only on the seed and its vehicle number, not on the number of processes.
+    """
+    os.makedirs(output, exist_ok=True)
+    seeds = np.random.SeedSequence(seed).spawn(vehicles)
+    tasks = [(vehicle, seeds[vehicle], output, seconds, fmt, sampling_rate, potholes_per_minute, chunk_seconds)
+             for vehicle in range(vehicles)]
+    if processes == 1:
+        results = list(map(write_vehicle, tasks))
+    else:
+        with ProcessPoolExecutor(processes) as pool:
+            results = list(pool.map(write_vehicle, tasks))
+    with open(os.path.join(output, 'fleet.json'), 'w') as f:
+        json.dump({'vehicles': vehicles, 'seconds': seconds, 'seed': seed, 'format': fmt,
+                   'sampling_rate': sampling_rate, 'potholes_per_minute': potholes_per_minute,
+                   'columns': FLEET_COLUMNS, 'files': [os.path.basename(path) for path, _, _ in results]},
+                  f, indent=2)
+    return results
+
 if __name__ == "__main__":
-   
-    generator = RoadDataGenerator()
-    
-   
-    print("Generating dataset...")
-    data = generator.generate_dataset(normal_duration=60, num_potholes=20)
-    
-    # Plot first 5 seconds of data
-    print("Plotting data...")
-    generator.plot_data(data, duration=5)
-    
-    
-    print("Saving dataset...")
-    data.to_csv('synthetic_road_data.csv', index=False)
-    print(f"Generated dataset with {len(data)} samples and {int(data['label'].sum())} pothole instances")
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Generate synthetic road data")
+    parser.add_argument('--vehicles', type=int,
+                        help="Write 12-channel logs with GPS for this many vehicles into --output "
+                             "(default: the 3-axis synthetic_road_data.csv)")
+    parser.add_argument('--hours', type=float, default=1.0, help="Log length per vehicle")
+    parser.add_argument('--output', default='fleet_data')
+    parser.add_argument('--format', choices=['bin', 'csv'], default='bin')
+    parser.add_argument('--processes', type=int, help="Worker processes (default: one per CPU)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--potholes-per-minute', type=float, default=POTHOLES_PER_MINUTE)
+    args = parser.parse_args()
+
+    if args.vehicles:
+        start = time.perf_counter()
+        results = generate_fleet(args.output, args.vehicles, args.hours * 3600, args.processes, args.seed,
+                                 args.format, potholes_per_minute=args.potholes_per_minute)
+        elapsed = time.perf_counter() - start
+        samples = sum(samples for _, samples, _ in results)
+        size = sum(os.path.getsize(os.path.join(root, name))
+                   for root, _, names in os.walk(args.output) for name in names)
+        print(f"Wrote {args.vehicles} vehicles, {samples} samples ({size / 1e6:.1f} MB) to {args.output} "
+              f"in {elapsed:.1f} s, {samples / elapsed:,.0f} samples/s")
+    else:
+        generator = RoadDataGenerator()
+        
+       
+        print("Generating dataset...")
+        data = generator.generate_dataset(normal_duration=60, num_potholes=20)
+        
+        # Plot first 5 seconds of data
+        print("Plotting data...")
+        generator.plot_data(data, duration=5)
+        
+        
+        print("Saving dataset...")
+        data.to_csv('synthetic_road_data.csv', index=False)
+        print(f"Generated dataset with {len(data)} samples and {int(data['label'].sum())} pothole instances")
@@ -0,0 +1,238 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+from storage import MERGE_RADIUS_M, METERS_PER_DEGREE, query_points
+
+# Route queries are answered for their bounding box snapped outwards to this grid
+# (about 1 km), so nearly identical searches share one entry; rows outside the exact
+# box are filtered out of the cached result
+ROUTE_CACHE_GRID_DEG = float(os.environ.get('POTHOLE_ROUTE_CACHE_GRID_DEG', 0.01))
+ROUTE_CACHE_MB = float(os.environ.get('POTHOLE_ROUTE_CACHE_MB', 32))
+ROUTE_CACHE_TTL_S = float(os.environ.get('POTHOLE_ROUTE_CACHE_TTL_S', 300))
+# Time windows are widened to whole hours for the key and filtered exactly
+PERIOD_QUANTUM_MS = 3600000
+# Rough size of one cached row (a 9-tuple of ints and floats) and of an entry's bookkeeping
+ROW_BYTES = 350
+ENTRY_BYTES = 400
+# Invalidations remembered for in-flight fills; a fill older than these is not stored
+RECENT_INVALIDATIONS = 256
+
+
+class RouteCache:
+    """LRU + TTL cache of bounding-box pothole queries with write-through invalidation.
+
+    Entries are bounded by an estimated byte size and expire after ttl_s.
+    invalidate() drops only the entries whose box contains a written point,
+    and a query that was running while a point in its box was written is
+    answered but not cached, so a stale result is never stored.
+    """
+
+    def __init__(self, max_mb=ROUTE_CACHE_MB, ttl_s=ROUTE_CACHE_TTL_S, grid_deg=ROUTE_CACHE_GRID_DEG,
+                 merge_radius_m=MERGE_RADIUS_M):
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.ttl = ttl_s
+        self.grid = grid_deg
+        # A merge can move a pothole by up to the merge radius, so boxes are checked with that margin
+        self.margin = merge_radius_m / METERS_PER_DEGREE
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.uncached_fills = 0
+        self._entries = OrderedDict()
+        self._generation = 0
+        self._recent = deque(maxlen=RECENT_INVALIDATIONS)
+        self._lock = threading.Lock()
+
+    def query(self, conn, min_lat, min_lng, max_lat, max_lng, period=None):
+        """Same rows as storage.query_bbox_ids: (id, lat, lng, severity, timestamp, report_count)"""
+        min_lat, max_lat = sorted((min_lat, max_lat))
+        min_lng, max_lng = sorted((min_lng, max_lng))
+        key = self._key(min_lat, min_lng, max_lat, max_lng, period)
+        rows = self._get(key)
+        if rows is None:
+            rows = self._fill(conn, key)
+        # Cached rows are full query_points rows; last_seen is column 6
+        start, end = period or (None, None)
+        return [
+            row[:6] for row in rows
+            if min_lat <= row[1] <= max_lat and min_lng <= row[2] <= max_lng
+            and (period is None or start <= row[6] <= end)
+        ]
+
+    def invalidate(self, points):
+        """Drop the entries whose box holds any of the (lat, lng, ...) points just written"""
+        points = [(point[0], point[1]) for point in points]
+        if not points:
+            return 0
+        with self._lock:
+            self._generation += 1
+            self._recent.append((self._generation, points))
+            stale = [key for key, entry in self._entries.items() if self._touches(entry[1], points)]
+            for key in stale:
+                self._drop(key)
+            self.invalidations += len(stale)
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            # Anything filled before this point is stale
+            self._recent.clear()
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+                'uncached_fills': self.uncached_fills,
+            }
+
+    def _key(self, min_lat, min_lng, max_lat, max_lng, period):
+        grid = self.grid
+        key = (math.floor(min_lat / grid), math.floor(min_lng / grid),
+               math.floor(max_lat / grid) + 1, math.floor(max_lng / grid) + 1)
+        if period is not None:
+            key += (period[0] // PERIOD_QUANTUM_MS, -(-period[1] // PERIOD_QUANTUM_MS))
+        return key
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] < time.monotonic():
+                self._drop(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def _fill(self, conn, key):
+        grid = self.grid
+        box = (key[0] * grid, key[1] * grid, key[2] * grid, key[3] * grid)
+        period = None
+        if len(key) > 4:
+            period = (key[4] * PERIOD_QUANTUM_MS, key[5] * PERIOD_QUANTUM_MS)
+        with self._lock:
+            generation = self._generation
+        rows = query_points(conn, *box, period)
+        size = ENTRY_BYTES + ROW_BYTES * len(rows)
+
+        with self._lock:
+            # Written while we were reading, or too long ago to tell: answer without caching
+            missed = [points for seen, points in self._recent if seen > generation]
+            forgotten = not self._recent or self._recent[0][0] > generation + 1
+            if (self._generation > generation and forgotten) \
+                    or any(self._touches(box, points) for points in missed) or size > self.max_bytes:
+                self.uncached_fills += 1
+                return rows
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.monotonic() + self.ttl, box, rows, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+        return rows
+
+    def _touches(self, box, points):
+        min_lat, min_lng, max_lat, max_lng = box
+        margin = self.margin
+        # Longitude degrees shrink towards the poles
+        lng_margin = margin / max(math.cos(math.radians(max(abs(min_lat), abs(max_lat)))), 1e-6)
+        return any(min_lat - margin <= lat <= max_lat + margin and min_lng - lng_margin <= lng <= max_lng + lng_margin
+                   for lat, lng in points)
+
+    def _drop(self, key):
+        self.bytes -= self._entries.pop(key)[3]
+
+
+def benchmark(rows=1000000, queries=20000, corridors=500, skew=1.1, writes_per_1000=20, workdir='.'):
+    """Route-box latency uncached vs cached for a Zipf-skewed commuter query mix with interleaved writes"""
+    import numpy as np
+
+    from storage import _seed_potholes, get_connection, query_bbox_ids, store_or_merge, now_ms
+
+    rng = np.random.default_rng(0)
+    path = os.path.join(workdir, f'bench_route_cache_{rows}.db')
+    if os.path.exists(path):
+        os.remove(path)
+    _seed_potholes(path, rows, rng)
+    conn = get_connection(path)
+
+    # Commuter corridors of 5-30 km; each search jitters the endpoints by up to ~100 m,
+    # as geocoded addresses and map clicks do
+    starts = np.column_stack([rng.uniform(8.0, 29.5, corridors), rng.uniform(70.0, 89.5, corridors)])
+    ends = starts + rng.uniform(-0.25, 0.25, (corridors, 2))
+    ranks = np.arange(1, corridors + 1, dtype=np.float64)
+    weights = ranks ** -skew
+    picks = rng.choice(corridors, size=queries, p=weights / weights.sum())
+    jitter = rng.uniform(-0.001, 0.001, (queries, 4))
+    corners = np.concatenate([starts[picks] + jitter[:, :2], ends[picks] + jitter[:, 2:]], axis=1)
+    boxes = [(min(a, c), min(b, d), max(a, c), max(b, d)) for a, b, c, d in corners.tolist()]
+    write_at = set(rng.choice(queries, size=queries * writes_per_1000 // 1000, replace=False).tolist())
+
+    def run(fn):
+        latencies = []
+        for i, box in enumerate(boxes):
+            if i in write_at:
+                # A detection on the corridor being searched, so invalidation is exercised
+                lat, lng = (starts[picks[i]] + ends[picks[i]]) / 2
+                with conn:
+                    store_or_merge(conn, float(lat), float(lng), 0.8, now_ms())
+                if cache is not None:
+                    cache.invalidate([(float(lat), float(lng))])
+            start = time.perf_counter()
+            fn(box)
+            latencies.append(time.perf_counter() - start)
+        return np.array(latencies) * 1000
+
+    cache = None
+    base = run(lambda box: query_bbox_ids(conn, box[0], box[1], box[2], box[3]))
+    cache = RouteCache()
+    cached = run(lambda box: cache.query(conn, box[0], box[1], box[2], box[3]))
+
+    # The cache must agree with the database on the final state
+    for box in boxes[:200]:
+        assert sorted(cache.query(conn, *box)) == sorted(query_bbox_ids(conn, *box))
+
+    print(f"{rows} rows, {queries} queries over {corridors} corridors (zipf {skew}), "
+          f"{len(write_at)} interleaved writes")
+    print(f"{'':>10} {'mean_ms':>9} {'p50_ms':>9} {'p99_ms':>9}")
+    for name, latencies in [('uncached', base), ('cached', cached)]:
+        print(f"{name:>10} {latencies.mean():>9.3f} {np.percentile(latencies, 50):>9.3f} "
+              f"{np.percentile(latencies, 99):>9.3f}")
+    print(cache.stats())
+    os.remove(path)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the /api/route result cache")
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--queries', type=int, default=20000)
+    parser.add_argument('--corridors', type=int, default=500)
+    parser.add_argument('--skew', type=float, default=1.1, help="Zipf exponent of corridor popularity")
+    args = parser.parse_args()
+    benchmark(args.rows, args.queries, args.corridors, args.skew)
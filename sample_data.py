@@ -1,6 +1,5 @@
 import geopy.distance
-import sqlite3
-from datetime import datetime
+from storage import INSERT_POTHOLE, get_connection, init_db, now_ms
 
 # Step 1: Define the start and end coordinates
 start_coords = (12.985330555555556, 79.96983055555556)  # Converted from 12° 59' 7.19" N, 79° 58' 11.39" E
@@ -14,30 +13,17 @@ longitudes = [start_coords[1] + i * (end_coords[1] - start_coords[1]) / (num_poi
 # Combine coordinates into pothole locations
 pothole_locations = list(zip(latitudes, longitudes))
 
-# Step 3: Create the database table if it doesn't exist and insert the data
-conn = sqlite3.connect('potholes.db')
+# Step 3: Bring the database schema up to date and insert the data
+init_db()
+conn = get_connection()
 cursor = conn.cursor()
 
-# Create the potholes table
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS potholes (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    latitude REAL NOT NULL,
-    longitude REAL NOT NULL,
-    severity REAL NOT NULL,
-    timestamp TEXT NOT NULL
-)
-''')
-
 # Insert the 10 pothole locations with varying severity
 for i, (lat, lng) in enumerate(pothole_locations):
     # Vary the severity slightly for more realistic data
     severity = 0.7 + (i % 3) * 0.1  # Values between 0.7 and 0.9
     
-    cursor.execute(
-        "INSERT INTO potholes (latitude, longitude, severity, timestamp) VALUES (?, ?, ?, ?)",
-        (lat, lng, severity, datetime.now().isoformat())
-    )
+    cursor.execute(INSERT_POTHOLE, (lat, lng, severity, now_ms()))
 
 # Commit and close connection
 conn.commit()
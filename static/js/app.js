@@ -13,6 +13,17 @@ document.addEventListener('DOMContentLoaded', function() {
     let searchTimeout = null;
     let routeMarkers = [];
     
+    // Potholes in the current viewport: server-side clusters below POINT_ZOOM,
+    // individual markers (kept in sync incrementally) at POINT_ZOOM and above
+    const POINT_ZOOM = 14;
+    const viewportLayer = L.layerGroup().addTo(map);
+    const viewportMarkers = new Map();  // pothole id -> marker
+    let viewportEtag = null;
+    let syncCursor = null;
+    
+    // Potholes further than this from the route line are not shown for a route
+    const ROUTE_CORRIDOR_WIDTH_M = 30;
+    
     // Get user's location if available
     if (navigator.geolocation) {
         navigator.geolocation.getCurrentPosition(function(position) {
@@ -47,48 +58,127 @@ document.addEventListener('DOMContentLoaded', function() {
         fetchPotholes();
     }
     
-    // Fetch potholes from API
+    function viewportBbox() {
+        const bounds = map.getBounds();
+        return [bounds.getWest(), bounds.getSouth(), bounds.getEast(), bounds.getNorth()]
+            .map(value => value.toFixed(5)).join(',');
+    }
+    
+    // Fetch potholes for the viewport; unchanged views are revalidated by ETag and not redrawn.
+    // Zoomed out, the severity heatmap replaces individual markers.
     function fetchPotholes() {
-        fetch('/api/potholes')
-            .then(response => response.json())
+        if (map.getZoom() < POINT_ZOOM) {
+            fetchHeatmap();
+            return;
+        }
+        
+        fetch(`/api/potholes?bbox=${viewportBbox()}&zoom=${map.getZoom()}`, { cache: 'no-cache' })
+            .then(response => {
+                const etag = response.headers.get('ETag');
+                if (etag && etag === viewportEtag) {
+                    return null;
+                }
+                viewportEtag = etag;
+                return response.json();
+            })
             .then(data => {
-                // Remove existing markers
-                potholeMarkers.forEach(marker => map.removeLayer(marker));
-                potholeMarkers = [];
+                if (!data) return;
                 
-                // Update count
-                document.getElementById('pothole-count').textContent = `Potholes on route: ${data.length}`;
+                viewportLayer.clearLayers();
+                viewportMarkers.clear();
+                syncCursor = data.cursor;
+                data.potholes.forEach(upsertPotholeMarker);
+            })
+            .catch(error => console.error('Error fetching potholes:', error));
+    }
+    
+    function fetchHeatmap() {
+        fetch(`/api/heatmap?bbox=${viewportBbox()}`)
+            .then(response => response.json())
+            .then(data => {
+                viewportLayer.clearLayers();
+                viewportMarkers.clear();
+                viewportEtag = null;
+                syncCursor = null;
+                if (!data.count) return;
                 
-                // Add markers for each pothole
-                data.forEach(pothole => {
-                    const marker = L.circleMarker([pothole.lat, pothole.lng], {
-                        radius: 12,
-                        fillColor: getSeverityColor(pothole.severity),
-                        color: '#000',
-                        weight: 2,
-                        opacity: 1,
-                        fillOpacity: 0.9,
-                        zIndex: 1000
-                    }).addTo(map);
-                    
-                    marker.bindPopup(`
-                        <strong>Pothole</strong><br>
-                        Severity: ${(pothole.severity * 10).toFixed(1)}/10<br>
-                        Detected: ${new Date(pothole.timestamp).toLocaleString()}
-                    `);
-                    
-                    potholeMarkers.push(marker);
+                for (let i = 0; i < data.count.length; i++) {
+                    const south = (data.row0 + data.rows[i]) * data.cell_deg - 90;
+                    const west = (data.col0 + data.cols[i]) * data.cell_deg - 180;
+                    L.rectangle([[south, west], [south + data.cell_deg, west + data.cell_deg]], {
+                        stroke: false,
+                        fillColor: getSeverityColor(data.max[i]),
+                        fillOpacity: Math.min(0.25 + 0.2 * Math.log10(data.count[i]), 0.8)
+                    })
+                        .bindTooltip(`${data.count[i]} potholes, mean severity ${(data.mean[i] * 10).toFixed(1)}/10, ` +
+                                     `worst ${(data.max[i] * 10).toFixed(1)}/10`)
+                        .addTo(viewportLayer);
+                }
+            })
+            .catch(error => console.error('Error fetching heatmap:', error));
+    }
+    
+    // Pull only potholes added, changed or removed since the last response
+    function syncPotholes() {
+        if (map.getZoom() < POINT_ZOOM || syncCursor === null) {
+            fetchPotholes();
+            return;
+        }
+        
+        fetch(`/api/potholes?since=${syncCursor}&bbox=${viewportBbox()}`)
+            .then(response => response.json())
+            .then(data => {
+                if (data.reset) {
+                    // The server no longer knows every deletion since our cursor
+                    viewportEtag = null;
+                    syncCursor = null;
+                    fetchPotholes();
+                    return;
+                }
+                data.potholes.forEach(upsertPotholeMarker);
+                data.deleted.forEach(id => {
+                    const marker = viewportMarkers.get(id);
+                    if (marker) {
+                        viewportLayer.removeLayer(marker);
+                        viewportMarkers.delete(id);
+                    }
                 });
-                
-                // Fit map to show all markers if there are any
-                if (potholeMarkers.length > 0) {
-                    const group = new L.featureGroup(potholeMarkers);
-                    map.fitBounds(group.getBounds());
+                syncCursor = data.cursor;
+                if (data.potholes.length > 0 || data.deleted.length > 0) {
+                    viewportEtag = null;
                 }
             })
-            .catch(error => console.error('Error fetching potholes:', error));
+            .catch(error => console.error('Error syncing potholes:', error));
     }
     
+    function upsertPotholeMarker(pothole) {
+        const existing = viewportMarkers.get(pothole.id);
+        if (existing) {
+            viewportLayer.removeLayer(existing);
+        }
+        
+        const marker = L.circleMarker([pothole.lat, pothole.lng], {
+            radius: 12,
+            fillColor: getSeverityColor(pothole.severity),
+            color: '#000',
+            weight: 2,
+            opacity: 1,
+            fillOpacity: 0.9,
+            zIndex: 1000
+        }).addTo(viewportLayer);
+        
+        marker.bindPopup(`
+            <strong>Pothole</strong><br>
+            Severity: ${(pothole.severity * 10).toFixed(1)}/10<br>
+            Reports: ${pothole.report_count}<br>
+            First detected: ${new Date(pothole.timestamp).toLocaleString()}
+        `);
+        
+        viewportMarkers.set(pothole.id, marker);
+    }
+    
+    map.on('moveend', fetchPotholes);
+    
     // Get color based on severity
     function getSeverityColor(severity) {
         if (severity > 0.8) return '#ff0000'; // Severe
@@ -390,12 +480,15 @@ document.addEventListener('DOMContentLoaded', function() {
                 displayDirections(route.legs[0].steps);
             }
             
-            // Calculate route bounds to query for potholes
-            const bounds = currentRoute.getBounds();
-            const bufferDeg = 0.02;  // About 2km buffer
-            
-            // Query for potholes along route
-            const response = await fetch(`/api/route?start_lat=${bounds.getSouth() - bufferDeg}&start_lng=${bounds.getWest() - bufferDeg}&end_lat=${bounds.getNorth() + bufferDeg}&end_lng=${bounds.getEast() + bufferDeg}`);
+            // Query for potholes within a corridor around the actual route geometry
+            const response = await fetch('/api/route/corridor', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({
+                    coordinates: route.geometry.coordinates,
+                    width_m: ROUTE_CORRIDOR_WIDTH_M
+                })
+            });
             const data = await response.json();
             
             // Update pothole count display
@@ -424,7 +517,9 @@ document.addEventListener('DOMContentLoaded', function() {
                     marker.bindPopup(`
                         <strong>Pothole</strong><br>
                         Severity: ${(pothole.severity * 10).toFixed(1)}/10<br>
-                        Detected: ${new Date(pothole.timestamp).toLocaleString()}
+                        ${(pothole.route_offset_m / 1000).toFixed(1)} km along route<br>
+                        Reports: ${pothole.report_count}<br>
+                        First detected: ${new Date(pothole.timestamp).toLocaleString()}
                     `);
                     
                     potholeMarkers.push(marker);
@@ -455,6 +550,6 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     });
     
-    // Set up periodic refresh of pothole data (every 30 seconds)
-    setInterval(fetchPotholes, 30000);
+    // Set up periodic incremental refresh of pothole data (every 30 seconds)
+    setInterval(syncPotholes, 30000);
 });
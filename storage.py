@@ -0,0 +1,1228 @@
+import math
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+DB_PATH = os.environ.get('POTHOLE_DB', 'potholes.db')
+
+# Group-commit settings for the background writer
+WRITE_BATCH_SIZE = int(os.environ.get('POTHOLE_WRITE_BATCH', 256))
+WRITE_INTERVAL_MS = float(os.environ.get('POTHOLE_WRITE_INTERVAL_MS', 50))
+MAX_PENDING_WRITES = int(os.environ.get('POTHOLE_MAX_PENDING_WRITES', 10000))
+# Tries at switching a new database to WAL while other threads open it too
+WAL_SWITCH_ATTEMPTS = 20
+
+# Detections closer than this to a known pothole are merged into it
+MERGE_RADIUS_M = float(os.environ.get('POTHOLE_MERGE_RADIUS_M', 10))
+
+# Fixed grid used to bucket potholes for neighbour lookups. Part of the schema:
+# the generated `cell` column is computed from these, so changing them needs a migration.
+CELL_DEG = 0.0002
+CELL_COLUMNS = 1800000  # 360 / CELL_DEG
+METERS_PER_DEGREE = 111320.0
+EARTH_RADIUS_M = 6371000.0
+
+# Reports whose pothole was last seen longer ago than this are rolled up by month and
+# removed by the retention job (0 keeps everything)
+RETENTION_DAYS = float(os.environ.get('POTHOLE_RETENTION_DAYS', 365))
+RETENTION_INTERVAL_S = float(os.environ.get('POTHOLE_RETENTION_INTERVAL_S', 3600))
+# Deletion tombstones older than this are pruned by the retention job; a client
+# whose sync cursor predates the oldest kept one must reload from scratch
+TOMBSTONE_DAYS = float(os.environ.get('POTHOLE_TOMBSTONE_DAYS', 30))
+# Rows moved per retention transaction, so the detection writer never waits long
+RETENTION_BATCH_ROWS = 5000
+# Free pages handed back to the filesystem per incremental vacuum step
+VACUUM_PAGES = 2000
+DAY_MS = 86400000
+# Time windows holding fewer potholes than this are answered from the time index instead of the R*Tree
+PERIOD_INDEX_ROWS = 5000
+# Rollup grid, coarser than CELL_DEG: about 1 km
+ROLLUP_CELL_DEG = 0.01
+ROLLUP_COLUMNS = 36000  # 360 / ROLLUP_CELL_DEG
+
+# Heatmap aggregate resolutions, coarsest first; level i covers the globe with
+# HEATMAP_COLUMNS[i] columns of HEATMAP_CELL_DEG[i] degrees. Part of the schema.
+HEATMAP_CELL_DEG = (0.128, 0.032, 0.008, 0.002)
+HEATMAP_COLUMNS = tuple(math.ceil(360 / deg) for deg in HEATMAP_CELL_DEG)
+
+# Generated `cell` column: row-major index of the CELL_DEG grid cell holding the point
+_CELL_EXPR = f"""
+    CAST((latitude + 90.0) / {CELL_DEG} AS INTEGER) * {CELL_COLUMNS}
+    + CAST((longitude + 180.0) / {CELL_DEG} AS INTEGER)
+"""
+
+# (lat, lng, severity, timestamp); timestamps are epoch milliseconds and a new
+# pothole is first and last seen at `timestamp`
+INSERT_POTHOLE = """
+    INSERT INTO potholes (latitude, longitude, severity, timestamp, last_seen, max_severity)
+    VALUES (?1, ?2, ?3, ?4, ?4, ?3)
+"""
+
+_local = threading.local()
+_STOP = object()
+# Connections opened by get_connection, one per thread and database
+_connections_opened = 0
+_connections_lock = threading.Lock()
+
+
+def now_ms():
+    """Current time as integer epoch milliseconds, the unit of every stored timestamp"""
+    return int(time.time() * 1000)
+
+
+def connect(path=DB_PATH):
+    """Open a connection in WAL mode so readers never wait on the writer"""
+    conn = sqlite3.connect(path, timeout=30)
+    # Only takes effect on a new, empty database; init_db converts older ones
+    conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+    _use_wal(conn)
+    # WAL is crash-safe with NORMAL; only the last commits can be lost on power failure
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+
+def _use_wal(conn, attempts=WAL_SWITCH_ATTEMPTS):
+    # WAL is persistent, so only a new database needs the switch. The switch takes
+    # an exclusive lock and can fail with "database is locked" without waiting on
+    # the busy timeout while another thread opens the same new database.
+    for attempt in range(attempts):
+        if conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal':
+            return
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            return
+        except sqlite3.OperationalError:
+            if attempt == attempts - 1:
+                raise
+            time.sleep(0.01 * 2 ** min(attempt, 6))
+
+
+def get_connection(path=DB_PATH):
+    """Return this thread's connection to the database, opening it on first use"""
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+    conn = connections.get(path)
+    if conn is None:
+        global _connections_opened
+        conn = connections[path] = connect(path)
+        with _connections_lock:
+            _connections_opened += 1
+    return conn
+
+
+def connections_opened():
+    """Number of per-thread connections get_connection has opened in this process"""
+    return _connections_opened
+
+
+def _execute_script(conn, script):
+    """Run a multi-statement script inside the caller's transaction.
+
+    Unlike executescript, which commits first, this lets init_db apply a
+    migration and its user_version in one transaction.
+    """
+    statement = ''
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            conn.execute(statement)
+            statement = ''
+    if statement.strip():
+        conn.execute(statement)
+
+
+def _create_potholes(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS potholes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        latitude REAL NOT NULL,
+        longitude REAL NOT NULL,
+        severity REAL NOT NULL,
+        timestamp TEXT NOT NULL
+    )
+    ''')
+
+
+_RTREE_TRIGGERS = '''
+    CREATE TRIGGER IF NOT EXISTS potholes_rtree_insert AFTER INSERT ON potholes BEGIN
+        INSERT INTO potholes_rtree VALUES (new.id, new.latitude, new.latitude, new.longitude, new.longitude);
+    END;
+    CREATE TRIGGER IF NOT EXISTS potholes_rtree_update AFTER UPDATE OF latitude, longitude ON potholes BEGIN
+        UPDATE potholes_rtree SET min_lat = new.latitude, max_lat = new.latitude,
+                                  min_lng = new.longitude, max_lng = new.longitude
+        WHERE id = new.id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS potholes_rtree_delete AFTER DELETE ON potholes BEGIN
+        DELETE FROM potholes_rtree WHERE id = old.id;
+    END;
+'''
+
+_SEQ_TRIGGERS = '''
+    CREATE TRIGGER IF NOT EXISTS potholes_seq_insert AFTER INSERT ON potholes BEGIN
+        UPDATE sync_state SET seq = seq + 1;
+        UPDATE potholes SET updated_seq = (SELECT seq FROM sync_state) WHERE id = new.id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS potholes_seq_update
+    AFTER UPDATE OF latitude, longitude, severity, report_count, last_seen, max_severity ON potholes BEGIN
+        UPDATE sync_state SET seq = seq + 1;
+        UPDATE potholes SET updated_seq = (SELECT seq FROM sync_state) WHERE id = new.id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS potholes_seq_delete AFTER DELETE ON potholes BEGIN
+        UPDATE sync_state SET seq = seq + 1;
+        INSERT INTO pothole_deletions (seq, id) SELECT seq, old.id FROM sync_state;
+    END;
+'''
+
+
+def _add_rtree_index(conn):
+    # R*Tree over each pothole's point, kept in sync with the base table by triggers
+    _execute_script(conn, '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS potholes_rtree USING rtree(
+        id, min_lat, max_lat, min_lng, max_lng
+    );
+    INSERT OR IGNORE INTO potholes_rtree
+        SELECT id, latitude, latitude, longitude, longitude FROM potholes;
+    ''' + _RTREE_TRIGGERS)
+
+
+def _add_report_aggregates(conn):
+    # One row per physical pothole: repeated reports are merged into it on ingest.
+    # `timestamp` is when the pothole was first seen.
+    _execute_script(conn, f'''
+    ALTER TABLE potholes ADD COLUMN report_count INTEGER NOT NULL DEFAULT 1;
+    ALTER TABLE potholes ADD COLUMN last_seen TEXT;
+    ALTER TABLE potholes ADD COLUMN max_severity REAL;
+    UPDATE potholes SET last_seen = timestamp, max_severity = severity;
+
+    ALTER TABLE potholes ADD COLUMN cell INTEGER GENERATED ALWAYS AS ({_CELL_EXPR}) VIRTUAL;
+    CREATE INDEX IF NOT EXISTS idx_potholes_cell ON potholes(cell);
+    ''')
+
+
+def _add_change_tracking(conn):
+    # Every insert, change and delete takes the next value of a global sequence.
+    # Clients use it as a cursor to fetch only what changed since their last sync.
+    _execute_script(conn, '''
+    CREATE TABLE IF NOT EXISTS sync_state (
+        id INTEGER PRIMARY KEY CHECK (id = 0),
+        seq INTEGER NOT NULL
+    );
+    INSERT OR IGNORE INTO sync_state VALUES (0, 0);
+
+    ALTER TABLE potholes ADD COLUMN updated_seq INTEGER NOT NULL DEFAULT 0;
+    UPDATE potholes SET updated_seq = id;
+    UPDATE sync_state SET seq = (SELECT COALESCE(MAX(id), 0) FROM potholes);
+    CREATE INDEX IF NOT EXISTS idx_potholes_updated_seq ON potholes(updated_seq);
+
+    CREATE TABLE IF NOT EXISTS pothole_deletions (
+        seq INTEGER PRIMARY KEY,
+        id INTEGER NOT NULL
+    );
+    ''' + _SEQ_TRIGGERS)
+
+
+def _timestamp_tombstones(conn):
+    # Tombstones get their deletion time so retention can prune old ones.
+    # sync_state.pruned_seq is the newest pruned tombstone's seq: a cursor below
+    # it may have missed deletions. Tombstones from before this migration count
+    # as deleted now.
+    _execute_script(conn, f'''
+    ALTER TABLE pothole_deletions ADD COLUMN deleted_at INTEGER NOT NULL DEFAULT 0;
+    UPDATE pothole_deletions SET deleted_at = {now_ms()};
+    CREATE INDEX idx_pothole_deletions_deleted_at ON pothole_deletions(deleted_at);
+    ALTER TABLE sync_state ADD COLUMN pruned_seq INTEGER NOT NULL DEFAULT 0;
+
+    DROP TRIGGER potholes_seq_delete;
+    CREATE TRIGGER potholes_seq_delete AFTER DELETE ON potholes BEGIN
+        UPDATE sync_state SET seq = seq + 1;
+        INSERT INTO pothole_deletions (seq, id, deleted_at)
+            SELECT seq, old.id, CAST((julianday('now') - 2440587.5) * {DAY_MS} AS INTEGER) FROM sync_state;
+    END;
+    ''')
+
+
+def _ms_from_iso(column):
+    # ISO text from datetime.now() is local time; 'utc' converts it before taking epoch ms
+    return f"""CASE WHEN typeof({column}) = 'integer' THEN {column}
+        ELSE CAST(ROUND((julianday({column}, 'utc') - 2440587.5) * {DAY_MS}) AS INTEGER) END"""
+
+
+def _use_epoch_timestamps(conn):
+    # SQLite cannot change a column's type, so the table is rebuilt with integer
+    # epoch-ms `timestamp` / `last_seen`, keeping ids, sequence numbers and the R*Tree
+    next_id = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'potholes'").fetchone()
+    _execute_script(conn, f'''
+    CREATE TABLE potholes_epoch (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        latitude REAL NOT NULL,
+        longitude REAL NOT NULL,
+        severity REAL NOT NULL,
+        timestamp INTEGER NOT NULL,
+        report_count INTEGER NOT NULL DEFAULT 1,
+        last_seen INTEGER NOT NULL,
+        max_severity REAL,
+        cell INTEGER GENERATED ALWAYS AS ({_CELL_EXPR}) VIRTUAL,
+        updated_seq INTEGER NOT NULL DEFAULT 0
+    );
+    INSERT INTO potholes_epoch (id, latitude, longitude, severity, timestamp,
+                                report_count, last_seen, max_severity, updated_seq)
+        SELECT id, latitude, longitude, severity, COALESCE({_ms_from_iso('timestamp')}, 0),
+               report_count, COALESCE({_ms_from_iso('last_seen')}, {_ms_from_iso('timestamp')}, 0),
+               max_severity, updated_seq
+        FROM potholes;
+
+    DROP TRIGGER potholes_rtree_insert;
+    DROP TRIGGER potholes_rtree_update;
+    DROP TRIGGER potholes_rtree_delete;
+    DROP TRIGGER potholes_seq_insert;
+    DROP TRIGGER potholes_seq_update;
+    DROP TRIGGER potholes_seq_delete;
+    DROP TABLE potholes;
+    ALTER TABLE potholes_epoch RENAME TO potholes;
+    UPDATE sqlite_sequence SET seq = MAX(seq, {next_id[0] if next_id else 0}) WHERE name = 'potholes';
+
+    -- Cell lookups (ingest merging) can be narrowed by time, and time ranges by cell
+    CREATE INDEX idx_potholes_cell_seen ON potholes(cell, last_seen);
+    CREATE INDEX idx_potholes_seen_cell ON potholes(last_seen, cell);
+    CREATE INDEX idx_potholes_updated_seq ON potholes(updated_seq);
+    ''' + _RTREE_TRIGGERS + _SEQ_TRIGGERS + '''
+
+    -- Potholes removed by retention, aggregated per month of last report and ROLLUP_CELL_DEG cell
+    CREATE TABLE pothole_monthly (
+        month INTEGER NOT NULL,
+        cell INTEGER NOT NULL,
+        potholes INTEGER NOT NULL,
+        reports INTEGER NOT NULL,
+        severity_sum REAL NOT NULL,
+        max_severity REAL NOT NULL,
+        PRIMARY KEY (month, cell)
+    ) WITHOUT ROWID;
+    ''')
+
+
+def _heat_cell(row, level):
+    # Heatmap cell of a pothole row alias (new, old, p) at one level
+    deg, columns = HEATMAP_CELL_DEG[level], HEATMAP_COLUMNS[level]
+    return (f"(CAST(({row}.latitude + 90.0) / {deg!r} AS INTEGER) * {columns}"
+            f" + CAST(({row}.longitude + 180.0) / {deg!r} AS INTEGER))")
+
+
+def _heatmap_add(row):
+    return ''.join(f'''
+        INSERT INTO heatmap_cells (level, cell, count, severity_sum, max_severity, updated_at)
+        VALUES ({level}, {_heat_cell(row, level)}, 1, {row}.severity,
+                COALESCE({row}.max_severity, {row}.severity), {row}.last_seen)
+        ON CONFLICT (level, cell) DO UPDATE SET
+            count = count + 1,
+            severity_sum = severity_sum + excluded.severity_sum,
+            max_severity = MAX(max_severity, excluded.max_severity),
+            updated_at = MAX(updated_at, excluded.updated_at);''' for level in range(len(HEATMAP_CELL_DEG)))
+
+
+def _heatmap_remove(rescan_when='1'):
+    # Count and severity sum are subtracted; a maximum cannot be, so when the
+    # removed row may have held the cell's max severity or latest report, both
+    # are recomputed from the potholes left in that cell through the R*Tree
+    statements = []
+    for level, deg in enumerate(HEATMAP_CELL_DEG):
+        cell = _heat_cell('old', level)
+        lat0 = f"(CAST((old.latitude + 90.0) / {deg!r} AS INTEGER) * {deg!r} - 90.0)"
+        lng0 = f"(CAST((old.longitude + 180.0) / {deg!r} AS INTEGER) * {deg!r} - 180.0)"
+        statements.append(f'''
+        UPDATE heatmap_cells SET count = count - 1, severity_sum = severity_sum - old.severity
+        WHERE level = {level} AND cell = {cell};
+        DELETE FROM heatmap_cells WHERE level = {level} AND cell = {cell} AND count = 0;
+        UPDATE heatmap_cells SET (max_severity, updated_at) = (
+            SELECT MAX(COALESCE(p.max_severity, p.severity)), MAX(p.last_seen)
+            FROM potholes_rtree r JOIN potholes p ON p.id = r.id
+            WHERE r.max_lat >= {lat0} - 1e-6 AND r.min_lat <= {lat0} + {deg!r} + 1e-6
+            AND r.max_lng >= {lng0} - 1e-6 AND r.min_lng <= {lng0} + {deg!r} + 1e-6
+            AND {_heat_cell('p', level)} = {cell}
+        )
+        WHERE level = {level} AND cell = {cell}
+        AND (max_severity <= COALESCE(old.max_severity, old.severity) OR updated_at <= old.last_seen)
+        AND ({rescan_when.format(cell=cell, new_cell=_heat_cell('new', level))});''')
+    return ''.join(statements)
+
+
+def _add_heatmap(conn):
+    # Per-cell pothole count, severity sum (for the mean), max severity and latest
+    # report at each HEATMAP_CELL_DEG level, kept current by triggers inside the
+    # same transaction as the write that changed the pothole
+    _execute_script(conn, '''
+    CREATE TABLE IF NOT EXISTS heatmap_cells (
+        level INTEGER NOT NULL,
+        cell INTEGER NOT NULL,
+        count INTEGER NOT NULL,
+        severity_sum REAL NOT NULL,
+        max_severity REAL NOT NULL,
+        updated_at INTEGER NOT NULL,
+        PRIMARY KEY (level, cell)
+    ) WITHOUT ROWID;
+
+    CREATE TRIGGER IF NOT EXISTS potholes_heatmap_insert AFTER INSERT ON potholes BEGIN'''
+        + _heatmap_add('new') + '''
+    END;
+    CREATE TRIGGER IF NOT EXISTS potholes_heatmap_delete AFTER DELETE ON potholes BEGIN'''
+        + _heatmap_remove() + '''
+    END;
+    CREATE TRIGGER IF NOT EXISTS potholes_heatmap_update
+    AFTER UPDATE OF latitude, longitude, severity, max_severity, last_seen ON potholes BEGIN'''
+        # Merged reports only raise max_severity and last_seen, so the rescan
+        # is needed only when the pothole changed cell or either went down
+        + _heatmap_remove("{new_cell} != {cell} OR COALESCE(new.max_severity, new.severity) "
+                          "< COALESCE(old.max_severity, old.severity) OR new.last_seen < old.last_seen")
+        + _heatmap_add('new') + '''
+    END;
+    ''')
+    _recompute_heatmap(conn)
+
+
+_HEATMAP_RECOMPUTE = """
+    SELECT {level}, {cell}, COUNT(*), SUM(p.severity), MAX(COALESCE(p.max_severity, p.severity)), MAX(p.last_seen)
+    FROM potholes p GROUP BY 2
+"""
+
+
+def rebuild_heatmap(conn):
+    """Recompute every heatmap cell from the potholes table in one transaction"""
+    with conn:
+        _recompute_heatmap(conn)
+
+
+def _recompute_heatmap(conn):
+    conn.execute("DELETE FROM heatmap_cells")
+    for level in range(len(HEATMAP_CELL_DEG)):
+        conn.execute("INSERT INTO heatmap_cells " +
+                     _HEATMAP_RECOMPUTE.format(level=level, cell=_heat_cell('p', level)))
+
+
+def check_heatmap(conn, tolerance=1e-6):
+    """Compare the maintained heatmap with a full recomputation.
+
+    Returns {level: (cells, mismatched_cells)}; severity sums may differ by
+    tolerance, as incremental and batch sums round differently.
+    """
+    result = {}
+    for level in range(len(HEATMAP_CELL_DEG)):
+        with conn:
+            conn.execute("DROP TABLE IF EXISTS temp.heatmap_expected")
+            conn.execute("""CREATE TEMP TABLE heatmap_expected (level, cell, count, severity_sum, max_severity,
+                                                                updated_at, PRIMARY KEY (level, cell))""")
+            conn.execute("INSERT INTO heatmap_expected " +
+                         _HEATMAP_RECOMPUTE.format(level=level, cell=_heat_cell('p', level)))
+            cells = conn.execute("SELECT COUNT(*) FROM heatmap_expected").fetchone()[0]
+            wrong = conn.execute("""
+                SELECT COUNT(*) FROM heatmap_expected e LEFT JOIN heatmap_cells h
+                    ON h.level = e.level AND h.cell = e.cell
+                WHERE h.cell IS NULL OR h.count != e.count OR ABS(h.severity_sum - e.severity_sum) > ?
+                OR h.max_severity != e.max_severity OR h.updated_at != e.updated_at
+            """, (tolerance,)).fetchone()[0]
+            extra = conn.execute("""
+                SELECT COUNT(*) FROM heatmap_cells h LEFT JOIN heatmap_expected e ON e.cell = h.cell
+                WHERE h.level = ? AND e.cell IS NULL
+            """, (level,)).fetchone()[0]
+            conn.execute("DROP TABLE heatmap_expected")
+        result[level] = (cells, wrong + extra)
+    return result
+
+
+def heatmap_level(min_lng, max_lng, columns):
+    """Finest level that covers the width max_lng - min_lng with at most `columns` cells"""
+    width = max(max_lng - min_lng, 1e-9)
+    for level in range(len(HEATMAP_CELL_DEG) - 1, 0, -1):
+        if width / HEATMAP_CELL_DEG[level] <= columns:
+            return level
+    return 0
+
+
+def query_heatmap(conn, level, min_lat, min_lng, max_lat, max_lng):
+    """Heatmap cells at `level` inside the box as (row, col, count, mean, max_severity, updated_at),
+    row/col being the cell's grid position from (-90, -180)"""
+    deg, columns = HEATMAP_CELL_DEG[level], HEATMAP_COLUMNS[level]
+    min_row, max_row = int((min_lat + 90.0) / deg), int((max_lat + 90.0) / deg)
+    min_col, max_col = int((min_lng + 180.0) / deg), int((max_lng + 180.0) / deg)
+    return conn.execute("""
+        SELECT cell / ?1, cell % ?1, count, severity_sum / count, max_severity, updated_at
+        FROM heatmap_cells
+        WHERE level = ?2 AND cell BETWEEN ?3 AND ?4 AND cell % ?1 BETWEEN ?5 AND ?6
+    """, (columns, level, min_row * columns + min_col, max_row * columns + max_col,
+          min_col, max_col)).fetchall()
+
+
+# Schema migrations, applied in order; PRAGMA user_version records how many have run
+MIGRATIONS = [
+    _create_potholes,
+    _add_rtree_index,
+    _add_report_aggregates,
+    _add_change_tracking,
+    _use_epoch_timestamps,
+    _add_heatmap,
+    _timestamp_tombstones,
+]
+
+
+def init_db(path=DB_PATH):
+    """Create the schema or bring an existing database up to date"""
+    conn = get_connection(path)
+    initial = conn.execute('PRAGMA user_version').fetchone()[0]
+    while True:
+        # Each migration and its version bump commit together or not at all, so
+        # a failed migration leaves the schema as it was and can simply be re-run.
+        # The version is read under the write lock, so concurrent init_db calls
+        # never apply the same migration twice.
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            if version >= len(MIGRATIONS):
+                break
+            migration = MIGRATIONS[version]
+            migration(conn)
+            conn.execute(f'PRAGMA user_version = {version + 1}')
+        if initial:
+            print(f"Migrated {path} to schema version {version + 1} ({migration.__name__.strip('_')})")
+
+    # Retention frees pages with incremental vacuum, which databases created
+    # before it have to be rewritten once to support
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        print(f"Rewriting {path} once to enable incremental vacuum")
+        conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        conn.execute('VACUUM')
+
+
+_BBOX_QUERY = """
+    SELECT {columns}
+    FROM potholes_rtree r JOIN potholes p ON p.id = r.id
+    WHERE r.max_lat >= ? AND r.min_lat <= ? AND r.max_lng >= ? AND r.min_lng <= ?
+    AND p.latitude BETWEEN ? AND ?
+    AND p.longitude BETWEEN ? AND ?
+"""
+
+# Same result driven by the (last_seen, cell) index, for time windows holding few potholes.
+# The cell row/column bounds are checked on the index entry, before the table row is read.
+_PERIOD_QUERY = f"""
+    SELECT {{columns}}
+    FROM potholes p INDEXED BY idx_potholes_seen_cell
+    WHERE p.last_seen BETWEEN ? AND ?
+    AND p.cell / {CELL_COLUMNS} BETWEEN ? AND ? AND p.cell % {CELL_COLUMNS} BETWEEN ? AND ?
+    AND p.latitude BETWEEN ? AND ?
+    AND p.longitude BETWEEN ? AND ?
+"""
+
+
+def _period_is_narrow(conn, period):
+    # Bounded probe of the time index: stops counting at PERIOD_INDEX_ROWS
+    return conn.execute("""
+        SELECT COUNT(*) FROM (SELECT 1 FROM potholes WHERE last_seen BETWEEN ? AND ? LIMIT ?)
+    """, period + (PERIOD_INDEX_ROWS,)).fetchone()[0] < PERIOD_INDEX_ROWS
+
+
+def _bbox_sql(conn, columns, min_lat, min_lng, max_lat, max_lng, period=None):
+    """SQL and parameters selecting `columns` for potholes in the box.
+
+    period is an optional (from_ms, to_ms) range of last_seen. When fewer
+    than PERIOD_INDEX_ROWS potholes were seen in it, the time index is walked
+    and filtered by cell; otherwise the R*Tree is, and rows are filtered by
+    time (the unary + keeps SQLite from driving the join off the time index).
+    """
+    box = (min_lat, max_lat, min_lng, max_lng)
+    if period is None:
+        return _BBOX_QUERY.format(columns=columns), box + box
+    period = tuple(period)
+    if _period_is_narrow(conn, period):
+        cells = (int((min_lat + 90.0) / CELL_DEG), int((max_lat + 90.0) / CELL_DEG),
+                 int((min_lng + 180.0) / CELL_DEG), int((max_lng + 180.0) / CELL_DEG))
+        return _PERIOD_QUERY.format(columns=columns), period + cells + box
+    return (_BBOX_QUERY.format(columns=columns) + " AND +p.last_seen BETWEEN ? AND ?",
+            box + box + period)
+
+
+def query_bbox(conn, min_lat, min_lng, max_lat, max_lng, period=None):
+    """Return (lat, lng, severity, timestamp, report_count) rows inside the box in one indexed pass.
+
+    The R*Tree stores 32-bit bounds rounded outwards, so the base-table
+    BETWEEN keeps the result exact. period limits the result to potholes
+    last seen within (from_ms, to_ms).
+    """
+    sql, params = _bbox_sql(conn, 'p.latitude, p.longitude, p.severity, p.timestamp, p.report_count',
+                            min_lat, min_lng, max_lat, max_lng, period)
+    return conn.execute(sql, params).fetchall()
+
+
+def query_bbox_ids(conn, min_lat, min_lng, max_lat, max_lng, period=None):
+    """Like query_bbox, with the pothole id as the first column"""
+    sql, params = _bbox_sql(conn, 'p.id, p.latitude, p.longitude, p.severity, p.timestamp, p.report_count',
+                            min_lat, min_lng, max_lat, max_lng, period)
+    return conn.execute(sql, params).fetchall()
+
+
+_POINT_COLUMNS = ("p.id, p.latitude, p.longitude, p.severity, p.timestamp, p.report_count, "
+                  "p.last_seen, COALESCE(p.max_severity, p.severity), p.updated_seq")
+
+
+def query_points(conn, min_lat, min_lng, max_lat, max_lng, period=None):
+    """Full pothole rows inside the box:
+    (id, lat, lng, severity, timestamp, report_count, last_seen, max_severity, updated_seq)
+    """
+    sql, params = _bbox_sql(conn, _POINT_COLUMNS, min_lat, min_lng, max_lat, max_lng, period)
+    return conn.execute(sql, params).fetchall()
+
+
+def query_clusters(conn, min_lat, min_lng, max_lat, max_lng, cell_deg, period=None):
+    """Group potholes in the box on a cell_deg grid anchored at (-90, -180).
+
+    Returns (lat, lng, potholes, reports, max_severity) per non-empty cell,
+    with the position being the mean of the potholes in it.
+    """
+    sql, params = _bbox_sql(conn, f"""
+        CAST((p.latitude + 90.0) / {cell_deg!r} AS INTEGER) AS gy,
+        CAST((p.longitude + 180.0) / {cell_deg!r} AS INTEGER) AS gx,
+        AVG(p.latitude), AVG(p.longitude), COUNT(*), SUM(p.report_count),
+        MAX(COALESCE(p.max_severity, p.severity))
+    """, min_lat, min_lng, max_lat, max_lng, period)
+    rows = conn.execute(sql + " GROUP BY gy, gx", params).fetchall()
+    return [row[2:] for row in rows]
+
+
+def query_bbox_version(conn, min_lat, min_lng, max_lat, max_lng, period=None):
+    """(count, highest updated_seq) of potholes in the box; changes whenever the box's content does"""
+    sql, params = _bbox_sql(conn, 'COUNT(*), COALESCE(MAX(p.updated_seq), 0)',
+                            min_lat, min_lng, max_lat, max_lng, period)
+    return conn.execute(sql, params).fetchone()
+
+
+def current_cursor(conn):
+    return conn.execute("SELECT seq FROM sync_state").fetchone()[0]
+
+
+class CursorExpired(Exception):
+    """The sync cursor predates pruned deletion tombstones; the caller must reload everything"""
+
+
+def query_changes(conn, since, bbox=None):
+    """Potholes added or changed after cursor `since`, ids deleted after it, and the new cursor.
+
+    The cursor is read first, inside the same read transaction, so nothing
+    committed later can be skipped by the next call. Raises CursorExpired if
+    tombstones after `since` have been pruned.
+    """
+    with conn:
+        conn.execute("BEGIN")
+        cursor, pruned = conn.execute("SELECT seq, pruned_seq FROM sync_state").fetchone()
+        if since < pruned:
+            raise CursorExpired(f"Cursor {since} predates pruned deletions up to {pruned}")
+        if bbox is None:
+            changed = conn.execute(f"""
+                SELECT {_POINT_COLUMNS} FROM potholes p
+                WHERE p.updated_seq > ? ORDER BY p.updated_seq
+            """, (since,)).fetchall()
+        else:
+            min_lat, min_lng, max_lat, max_lng = bbox
+            changed = conn.execute(_BBOX_QUERY.format(columns=_POINT_COLUMNS) + """
+                AND p.updated_seq > ? ORDER BY p.updated_seq
+            """, (min_lat, max_lat, min_lng, max_lng, min_lat, max_lat, min_lng, max_lng, since)).fetchall()
+        deleted = [row[0] for row in conn.execute(
+            "SELECT id FROM pothole_deletions WHERE seq > ? ORDER BY seq", (since,))]
+    return changed, deleted, cursor
+
+
+def iter_points(conn, chunk_rows=100000):
+    """Snapshot of every pothole for building an in-memory copy.
+
+    Yields the current cursor first, then lists of up to chunk_rows
+    query_points rows, all from one read transaction; query_changes from
+    that cursor picks up everything committed afterwards.
+    """
+    with conn:
+        conn.execute("BEGIN")
+        yield current_cursor(conn)
+        result = conn.execute(f"SELECT {_POINT_COLUMNS} FROM potholes p")
+        while True:
+            rows = result.fetchmany(chunk_rows)
+            if not rows:
+                return
+            yield rows
+
+
+def grid_cell(lat, lng):
+    """Grid cell id of a point; matches the generated `cell` column"""
+    return int((lat + 90.0) / CELL_DEG) * CELL_COLUMNS + int((lng + 180.0) / CELL_DEG)
+
+
+def neighbour_cells(lat, lng, radius_m):
+    """Cells that can hold a point within radius_m of (lat, lng)"""
+    row = int((lat + 90.0) / CELL_DEG)
+    col = int((lng + 180.0) / CELL_DEG)
+    cell_height = CELL_DEG * METERS_PER_DEGREE
+    cell_width = cell_height * max(math.cos(math.radians(abs(lat) + CELL_DEG)), 1e-6)
+    rows = math.ceil(radius_m / cell_height)
+    cols = math.ceil(radius_m / cell_width)
+    return [(row + dr) * CELL_COLUMNS + col + dc
+            for dr in range(-rows, rows + 1) for dc in range(-cols, cols + 1)]
+
+
+def _distance_m(lat1, lng1, lat2, lng2):
+    # Haversine distance in meters
+    d_lat = math.radians(lat2 - lat1)
+    d_lng = math.radians(lng2 - lng1)
+    a = (math.sin(d_lat / 2) ** 2 +
+         math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(d_lng / 2) ** 2)
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(min(a, 1.0)))
+
+
+def _nearest_within(candidates, lat, lng, radius_m):
+    # candidates: sequences starting with (id, lat, lng, ...); returns the closest one in range
+    best, best_distance = None, radius_m
+    for candidate in candidates:
+        distance = _distance_m(lat, lng, candidate[1], candidate[2])
+        if distance <= best_distance:
+            best, best_distance = candidate, distance
+    return best
+
+
+def _merged(existing, lat, lng, severity, timestamp, count=1, last_seen=None, max_severity=None):
+    """Combine a pothole row (id, lat, lng, severity, count, last_seen, max_severity) with new reports.
+
+    Position and severity become report-weighted means.
+    """
+    pothole_id, old_lat, old_lng, old_severity, old_count, old_last, old_max = existing
+    # Rows inserted by older scripts may lack the aggregate columns
+    old_last = old_last or 0
+    old_max = old_severity if old_max is None else old_max
+    total = old_count + count
+    return (
+        pothole_id,
+        (old_lat * old_count + lat * count) / total,
+        (old_lng * old_count + lng * count) / total,
+        (old_severity * old_count + severity * count) / total,
+        total,
+        max(old_last, last_seen or timestamp),
+        max(old_max, severity if max_severity is None else max_severity),
+    )
+
+
+def store_or_merge(conn, lat, lng, severity, timestamp, radius_m=MERGE_RADIUS_M):
+    """Merge a detection into a known pothole within radius_m, or insert a new one.
+
+    Returns True when the detection was merged. Costs one indexed lookup over
+    a fixed handful of grid cells, not a scan.
+    """
+    cells = neighbour_cells(lat, lng, radius_m)
+    candidates = conn.execute(f"""
+        SELECT id, latitude, longitude, severity, report_count, last_seen, max_severity
+        FROM potholes WHERE cell IN ({','.join('?' * len(cells))})
+    """, cells).fetchall()
+    nearest = _nearest_within(candidates, lat, lng, radius_m)
+    if nearest is None:
+        conn.execute(INSERT_POTHOLE, (lat, lng, severity, timestamp))
+        return False
+
+    merged = _merged(nearest, lat, lng, severity, timestamp)
+    conn.execute("""
+        UPDATE potholes SET latitude = ?, longitude = ?, severity = ?,
+                            report_count = ?, last_seen = ?, max_severity = ?
+        WHERE id = ?
+    """, merged[1:] + merged[:1])
+    return True
+
+
+def compact_db(path=DB_PATH, radius_m=MERGE_RADIUS_M):
+    """One-off merge of duplicate reports already in the database.
+
+    Rows are clustered greedily in id order with the same rule as ingest,
+    then the merged rows are deleted and the survivors updated in one
+    transaction. Returns (rows_before, rows_after).
+    """
+    conn = get_connection(path)
+    buckets = {}
+    clusters = {}
+    absorbed = []
+    rows = conn.execute("""
+        SELECT id, latitude, longitude, severity, timestamp, report_count, last_seen, max_severity
+        FROM potholes ORDER BY id
+    """)
+    total = 0
+    for pothole_id, lat, lng, severity, timestamp, count, last_seen, max_severity in rows:
+        total += 1
+        candidates = [clusters[cid] for cell in neighbour_cells(lat, lng, radius_m)
+                      for cid in buckets.get(cell, ())]
+        nearest = _nearest_within(candidates, lat, lng, radius_m)
+        if nearest is None:
+            clusters[pothole_id] = (pothole_id, lat, lng, severity, count, last_seen, max_severity)
+            buckets.setdefault(grid_cell(lat, lng), []).append(pothole_id)
+        else:
+            # The cluster stays in its original bucket; merged centroids move by less than radius_m
+            clusters[nearest[0]] = _merged(nearest, lat, lng, severity, timestamp,
+                                           count, last_seen, max_severity)
+            absorbed.append((pothole_id,))
+
+    with conn:
+        conn.executemany("DELETE FROM potholes WHERE id = ?", absorbed)
+        conn.executemany("""
+            UPDATE potholes SET latitude = ?, longitude = ?, severity = ?,
+                                report_count = ?, last_seen = ?, max_severity = ?
+            WHERE id = ? AND report_count != ?
+        """, (cluster[1:] + (cluster[0], cluster[4]) for cluster in clusters.values()))
+    return total, total - len(absorbed)
+
+
+_ROLLUP_BATCH = f"""
+    INSERT INTO pothole_monthly (month, cell, potholes, reports, severity_sum, max_severity)
+    SELECT CAST(strftime('%Y%m', last_seen / 1000, 'unixepoch') AS INTEGER) AS month,
+           CAST((latitude + 90.0) / {ROLLUP_CELL_DEG} AS INTEGER) * {ROLLUP_COLUMNS}
+           + CAST((longitude + 180.0) / {ROLLUP_CELL_DEG} AS INTEGER) AS rollup_cell,
+           COUNT(*), SUM(report_count), SUM(severity), MAX(COALESCE(max_severity, severity))
+    FROM potholes
+    WHERE id IN (SELECT id FROM potholes WHERE last_seen < ?1 ORDER BY last_seen LIMIT ?2)
+    GROUP BY month, rollup_cell
+    ON CONFLICT (month, cell) DO UPDATE SET
+        potholes = potholes + excluded.potholes,
+        reports = reports + excluded.reports,
+        severity_sum = severity_sum + excluded.severity_sum,
+        max_severity = MAX(max_severity, excluded.max_severity)
+"""
+
+
+def apply_retention(conn, cutoff_ms, batch_rows=RETENTION_BATCH_ROWS, vacuum_pages=VACUUM_PAGES):
+    """Move potholes last seen before cutoff_ms into pothole_monthly, then free their pages.
+
+    Each batch of the oldest rows is rolled up and deleted in its own short
+    transaction through the (last_seen, cell) index. Deletions leave sync
+    tombstones like any other. Returns (rows_moved, pages_freed).
+    """
+    moved = 0
+    while True:
+        with conn:
+            conn.execute(_ROLLUP_BATCH, (cutoff_ms, batch_rows))
+            deleted = conn.execute("""
+                DELETE FROM potholes
+                WHERE id IN (SELECT id FROM potholes WHERE last_seen < ?1 ORDER BY last_seen LIMIT ?2)
+            """, (cutoff_ms, batch_rows)).rowcount
+        moved += deleted
+        if deleted < batch_rows:
+            break
+
+    # Return free pages to the filesystem in small steps, stopping once a step frees nothing
+    free_before = free_pages = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    while free_pages:
+        conn.execute(f'PRAGMA incremental_vacuum({vacuum_pages})').fetchall()
+        remaining = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        if remaining >= free_pages:
+            break
+        free_pages = remaining
+    return moved, free_before - free_pages
+
+
+def prune_tombstones(conn, cutoff_ms, batch_rows=RETENTION_BATCH_ROWS):
+    """Delete deletion tombstones recorded before cutoff_ms, oldest first.
+
+    Each batch raises sync_state.pruned_seq in the same transaction, so a
+    query_changes call either sees the tombstones or refuses the cursor.
+    Returns the number of tombstones removed.
+    """
+    pruned = 0
+    while True:
+        with conn:
+            last = conn.execute("""
+                SELECT MAX(seq), COUNT(*) FROM (
+                    SELECT seq FROM pothole_deletions WHERE deleted_at < ? ORDER BY seq LIMIT ?)
+            """, (cutoff_ms, batch_rows)).fetchone()
+            if not last[1]:
+                break
+            conn.execute("DELETE FROM pothole_deletions WHERE seq <= ?", (last[0],))
+            conn.execute("UPDATE sync_state SET pruned_seq = MAX(pruned_seq, ?)", (last[0],))
+        pruned += last[1]
+        if last[1] < batch_rows:
+            break
+    return pruned
+
+
+class RetentionJob:
+    """Background thread running apply_retention and prune_tombstones every
+    interval_s; on_commit, if given, is called with the run report after a run
+    that removed potholes"""
+
+    def __init__(self, path=DB_PATH, retention_days=RETENTION_DAYS, interval_s=RETENTION_INTERVAL_S,
+                 on_commit=None, tombstone_days=TOMBSTONE_DAYS):
+        self.path = path
+        self.on_commit = on_commit
+        self.retention_days = retention_days
+        self.tombstone_days = tombstone_days
+        self.interval = interval_s
+        self.runs = 0
+        self.moved = 0
+        self.last_run = None
+        self._stopped = threading.Event()
+        self._worker = threading.Thread(target=self._run, name='pothole-retention', daemon=True)
+        self._worker.start()
+
+    def run_once(self, conn):
+        start = time.perf_counter()
+        cutoff = now_ms() - int(self.retention_days * DAY_MS)
+        moved, freed = apply_retention(conn, cutoff)
+        tombstones = prune_tombstones(conn, now_ms() - int(self.tombstone_days * DAY_MS))
+        self.runs += 1
+        self.moved += moved
+        self.last_run = {'cutoff_ms': cutoff, 'moved': moved, 'pages_freed': freed,
+                         'tombstones_pruned': tombstones, 'seconds': time.perf_counter() - start}
+        if moved and self.on_commit is not None:
+            self.on_commit(self.last_run)
+        return self.last_run
+
+    def close(self):
+        self._stopped.set()
+        self._worker.join()
+
+    def _run(self):
+        # Connecting is retried on the next run too: nothing may end this thread
+        conn = None
+        while not self._stopped.wait(self.interval):
+            try:
+                if conn is None:
+                    conn = connect(self.path)
+                self.run_once(conn)
+            except Exception as e:
+                print(f"Retention run failed: {e!r}")
+        if conn is not None:
+            conn.close()
+
+
+def query_monthly(conn, min_lat, min_lng, max_lat, max_lng, from_month=0, to_month=999999):
+    """(month, potholes, reports, mean_severity, max_severity) of rolled-up potholes in the box"""
+    min_row = int((min_lat + 90.0) / ROLLUP_CELL_DEG)
+    max_row = int((max_lat + 90.0) / ROLLUP_CELL_DEG)
+    min_col = int((min_lng + 180.0) / ROLLUP_CELL_DEG)
+    max_col = int((max_lng + 180.0) / ROLLUP_CELL_DEG)
+    return conn.execute("""
+        SELECT month, SUM(potholes), SUM(reports), SUM(severity_sum) / SUM(potholes), MAX(max_severity)
+        FROM pothole_monthly
+        WHERE month BETWEEN ? AND ?
+        AND cell / ? BETWEEN ? AND ? AND cell % ? BETWEEN ? AND ?
+        GROUP BY month ORDER BY month
+    """, (from_month, to_month, ROLLUP_COLUMNS, min_row, max_row, ROLLUP_COLUMNS, min_col, max_col)).fetchall()
+
+
+def _checked_row(lat, lng, severity, timestamp):
+    # The writer thread must only ever see rows store_or_merge can handle
+    try:
+        row = (float(lat), float(lng), float(severity), int(timestamp))
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError(f"Invalid pothole {(lat, lng, severity, timestamp)!r}") from None
+    if not all(map(math.isfinite, row[:3])) or not (-90.0 <= row[0] <= 90.0 and -180.0 <= row[1] <= 180.0):
+        raise ValueError(f"Invalid pothole {(lat, lng, severity, timestamp)!r}")
+    return row
+
+
+class PotholeWriter:
+    """Single background thread that commits queued detections in batches.
+
+    on_commit, if given, is called from the writer thread with the
+    (lat, lng, severity, timestamp) rows each committed batch stored and the
+    seconds the transaction took. A row that fails is dropped on its own and
+    counted in `failed`; the thread keeps running through any error.
+    """
+
+    def __init__(self, path=DB_PATH, batch_size=WRITE_BATCH_SIZE, interval_ms=WRITE_INTERVAL_MS,
+                 max_pending=MAX_PENDING_WRITES, merge_radius_m=MERGE_RADIUS_M, on_commit=None):
+        self.path = path
+        self.on_commit = on_commit
+        self.merge_radius_m = merge_radius_m
+        self.batch_size = batch_size
+        self.interval = interval_ms / 1000.0
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.committed = 0
+        self.merged = 0
+        self.failed = 0
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, name='pothole-writer', daemon=True)
+        self._worker.start()
+
+    def submit(self, lat, lng, severity, timestamp=None):
+        """Queue a detection (timestamp in epoch ms, default now); it is committed with the next batch.
+
+        Raises ValueError for a position or severity that could never be stored.
+        """
+        if self._closed:
+            raise RuntimeError("PotholeWriter is closed")
+        self.pending.put(_checked_row(lat, lng, severity, timestamp or now_ms()))
+
+    def flush(self, timeout=None):
+        """Block until every detection submitted so far has been committed"""
+        done = threading.Event()
+        self.pending.put(done)
+        return done.wait(timeout)
+
+    def close(self):
+        """Commit everything still queued and stop the writer thread"""
+        if self._closed:
+            return
+        self._closed = True
+        self.pending.put(_STOP)
+        self._worker.join()
+
+    def queue_depth(self):
+        return self.pending.qsize()
+
+    def _run(self):
+        conn = None
+        stopping = False
+        while not stopping:
+            rows, waiters = [], []
+            item = self.pending.get()
+            deadline = time.perf_counter() + self.interval
+            while True:
+                if item is _STOP:
+                    stopping = True
+                elif isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    rows.append(item)
+                if stopping or len(rows) >= self.batch_size:
+                    break
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.pending.get(timeout=remaining)
+                except queue.Empty:
+                    break
+
+            # Drain whatever is already queued when stopping so nothing accepted is lost
+            while stopping:
+                try:
+                    item = self.pending.get_nowait()
+                except queue.Empty:
+                    break
+                if isinstance(item, threading.Event):
+                    waiters.append(item)
+                elif item is not _STOP:
+                    rows.append(item)
+
+            # Nothing may end this loop but _STOP: a dead writer would silently drop
+            # every later detection and leave flush() and a full submit() blocked
+            try:
+                if rows:
+                    if conn is None:
+                        conn = connect(self.path)
+                    self._commit(conn, rows)
+            except Exception as e:
+                print(f"Failed to store {len(rows)} potholes: {e!r}")
+            finally:
+                for waiter in waiters:
+                    waiter.set()
+        if conn is not None:
+            conn.close()
+
+    def _commit(self, conn, rows):
+        start = time.perf_counter()
+        with conn:
+            conn.execute('BEGIN')
+            stored = self._write_batch(conn, rows)
+        seconds = time.perf_counter() - start
+        self.committed += len(stored)
+        if stored and self.on_commit is not None:
+            try:
+                self.on_commit(stored, seconds)
+            except Exception as e:
+                print(f"on_commit failed after storing {len(stored)} potholes: {e!r}")
+
+    def _write_batch(self, conn, rows):
+        """Apply rows in order inside the open transaction and return the ones stored.
+
+        Each row has its own savepoint, so a row that fails is rolled back and
+        dropped alone. Rows are applied in order, so a batch can merge into itself.
+        """
+        stored = []
+        for row in rows:
+            conn.execute('SAVEPOINT pothole_row')
+            try:
+                merged = store_or_merge(conn, *row, self.merge_radius_m)
+            except Exception as e:
+                conn.execute('ROLLBACK TO pothole_row')
+                conn.execute('RELEASE pothole_row')
+                self.failed += 1
+                print(f"Dropped pothole {row}: {e!r}")
+                continue
+            conn.execute('RELEASE pothole_row')
+            self.merged += merged
+            stored.append(row)
+        return stored
+
+
+def _seed_potholes(path, rows, rng, days=0):
+    """Fill a benchmark database with uniformly spread potholes over India,
+    seen at evenly spread times over the last `days` days"""
+    import numpy as np
+
+    init_db(path)
+    conn = get_connection(path)
+    chunk = 100000
+    now = now_ms()
+    for start in range(0, rows, chunk):
+        n = min(chunk, rows - start)
+        lats = rng.uniform(8.0, 30.0, n)
+        lngs = rng.uniform(70.0, 90.0, n)
+        severities = rng.uniform(0.5, 1.0, n)
+        # Ids increase with time, as they do for real reports
+        age = (1.0 - (start + np.arange(n)) / rows) * days * DAY_MS
+        timestamps = now - age.astype(np.int64)
+        with conn:
+            conn.executemany(INSERT_POTHOLE, ((float(a), float(b), float(c), int(t))
+                                              for a, b, c, t in zip(lats, lngs, severities, timestamps)))
+
+
+def benchmark_route_queries(sizes, queries=200, workdir='.'):
+    """Time the old two-scan BETWEEN query against the R*Tree lookup"""
+    import numpy as np
+
+    rng = np.random.default_rng(0)
+    print(f"{'rows':>10} {'scan_ms':>9} {'rtree_ms':>9} {'avg_hits':>9}")
+    for rows in sizes:
+        path = os.path.join(workdir, f'bench_route_{rows}.db')
+        if os.path.exists(path):
+            os.remove(path)
+        _seed_potholes(path, rows, rng)
+        conn = get_connection(path)
+
+        # City-to-city sized boxes, roughly 50 km across
+        corners = np.column_stack([rng.uniform(8.0, 29.5, queries), rng.uniform(70.0, 89.5, queries)])
+        boxes = [(float(lat), float(lng), float(lat) + 0.5, float(lng) + 0.5) for lat, lng in corners]
+
+        start = time.perf_counter()
+        for min_lat, min_lng, max_lat, max_lng in boxes:
+            params = (min_lat, max_lat, min_lng, max_lng)
+            conn.execute("""SELECT COUNT(*) FROM potholes
+                WHERE latitude BETWEEN ? AND ? AND longitude BETWEEN ? AND ?""", params).fetchone()
+            conn.execute("""SELECT latitude, longitude, severity, timestamp FROM potholes
+                WHERE latitude BETWEEN ? AND ? AND longitude BETWEEN ? AND ?""", params).fetchall()
+        scan_time = (time.perf_counter() - start) / queries
+
+        hits = 0
+        start = time.perf_counter()
+        for box in boxes:
+            hits += len(query_bbox(conn, *box))
+        rtree_time = (time.perf_counter() - start) / queries
+
+        print(f"{rows:>10} {scan_time * 1000:>9.2f} {rtree_time * 1000:>9.2f} {hits / queries:>9.1f}")
+        conn.close()
+        _local.connections.pop(path)
+        os.remove(path)
+
+
+def benchmark_time_queries(rows, queries=200, days=3 * 365, retention_days=365, workdir='.'):
+    """Time windowed queries with and without the time index, and one retention run"""
+    import numpy as np
+
+    rng = np.random.default_rng(0)
+    path = os.path.join(workdir, f'bench_time_{rows}.db')
+    if os.path.exists(path):
+        os.remove(path)
+    start = time.perf_counter()
+    _seed_potholes(path, rows, rng, days)
+    print(f"Seeded {rows} rows over {days} days in {time.perf_counter() - start:.1f} s")
+    conn = get_connection(path)
+    now = now_ms()
+
+    def timed(fn, repeats):
+        start = time.perf_counter()
+        for i in range(repeats):
+            result = fn(i)
+        return (time.perf_counter() - start) / repeats * 1000, result
+
+    corners = np.column_stack([rng.uniform(8.0, 29.5, queries), rng.uniform(70.0, 89.5, queries)])
+    boxes = [(float(lat), float(lng), float(lat) + 0.5, float(lng) + 0.5) for lat, lng in corners]
+
+    # "reported in window": full scan vs time index; "route box in window": R*Tree then
+    # time filter vs whichever plan _bbox_sql picks
+    print(f"{'query':>28} {'window_d':>9} {'base_ms':>9} {'indexed_ms':>11} {'rows':>9}")
+    for window_days in [1, 7, 90]:
+        period = (now - window_days * DAY_MS, now)
+        scan_ms, count = timed(lambda i: conn.execute(
+            "SELECT COUNT(*) FROM potholes NOT INDEXED WHERE last_seen BETWEEN ? AND ?", period).fetchone(), 3)
+        index_ms, _ = timed(lambda i: conn.execute(
+            "SELECT COUNT(*) FROM potholes WHERE last_seen BETWEEN ? AND ?", period).fetchone(), 20)
+        print(f"{'reported in window':>28} {window_days:>9} {scan_ms:>9.2f} {index_ms:>11.2f} {count[0]:>9}")
+
+        rtree_ms, _ = timed(lambda i: conn.execute(
+            _BBOX_QUERY.format(columns='COUNT(*)') + " AND +p.last_seen BETWEEN ? AND ?",
+            (boxes[i][0], boxes[i][2], boxes[i][1], boxes[i][3]) * 2 + period).fetchone(), queries)
+        chosen_ms, hits = timed(lambda i: query_bbox_version(conn, *boxes[i], period=period), queries)
+        print(f"{'route box in window':>28} {window_days:>9} {rtree_ms:>9.2f} {chosen_ms:>11.2f} {hits[0]:>9}")
+
+    job_conn = connect(path)
+    size_before = os.path.getsize(path)
+    start = time.perf_counter()
+    moved, freed = apply_retention(job_conn, now - int(retention_days * DAY_MS))
+    elapsed = time.perf_counter() - start
+    print(f"Retention ({retention_days} d): moved {moved} rows into "
+          f"{conn.execute('SELECT COUNT(*) FROM pothole_monthly').fetchone()[0]} monthly cells, "
+          f"freed {freed} pages ({size_before / 1e6:.0f} MB -> {os.path.getsize(path) / 1e6:.0f} MB) "
+          f"in {elapsed:.1f} s")
+    job_conn.close()
+    conn.close()
+    _local.connections.pop(path)
+    os.remove(path)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Pothole database maintenance")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    migrate = commands.add_parser('migrate', help="Bring an existing database up to the current schema")
+    migrate.add_argument('path', nargs='?', default=DB_PATH)
+
+    compact = commands.add_parser('compact', help="Merge duplicate reports of the same pothole")
+    compact.add_argument('path', nargs='?', default=DB_PATH)
+    compact.add_argument('--radius', type=float, default=MERGE_RADIUS_M, help="Merge radius in meters")
+
+    bench = commands.add_parser('bench-route', help="Benchmark bounding-box route queries")
+    bench.add_argument('--sizes', type=int, nargs='+', default=[10000, 1000000, 10000000])
+    bench.add_argument('--queries', type=int, default=200)
+
+    retention = commands.add_parser('retention', help="Roll up and remove potholes not seen recently")
+    retention.add_argument('path', nargs='?', default=DB_PATH)
+    retention.add_argument('--days', type=float, default=RETENTION_DAYS, help="Keep potholes seen this recently")
+
+    bench_time = commands.add_parser('bench-time', help="Benchmark time-window queries and retention")
+    bench_time.add_argument('--rows', type=int, default=5000000)
+    bench_time.add_argument('--queries', type=int, default=200)
+
+    heatmap = commands.add_parser('heatmap', help="Rebuild the heatmap aggregates or check them")
+    heatmap.add_argument('action', choices=['rebuild', 'check'])
+    heatmap.add_argument('path', nargs='?', default=DB_PATH)
+
+    args = parser.parse_args()
+    if args.command == 'migrate':
+        init_db(args.path)
+        print(f"{args.path} is at schema version {len(MIGRATIONS)}")
+    elif args.command == 'compact':
+        init_db(args.path)
+        before, after = compact_db(args.path, args.radius)
+        print(f"Compacted {args.path}: {before} rows -> {after} potholes")
+    elif args.command == 'bench-route':
+        benchmark_route_queries(args.sizes, args.queries)
+    elif args.command == 'retention':
+        init_db(args.path)
+        moved, freed = apply_retention(get_connection(args.path), now_ms() - int(args.days * DAY_MS))
+        print(f"Moved {moved} potholes from {args.path} into monthly rollups, freed {freed} pages")
+    elif args.command == 'bench-time':
+        benchmark_time_queries(args.rows, args.queries)
+    elif args.command == 'heatmap':
+        init_db(args.path)
+        conn = get_connection(args.path)
+        if args.action == 'rebuild':
+            start = time.perf_counter()
+            rebuild_heatmap(conn)
+            print(f"Rebuilt heatmap of {args.path} in {time.perf_counter() - start:.1f} s")
+        else:
+            mismatched = 0
+            for level, (cells, wrong) in check_heatmap(conn).items():
+                print(f"level {level} ({HEATMAP_CELL_DEG[level]} deg): {cells} cells, {wrong} mismatched")
+                mismatched += wrong
+            if mismatched:
+                raise SystemExit(f"Heatmap differs from a full recomputation in {mismatched} cells")
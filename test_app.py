@@ -0,0 +1,60 @@
+import os
+import tempfile
+
+# The app opens its database and starts its background threads at import
+os.environ['POTHOLE_DB'] = os.path.join(tempfile.mkdtemp(), 'potholes.db')
+os.environ['POTHOLE_RETENTION_DAYS'] = '0'
+os.environ.setdefault('POTHOLE_BACKEND', 'numpy')
+
+import app
+from features import CHANNELS
+
+app.init_db()
+client = app.app.test_client()
+
+SAMPLE = dict.fromkeys(CHANNELS, 0.1)
+
+
+def detect(samples):
+    return client.post('/api/detect', json={'latitude': 13.08, 'longitude': 80.27, 'accelerometer_data': samples})
+
+
+def test_detect_rejects_empty_window():
+    response = detect([])
+    assert response.status_code == 400
+    assert 'non-empty' in response.get_json()['error']
+
+
+def test_detect_rejects_sample_missing_a_channel():
+    sample = dict(SAMPLE)
+    del sample['acc_y1']
+    response = detect([SAMPLE] * 49 + [sample])
+    assert response.status_code == 400
+    assert 'acc_y1' in response.get_json()['error']
+
+
+def test_detect_rejects_missing_or_non_numeric_samples():
+    assert client.post('/api/detect', json={'latitude': 13.08, 'longitude': 80.27}).status_code == 400
+    assert detect([dict(SAMPLE, acc_x1='1.5')] * 50).status_code == 400
+    assert detect([dict(SAMPLE, acc_x1=None)] * 50).status_code == 400
+
+
+def test_route_rejects_missing_or_non_finite_corner():
+    assert client.get('/api/route?start_lat=13&start_lng=80&end_lat=13.1').status_code == 400
+    assert client.get('/api/route?start_lat=13&start_lng=80&end_lat=nan&end_lng=80.1').status_code == 400
+    assert client.get('/api/route?start_lat=13&start_lng=80&end_lat=13.1&end_lng=80.1').status_code == 200
+
+
+def test_profiler_refuses_unauthenticated_requests():
+    app.ADMIN_TOKEN = 'secret'
+    try:
+        assert client.post('/api/profiler', json={'enabled': True}).status_code == 403
+        assert client.get('/api/profiler').status_code == 403
+        assert not app.profiler.status()['running']
+        response = client.get('/api/profiler', headers={'Authorization': 'Bearer secret'})
+        assert response.status_code == 200
+    finally:
+        app.ADMIN_TOKEN = ''
+    # With no token configured the endpoint is off altogether
+    assert client.post('/api/profiler', json={'enabled': True},
+                       headers={'Authorization': 'Bearer '}).status_code == 403
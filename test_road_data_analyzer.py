@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+from features import CHANNELS
+from road_data_analyzer import FLEET_AXES, RoadDataAnalyzer
+from road_data_generator import RoadDataGenerator, generate_fleet
+
+
+@pytest.mark.parametrize('fmt', ['bin', 'csv'])
+def test_fleet_log_axes_come_from_the_front_sensor(tmp_path, fmt):
+    (path, samples, _), = generate_fleet(str(tmp_path), 1, 60, processes=1, fmt=fmt)
+    analyzer = RoadDataAnalyzer()
+    data = analyzer.load_data(path)
+    assert FLEET_AXES == {'acc_x1': 'acc_x', 'acc_y1': 'acc_y', 'acc_z1': 'acc_z'}
+    for channel, axis in FLEET_AXES.items():
+        np.testing.assert_array_equal(np.asarray(data[axis]), np.asarray(data[channel]))
+        # Not the rear sensor, which sees the same impacts a wheelbase later
+        assert not np.array_equal(np.asarray(data[axis]), np.asarray(data[channel.replace('1', '2')]))
+    X, y = analyzer.prepare_training_data()
+    assert len(X) == len(y) > 0 and y.any()
+
+
+def test_overlapping_impacts_take_the_last_listed():
+    data = np.zeros((200, len(CHANNELS)))
+    labels = np.zeros(200, dtype=np.uint8)
+    RoadDataGenerator().insert_potholes(np.random.default_rng(0), data, labels, np.array([10, 30]), 50, 5)
+
+    # The jolts insert_potholes draws from the same seed
+    rng = np.random.default_rng(0)
+    pulse = np.exp(-np.linspace(-3, 3, 50) ** 2)[np.newaxis, :, np.newaxis]
+    jolts = pulse * [0.5, 0.3, -2.0] + 0.1 * rng.standard_normal((2, 50, 3))
+    # Samples 30-59 are covered by both impacts; the second one's values are kept
+    np.testing.assert_allclose(data[10:30, 0:3], jolts[0][:20])
+    np.testing.assert_allclose(data[30:80, 0:3], jolts[1])
+    np.testing.assert_allclose(data[35:85, 3:6], 0.8 * jolts[1])
+    assert labels[10:80].all() and not labels[80:].any()
@@ -1,16 +1,23 @@
 import numpy as np
 import openvino as ov
 
+from features import CHANNELS, NUM_FEATURES, extract_features_batch
+
 # Initialize OpenVINO runtime
 core = ov.Core()
 
-# Load and compile the model
-model = core.read_model("pothole_detection_model.xml")
+# Load and compile the model exported by convert_model.py
+model = core.read_model("pothole_ov_model.xml")
 compiled_model = core.compile_model(model, "CPU")
+print(f"Model input: {compiled_model.input(0).get_partial_shape()}, expected {NUM_FEATURES} features")
 
-# Create a sample feature vector (with the correct number of features)
-# Replace 28 with the actual number of features from your SVM model
-features = np.random.rand(1, 28).astype(np.float32)
+# Feature vector computed the way the server does, from a synthetic 50-sample window
+# with a jolt in the middle
+rng = np.random.default_rng(0)
+window = rng.normal(0, 0.2, (1, 50, len(CHANNELS))).astype(np.float32)
+window[:, :, 2] += 1.0
+window[:, 20:30, :6] += rng.normal(0, 4, (10, 6))
+features = extract_features_batch(window)
 
 # Run inference
 results = compiled_model(features)
@@ -0,0 +1,278 @@
+import json
+import time
+from collections import deque
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from features import CHANNELS, extract_features_batch
+
+# Whole-trip uploads for /api/trips, one JSON record per line:
+#
+#   {"type": "trip", "rate_hz": 100}                         optional, first line only
+#   {"type": "samples", "t": 12.5, "data": [[12 floats], ...]}  consecutive samples from time t (seconds)
+#   {"type": "gps", "t": 12.0, "lat": 13.08, "lng": 80.27}     one fix
+#   {"type": "gps", "fixes": [[t, lat, lng], ...]}              several fixes
+#
+# Samples are in features.CHANNELS order and arrive in time order, as do GPS
+# fixes; the two streams may be interleaved in any way. Every record is
+# processed as it arrives and the result is streamed back as NDJSON.
+SAMPLE_RATE_HZ = 100
+WINDOW_SIZE = 50
+WINDOW_HOP = 25
+# Windows scored per feature-extraction + inference call
+BATCH_WINDOWS = 64
+# Longest accepted input line; a 100-sample chunk is about 25 KB of JSON
+MAX_LINE_BYTES = 1 << 20
+# Request body bytes read per call
+READ_CHUNK_BYTES = 1 << 16
+THRESHOLD = 0.5
+
+
+class TripDetector:
+    """Slide windows over a streamed trip and report detections with interpolated positions.
+
+    Memory stays bounded by the window carry, one batch of samples and the GPS
+    fixes not yet passed by the samples; nothing else of the trip is kept.
+    Consecutive positive windows are reported as one detection at the window
+    with the highest confidence.
+    """
+
+    def __init__(self, infer_batch, window_size=WINDOW_SIZE, hop=WINDOW_HOP,
+                 batch_windows=BATCH_WINDOWS, threshold=THRESHOLD):
+        self.infer_batch = infer_batch
+        self.window_size = window_size
+        self.hop = hop
+        self.batch_windows = batch_windows
+        self.threshold = threshold
+        self.rate_hz = SAMPLE_RATE_HZ
+
+        self.samples = np.empty((0, len(CHANNELS)), dtype=np.float32)
+        self.times = np.empty(0, dtype=np.float64)
+        self.gps = deque()
+        self.run = None
+        self.pending = deque()
+
+        self.lines = 0
+        self.sample_count = 0
+        self.window_count = 0
+        self.detection_count = 0
+        self.gps_count = 0
+
+    def feed_line(self, line):
+        """Handle one NDJSON input line and return the detections it completes.
+
+        Raises ValueError for a malformed record.
+        """
+        self.lines += 1
+        line = line.strip()
+        if not line:
+            return []
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            raise ValueError(f"Line {self.lines}: invalid JSON ({e})")
+        if not isinstance(record, dict):
+            raise ValueError(f"Line {self.lines}: expected a JSON object")
+
+        kind = record.get('type')
+        try:
+            if kind == 'samples':
+                self.add_samples(float(record['t']), record['data'])
+            elif kind == 'gps':
+                fixes = record['fixes'] if 'fixes' in record else [[record['t'], record['lat'], record['lng']]]
+                self.add_fixes(fixes)
+            elif kind == 'trip':
+                if self.sample_count:
+                    raise ValueError("trip header after samples")
+                self.rate_hz = float(record.get('rate_hz', SAMPLE_RATE_HZ))
+                if self.rate_hz <= 0:
+                    raise ValueError("rate_hz must be positive")
+            else:
+                raise ValueError(f"unknown record type {kind!r}")
+        except (KeyError, TypeError) as e:
+            raise ValueError(f"Line {self.lines}: malformed {kind} record ({e!r})")
+        except ValueError as e:
+            raise ValueError(f"Line {self.lines}: {e}")
+        return self._ready_detections(final=False)
+
+    def add_samples(self, t, data):
+        data = np.asarray(data, dtype=np.float32)
+        if data.ndim != 2 or data.shape[1] != len(CHANNELS):
+            raise ValueError(f"samples must be a list of {len(CHANNELS)}-value rows")
+        times = t + np.arange(len(data)) / self.rate_hz
+        if len(self.times) and len(times) and times[0] <= self.times[-1]:
+            raise ValueError("samples are not in time order")
+
+        self.samples = np.concatenate([self.samples, data])
+        self.times = np.concatenate([self.times, times])
+        self.sample_count += len(data)
+        if self._available_windows() >= self.batch_windows:
+            self._score_windows()
+
+    def add_fixes(self, fixes):
+        fixes = np.asarray(fixes, dtype=np.float64).reshape(-1, 3)
+        # None converts to NaN above, which np.interp would pass on to the detections
+        if not np.isfinite(fixes).all():
+            raise ValueError("GPS fixes must be finite numbers")
+        if (np.abs(fixes[:, 1]) > 90).any() or (np.abs(fixes[:, 2]) > 180).any():
+            raise ValueError("GPS fix out of range")
+        for t, lat, lng in fixes:
+            if self.gps and t <= self.gps[-1][0]:
+                raise ValueError("GPS fixes are not in time order")
+            self.gps.append((t, lat, lng))
+        self.gps_count += len(fixes)
+
+    def finish(self):
+        """Score what is left, close any open detection and return everything still pending"""
+        self._score_windows()
+        if self.run is not None:
+            self.pending.append(self.run)
+            self.run = None
+        return self._ready_detections(final=True)
+
+    def summary(self):
+        return {
+            'type': 'summary',
+            'lines': self.lines,
+            'samples': self.sample_count,
+            'gps_fixes': self.gps_count,
+            'windows': self.window_count,
+            'detections': self.detection_count,
+        }
+
+    def _available_windows(self):
+        if len(self.samples) < self.window_size:
+            return 0
+        return (len(self.samples) - self.window_size) // self.hop + 1
+
+    def _score_windows(self):
+        n_windows = self._available_windows()
+        if n_windows == 0:
+            return
+        # (windows, samples, channels) view over the buffer, no copy
+        windows = sliding_window_view(self.samples, self.window_size, axis=0)[::self.hop][:n_windows]
+        features = extract_features_batch(np.moveaxis(windows, -1, 1))
+        confidences = np.asarray(self.infer_batch(features)).reshape(-1)
+        centres = self.times[np.arange(n_windows) * self.hop + self.window_size // 2]
+
+        for t, confidence in zip(centres, confidences):
+            confidence = float(confidence)
+            if confidence > self.threshold:
+                if self.run is None:
+                    self.run = {'t_start': float(t), 't': float(t), 'confidence': confidence, 'windows': 1}
+                else:
+                    self.run['windows'] += 1
+                    if confidence > self.run['confidence']:
+                        self.run.update(t=float(t), confidence=confidence)
+                        self.run.pop('lat', None)
+                        self.run.pop('lng', None)
+            elif self.run is not None:
+                self.pending.append(self.run)
+                self.run = None
+
+        self.window_count += n_windows
+        self.samples = self.samples[n_windows * self.hop:]
+        self.times = self.times[n_windows * self.hop:]
+
+    def _ready_detections(self, final):
+        # A detection is placed once a fix at or after its peak has arrived (at
+        # the end of the trip the track is clamped to its last fix); an open
+        # run is placed eagerly so the fixes before its peak can be dropped
+        if self.run is not None and 'lat' not in self.run and self._covers(self.run['t']):
+            self._place(self.run)
+        ready = []
+        while self.pending and (final or 'lat' in self.pending[0] or self._covers(self.pending[0]['t'])):
+            run = self.pending.popleft()
+            if 'lat' not in run:
+                self._place(run)
+            ready.append(dict(run, type='detection'))
+        self._trim_gps()
+        self.detection_count += len(ready)
+        return ready
+
+    def _covers(self, t):
+        return bool(self.gps) and self.gps[-1][0] >= t
+
+    def _place(self, run):
+        run['lat'] = run['lng'] = None
+        if self.gps:
+            track = np.array(self.gps)
+            run['lat'] = float(np.interp(run['t'], track[:, 0], track[:, 1]))
+            run['lng'] = float(np.interp(run['t'], track[:, 0], track[:, 2]))
+
+    def _trim_gps(self):
+        # Keep the last fix before the earliest time a detection may still need
+        candidates = [run['t'] for run in self.pending if 'lat' not in run]
+        if self.run is not None and 'lat' not in self.run:
+            candidates.append(self.run['t'])
+        if len(self.times):
+            candidates.append(self.times[0])
+        if not candidates:
+            candidates.append(self.gps[-1][0] if self.gps else 0.0)
+        needed = min(candidates)
+        while len(self.gps) >= 2 and self.gps[1][0] <= needed:
+            self.gps.popleft()
+
+
+def iter_lines(stream, max_line_bytes=MAX_LINE_BYTES, chunk_bytes=READ_CHUNK_BYTES):
+    """Yield lines from a (possibly chunked) request body without reading it all.
+
+    The body is read in chunks and split here: readline() on a WSGI input
+    stream is unbuffered and fetches one byte per call.
+    """
+    pending = b''
+    while True:
+        chunk = stream.read(chunk_bytes)
+        if not chunk:
+            break
+        lines = (pending + chunk).split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            if len(line) > max_line_bytes:
+                raise ValueError(f"Line longer than {max_line_bytes} bytes")
+            yield line
+        if len(pending) > max_line_bytes:
+            raise ValueError(f"Line longer than {max_line_bytes} bytes")
+    if pending:
+        yield pending
+
+
+def synthetic_trip_lines(seconds, rate_hz=SAMPLE_RATE_HZ, chunk=100, pothole_every_s=30, seed=0):
+    """NDJSON lines for a synthetic trip: noise with periodic jolts and a 1 Hz GPS track"""
+    rng = np.random.default_rng(seed)
+    yield json.dumps({'type': 'trip', 'rate_hz': rate_hz})
+    lat, lng = 13.0827, 80.2707
+    for start in range(0, int(seconds * rate_hz), chunk):
+        t = start / rate_hz
+        data = rng.normal(0, 0.2, (chunk, len(CHANNELS)))
+        data[:, 2] += 1.0
+        data[:, 5] += 1.0
+        offsets = (start + np.arange(chunk)) % int(pothole_every_s * rate_hz)
+        data[offsets < 30, :6] += rng.normal(0, 4, (int((offsets < 30).sum()), 6))
+        if start % rate_hz == 0:
+            yield json.dumps({'type': 'gps', 't': t, 'lat': lat + t * 1e-5, 'lng': lng + t * 1e-5})
+        yield json.dumps({'type': 'samples', 't': t, 'data': np.round(data, 4).tolist()})
+
+
+if __name__ == "__main__":
+    import tracemalloc
+
+    from inference import NumpyBackend
+
+    backend = NumpyBackend()
+    print(f"{'trip_s':>8} {'lines':>8} {'windows':>9} {'detections':>11} {'samples/s':>11} {'peak_kb':>9}")
+    for seconds in [60, 600, 3600]:
+        lines = list(synthetic_trip_lines(seconds))
+        tracemalloc.start()
+        start = time.perf_counter()
+        detector = TripDetector(backend.infer_batch)
+        for line in lines:
+            detector.feed_line(line)
+        detector.finish()
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        summary = detector.summary()
+        print(f"{seconds:>8} {summary['lines']:>8} {summary['windows']:>9} {summary['detections']:>11} "
+              f"{summary['samples'] / elapsed:>11.0f} {peak / 1024:>9.0f}")
@@ -0,0 +1,176 @@
+import json
+import math
+import struct
+import time
+
+import numpy as np
+
+from features import CHANNELS, FEATURE_SCHEMA_VERSION, NUM_FEATURES
+
+# Binary sensor-window payload for /api/detect
+#
+#   offset  size  field
+#   0       2     magic b'PH'
+#   2       1     format version
+#   3       1     reserved (0)
+#   4       8     latitude, float64
+#   12      8     longitude, float64
+#   20      2     sample count, uint16
+#   22      2     channel count, uint16
+#   24      ...   samples x channels float32, row-major, channels in features.CHANNELS order
+#
+# Every field is little-endian, matching the ESP32's native layout.
+CONTENT_TYPE = 'application/x-pothole-window'
+MAGIC = b'PH'
+VERSION = 1
+HEADER = struct.Struct('<2sBxddHH')
+
+
+# Edge-computed feature vector for /api/detect
+#
+#   offset  size  field
+#   0       2     magic b'PF'
+#   2       1     format version
+#   3       1     feature schema version (features.FEATURE_SCHEMA_VERSION)
+#   4       8     latitude, float64
+#   12      8     longitude, float64
+#   20      2     feature count, uint16
+#   22      2     audit sample count, uint16 (0 when no raw window follows)
+#   24      ...   features float32, in extract_features_batch layout
+#   ...     ...   optional audit window, samples x 12 float32 as above
+FEATURES_CONTENT_TYPE = 'application/x-pothole-features'
+FEATURES_MAGIC = b'PF'
+FEATURES_HEADER = struct.Struct('<2sBBddHH')
+
+
+def check_position(lat, lng):
+    """(lat, lng) as floats; raises ValueError unless both are finite and in range"""
+    try:
+        lat, lng = float(lat), float(lng)
+    except (TypeError, ValueError):
+        raise ValueError("latitude and longitude must be numbers") from None
+    if not (math.isfinite(lat) and math.isfinite(lng)):
+        raise ValueError("latitude and longitude must be finite")
+    if not (-90.0 <= lat <= 90.0 and -180.0 <= lng <= 180.0):
+        raise ValueError("latitude or longitude out of range")
+    return lat, lng
+
+
+def encode_window(lat, lng, window):
+    """Pack a (samples, 12) array into the binary payload"""
+    window = np.ascontiguousarray(window, dtype='<f4')
+    n_samples, n_channels = window.shape
+    return HEADER.pack(MAGIC, VERSION, lat, lng, n_samples, n_channels) + window.tobytes()
+
+
+def decode_window(payload):
+    """Parse a binary payload into (lat, lng, window) without copying the samples.
+
+    The returned window is a read-only (samples, channels) float32 view over
+    the payload buffer. Raises ValueError for anything malformed.
+    """
+    if len(payload) < HEADER.size:
+        raise ValueError("Payload shorter than header")
+    magic, version, lat, lng, n_samples, n_channels = HEADER.unpack_from(payload)
+    if magic != MAGIC:
+        raise ValueError("Bad payload magic")
+    if version != VERSION:
+        raise ValueError(f"Unsupported payload version {version}")
+    if n_channels != len(CHANNELS):
+        raise ValueError(f"Expected {len(CHANNELS)} channels, got {n_channels}")
+    if n_samples == 0:
+        raise ValueError("Window has no samples")
+    lat, lng = check_position(lat, lng)
+    expected = HEADER.size + n_samples * n_channels * 4
+    if len(payload) != expected:
+        raise ValueError(f"Payload is {len(payload)} bytes, header implies {expected}")
+
+    window = np.frombuffer(payload, dtype='<f4', count=n_samples * n_channels, offset=HEADER.size)
+    return lat, lng, window.reshape(n_samples, n_channels)
+
+
+def encode_features(lat, lng, features, window=None, schema=FEATURE_SCHEMA_VERSION):
+    """Pack a feature vector, optionally followed by the raw window it came from"""
+    features = np.ascontiguousarray(features, dtype='<f4').reshape(-1)
+    body = features.tobytes()
+    n_samples = 0
+    if window is not None:
+        window = np.ascontiguousarray(window, dtype='<f4')
+        n_samples = window.shape[0]
+        body += window.tobytes()
+    return FEATURES_HEADER.pack(FEATURES_MAGIC, VERSION, schema, lat, lng, features.size, n_samples) + body
+
+
+def decode_features(payload):
+    """Parse a feature payload into (lat, lng, features, window).
+
+    features is a read-only float32 view of length NUM_FEATURES; window is the
+    (samples, 12) audit window, or None when the device did not attach one.
+    Raises ValueError for anything malformed or for another feature schema.
+    """
+    if len(payload) < FEATURES_HEADER.size:
+        raise ValueError("Payload shorter than header")
+    magic, version, schema, lat, lng, n_features, n_samples = FEATURES_HEADER.unpack_from(payload)
+    if magic != FEATURES_MAGIC:
+        raise ValueError("Bad payload magic")
+    if version != VERSION:
+        raise ValueError(f"Unsupported payload version {version}")
+    if schema != FEATURE_SCHEMA_VERSION:
+        raise ValueError(f"Feature schema {schema} does not match the server's {FEATURE_SCHEMA_VERSION}")
+    if n_features != NUM_FEATURES:
+        raise ValueError(f"Expected {NUM_FEATURES} features, got {n_features}")
+    lat, lng = check_position(lat, lng)
+    expected = FEATURES_HEADER.size + (n_features + n_samples * len(CHANNELS)) * 4
+    if len(payload) != expected:
+        raise ValueError(f"Payload is {len(payload)} bytes, header implies {expected}")
+
+    features = np.frombuffer(payload, dtype='<f4', count=n_features, offset=FEATURES_HEADER.size)
+    window = None
+    if n_samples:
+        window = np.frombuffer(payload, dtype='<f4', count=n_samples * len(CHANNELS),
+                               offset=FEATURES_HEADER.size + n_features * 4).reshape(n_samples, len(CHANNELS))
+    return lat, lng, features, window
+
+
+if __name__ == "__main__":
+    from features import extract_features_batch, samples_to_array
+
+    rng = np.random.default_rng(0)
+    window = rng.standard_normal((50, len(CHANNELS))).astype(np.float32)
+    lat, lng = 13.0827, 80.2707
+
+    json_body = json.dumps({
+        'accelerometer_data': [dict(zip(CHANNELS, map(float, row))) for row in window],
+        'latitude': lat,
+        'longitude': lng,
+    }).encode()
+    binary_body = encode_window(lat, lng, window)
+    features_body = encode_features(lat, lng, extract_features_batch(window)[0])
+
+    repeats = 2000
+    start = time.perf_counter()
+    for _ in range(repeats):
+        data = json.loads(json_body)
+        samples_to_array(data['accelerometer_data'])
+    json_time = (time.perf_counter() - start) / repeats
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        decode_window(binary_body)
+    binary_time = (time.perf_counter() - start) / repeats
+
+    # What the server does per report: parse, plus feature extraction unless the device sent features
+    start = time.perf_counter()
+    for _ in range(repeats):
+        extract_features_batch(decode_window(binary_body)[2])
+    window_total = (time.perf_counter() - start) / repeats
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        decode_features(features_body)
+    features_time = (time.perf_counter() - start) / repeats
+
+    print(f"{'format':>8} {'bytes':>8} {'parse_us':>10} {'to_features_us':>15}")
+    print(f"{'json':>8} {len(json_body):>8} {json_time * 1e6:>10.1f} {'':>15}")
+    print(f"{'binary':>8} {len(binary_body):>8} {binary_time * 1e6:>10.1f} {window_total * 1e6:>15.1f}")
+    print(f"{'features':>8} {len(features_body):>8} {features_time * 1e6:>10.1f} {features_time * 1e6:>15.1f}")